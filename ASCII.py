@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageStat
 import math
 import traceback
 import time
 import configparser # 导入配置解析器
-import concurrent.futures # 用于并行处理
-import multiprocessing # 获取 CPU 核心数
-import shutil # 用于文件复制
+import signal # 监视/服务模式下工作进程忽略 Ctrl+C
+import io # 服务模式在内存中解码和编码图像
+import operator # 批量取样 (itemgetter)
+import functools # 性能分析时包装任务函数
+import hashlib # 批处理时识别内容相同的输入
+import collections
+import logging # 分级日志
+import argparse # 命令行参数
+import log_utils # 日志配置与进度行
+import dithering # 字符网格有序抖动
+import tone_mapping # 字符网格上的自适应色调映射
+import folder_watch # 热文件夹监视 (--watch)
+import archive_io # zip / tar 归档输入
+# concurrent.futures、shutil、profiling (cProfile/pstats) 和 ascii_service (http.server) 在用到时才导入，
+# 单个图像的转换不必为并行处理、性能分析和服务模式付出启动时间
+
+logger = logging.getLogger("ascii")
 
 # --- 默认配置 (如果 config.ini 不存在或无效则使用) ---
 DEFAULT_OUTPUT_WIDTH_CHARS = 128 # 默认 ASCII 表示宽度
@@ -19,6 +33,60 @@ DEFAULT_THEMES_TO_GENERATE = ["light"] # <-- 新增：默认生成的主题列
 ASCII_CHARS = "@%#*+=-:. " # 假设@最暗, ' ' 最亮
 # ASCII_CHARS = " .:-=+*#%@" # 反转后，需要调整映射或接受 ' ' 代表最暗
 
+# --- 字符梯度 (ramp) 与查找表 ---
+# 灰度 = (R+G+B)/3，因此查找表按 R+G+B 之和 (0..765) 索引，结果与逐格计算 floor((gray/256)*N) 完全一致，
+# 每个字符格只需一次查表，梯度长度 (10 级或 70 级以上) 不影响每格的开销。
+CHAR_LUT_SIZE = 766
+AUTO_RAMP_KEYWORD = "auto" # config.ini 中 CHAR_RAMP = auto 表示按字体实测墨量自动生成
+DEFAULT_AUTO_RAMP_LEVELS = 70
+AUTO_RAMP_CANDIDATES = "".join(chr(code) for code in range(32, 127)) # 可打印 ASCII 字符 (含空格)
+
+# --- 边缘方向字符模式 ---
+# 在字符网格分辨率上做 Sobel 卷积 (Pillow 的 C 实现)，梯度幅值超过阈值的字符格改用方向字符
+# (| / - \ _)，其他字符格仍使用亮度梯度。幅值单位为 Sobel 响应 / 8 (约 0~180)。
+DEFAULT_EDGE_THRESHOLD = 32
+SOBEL_KERNEL_SCALE = 8 # 把 Sobel 响应 (±1020) 压缩到 8 位图像的 ±127
+SOBEL_X_KERNEL = ImageFilter.Kernel((3, 3), [-1, 0, 1, -2, 0, 2, -1, 0, 1], scale=SOBEL_KERNEL_SCALE, offset=128)
+# Pillow 的 Kernel 按行倒序应用 (上下翻转)，因此 Y 方向核写成翻转后的形式，使正值表示下方更亮
+SOBEL_Y_KERNEL = ImageFilter.Kernel((3, 3), [1, 2, 1, 0, 0, 0, -1, -2, -1], scale=SOBEL_KERNEL_SCALE, offset=128)
+_edge_lut_cache = {} # {阈值: 按 (gx << 8) | gy 索引的方向字符表 ('' 表示不是边缘)}
+
+try:
+    BOX = Image.Resampling.BOX # Pillow >= 9.0.0
+except AttributeError:
+    BOX = Image.BOX # 兼容旧版 Pillow
+
+# 每个进程缓存的字符墨量 {(字体路径, 字号, 字符集): {字符: 覆盖率}}
+_glyph_coverage_cache = {}
+_default_char_lut = None
+# 每个进程缓存的字体对象 {font_info 键: 字体}，避免每张图像重复加载字体文件
+_worker_font_cache = {}
+
+# 服务模式 (--serve) 默认值
+DEFAULT_SERVICE_ADDRESS = "127.0.0.1:8765"
+DEFAULT_PIPELINE_IO_THREADS = 2 # 流水线模式的读取线程数和写入线程数
+DEFAULT_PIPELINE_QUEUE_SIZE = 8 # 流水线模式每个阶段队列中最多缓存的图像数
+OUTPUT_ARCHIVE_FORMATS = ('zip', 'tar') # --output-archive / [Batch] OUTPUT_ARCHIVE 可选的归档格式
+DEFAULT_METRICS_INTERVAL_SECONDS = 10.0 # --metrics-file 指标文件的写入间隔 (秒)
+DEFAULT_VERIFY_SAMPLE_SIZE = 8 # --verify 从目录中抽取的图像数
+DEFAULT_SERVICE_QUEUE_SIZE = 16 # 工作进程都忙时最多再排队的请求数
+DEFAULT_SERVICE_MAX_UPLOAD_MB = 50
+
+CHAR_ASPECT_RATIO_CORRECTION = 0.5 # 字符网格高度 = 宽度 * 图像高宽比 * 此系数 (字符约为 1:2 的竖长方形)
+
+# 目录批处理的调度: 只读图像头估算成本，大任务先提交，小图像打包成多图任务
+SCHEDULE_CELL_COST = 1000 # 每个主题渲染一个字符格的成本，相对于解码一个源像素 (实测约 35µs 对 35ns)
+SCHEDULE_BATCH_TARGET_COST = 6000000 # 打包任务的目标成本 (约 0.2 秒)，低于它的图像视为小图像
+SCHEDULE_MIN_TASKS_PER_WORKER = 4 # 打包后每个工作进程至少分到的任务数 (保证负载均衡)
+SCHEDULE_MAX_BATCH_IMAGES = 64
+DEDUPE_HASH_CHUNK_SIZE = 1024 * 1024 # 计算文件哈希时每次读取的字节数
+PYRAMID_MIN_SCALE = 2 # 分辨率金字塔中选用的层级宽度至少为字符网格宽度的这个倍数
+# 内存估算 (按 3000x2000 图像在 128-1024 宽度下的实测峰值校准)
+MEMORY_BYTES_PER_PIXEL = 4 # Pillow 的 RGB 图像每像素占 4 字节
+MEMORY_BYTES_PER_CELL = 100 # 每个字符格的 Python 字符/颜色元组
+MEMORY_WORKER_BASE_BYTES = 32 * 1024 * 1024 # 工作进程本身 (解释器、Pillow、字体)
+MEMORY_BUDGET_AUTO_FRACTION = 0.5 # MEMORY_BUDGET_MB = auto 时使用的物理内存比例
+
 RESIZE_OUTPUT = True # 设置为 True 以将输出 PNG 调整为原始宽高比
 SUPPORTED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp')
 
@@ -35,83 +103,117 @@ COLOR_THEMES = {
 # --- 全局 THEMES_TO_GENERATE 列表已被移除 ---
 # 现在从 config.ini 加载
 
-# --- 配置加载函数 (已修改) ---
-def load_config(config_filepath):
-    """
-    从指定的路径加载配置。
-    如果文件不存在、键缺失或值无效，则使用默认值。
-    返回包含配置值的字典。
-    """
-    # --- 默认值 ---
-    config_values = {
+# --- 默认配置字典 ---
+def _default_config_values():
+    """返回一份新的默认配置字典 (每次调用都是独立副本)。"""
+    return {
         "output_width_chars": DEFAULT_OUTPUT_WIDTH_CHARS,
+        "output_widths": [DEFAULT_OUTPUT_WIDTH_CHARS], # 要生成的全部宽度 (从小到大)
         "font_filename": DEFAULT_FONT_FILENAME,
         "font_size": DEFAULT_FONT_SIZE,
         "enable_filter": False,
         "filter_type": "gaussian",
         "filter_gaussian_radius": 1.0,
         "filter_median_size": 3,
-        "themes_to_generate": list(DEFAULT_THEMES_TO_GENERATE) # <-- 新增: 主题列表默认值 (使用副本)
+        "themes_to_generate": list(DEFAULT_THEMES_TO_GENERATE), # 主题列表默认值 (使用副本)
+        "enable_profiling": False,
+        "char_ramp": "", # 空字符串表示使用内置的 ASCII_CHARS
+        "auto_ramp_levels": DEFAULT_AUTO_RAMP_LEVELS,
+        "enable_edges": False,
+        "edge_threshold": DEFAULT_EDGE_THRESHOLD,
+        "dither_mode": "none",
+        "tone_mode": "none",
+        "tone_clip_percent": tone_mapping.DEFAULT_CLIP_PERCENT,
+        "tone_clahe_tiles": tone_mapping.DEFAULT_CLAHE_TILES,
+        "tone_clahe_clip_limit": tone_mapping.DEFAULT_CLAHE_CLIP_LIMIT,
+        "watch_debounce_seconds": folder_watch.DEFAULT_DEBOUNCE_SECONDS,
+        "watch_poll_interval": folder_watch.DEFAULT_POLL_INTERVAL,
+        "dedupe_inputs": True,
+        "enable_pipeline": False,
+        "pipeline_io_threads": DEFAULT_PIPELINE_IO_THREADS,
+        "pipeline_queue_size": DEFAULT_PIPELINE_QUEUE_SIZE,
+        "memory_budget_mb": "auto", # 'auto'、0 (不限制) 或 MB 数
+        "output_archive": None, # None (写入目录)、'zip' 或 'tar'
+        "metrics_textfile": "", # 空字符串表示不导出指标
+        "metrics_interval_seconds": DEFAULT_METRICS_INTERVAL_SECONDS,
+        "verify_pixel_tolerance": 0,
+        "verify_sample_size": DEFAULT_VERIFY_SAMPLE_SIZE,
+        "service_address": DEFAULT_SERVICE_ADDRESS,
+        "service_queue_size": DEFAULT_SERVICE_QUEUE_SIZE,
+        "service_max_upload_mb": DEFAULT_SERVICE_MAX_UPLOAD_MB,
     }
-    print(f"尝试从以下路径加载配置文件: {config_filepath}")
+
+# --- 配置加载函数 (已修改) ---
+def load_config(config_filepath):
+    """
+    从指定的路径加载配置。
+    如果文件不存在、键缺失或值无效，则使用默认值。
+    返回包含配置值的字典。
+    """
+    # --- 默认值 ---
+    config_values = _default_config_values()
+    logger.debug(f"尝试从以下路径加载配置文件: {config_filepath}")
     if not os.path.exists(config_filepath):
-        print("未找到 config.ini。将使用默认设置。")
+        logger.info("未找到 config.ini。将使用默认设置。")
         # 打印所有默认值
-        print(f"  默认 OUTPUT_WIDTH_CHARS = {config_values['output_width_chars']}")
-        print(f"  默认 FONT_FILENAME = {config_values['font_filename']}")
-        print(f"  默认 FONT_SIZE = {config_values['font_size']}")
-        print(f"  默认 ENABLE_FILTER = {config_values['enable_filter']}")
-        print(f"  默认 FILTER_TYPE = {config_values['filter_type']}")
-        print(f"  默认 FILTER_GAUSSIAN_RADIUS = {config_values['filter_gaussian_radius']}")
-        print(f"  默认 FILTER_MEDIAN_SIZE = {config_values['filter_median_size']}")
-        print(f"  默认 THEMES_TO_GENERATE = {config_values['themes_to_generate']}") # <-- 新增
+        logger.debug(f"默认 OUTPUT_WIDTH_CHARS = {config_values['output_width_chars']}")
+        logger.debug(f"默认 FONT_FILENAME = {config_values['font_filename']}")
+        logger.debug(f"默认 FONT_SIZE = {config_values['font_size']}")
+        logger.debug(f"默认 ENABLE_FILTER = {config_values['enable_filter']}")
+        logger.debug(f"默认 FILTER_TYPE = {config_values['filter_type']}")
+        logger.debug(f"默认 FILTER_GAUSSIAN_RADIUS = {config_values['filter_gaussian_radius']}")
+        logger.debug(f"默认 FILTER_MEDIAN_SIZE = {config_values['filter_median_size']}")
+        logger.debug(f"默认 THEMES_TO_GENERATE = {config_values['themes_to_generate']}") # <-- 新增
+        logger.debug(f"默认 ENABLE_PROFILING = {config_values['enable_profiling']}")
+        logger.debug(f"默认 CHAR_RAMP = '{config_values['char_ramp'] or ASCII_CHARS}'")
+        logger.debug(f"默认 ENABLE_EDGES = {config_values['enable_edges']}")
+        logger.debug(f"默认 DITHER_MODE = {config_values['dither_mode']}")
         return config_values
 
     parser = configparser.ConfigParser(allow_no_value=True, inline_comment_prefixes=('#', ';'))
     try:
         parser.read(config_filepath, encoding='utf-8')
-        print("已找到 config.ini。正在加载设置...")
+        logger.debug("已找到 config.ini。正在加载设置...")
 
         # --- 加载 [Settings] 部分 ---
         if 'Settings' in parser:
             settings_section = parser['Settings']
             # (加载 OUTPUT_WIDTH_CHARS, FONT_FILENAME, FONT_SIZE 的代码保持不变)
-            # 加载 OUTPUT_WIDTH_CHARS
-            try:
-                loaded_width = settings_section.getint('OUTPUT_WIDTH_CHARS', fallback=config_values['output_width_chars'])
-                if loaded_width > 0:
-                    config_values["output_width_chars"] = loaded_width
-                    print(f"  已加载 OUTPUT_WIDTH_CHARS = {config_values['output_width_chars']}")
-                else:
-                    print(f"  警告: config.ini 中的 OUTPUT_WIDTH_CHARS 值 ({loaded_width}) 无效 (必须 > 0)。使用默认值 {config_values['output_width_chars']}。")
-            except ValueError:
-                print(f"  警告: config.ini 中的 OUTPUT_WIDTH_CHARS 值不是有效的整数。使用默认值 {config_values['output_width_chars']}。")
-            except KeyError:
-                print(f"  信息: config.ini 中未找到 OUTPUT_WIDTH_CHARS。使用默认值 {config_values['output_width_chars']}。")
+            # 加载 OUTPUT_WIDTH_CHARS (单个宽度，或逗号分隔的多个宽度)
+            loaded_widths = settings_section.get('OUTPUT_WIDTH_CHARS', fallback=None)
+            if loaded_widths is None:
+                logger.debug(f"config.ini 中未找到 OUTPUT_WIDTH_CHARS。使用默认值 {config_values['output_width_chars']}。")
+            else:
+                try:
+                    config_values["output_widths"] = parse_width_list(loaded_widths)
+                    config_values["output_width_chars"] = config_values["output_widths"][0]
+                    logger.debug(f"已加载 OUTPUT_WIDTH_CHARS = {config_values['output_widths']}")
+                except ValueError as e:
+                    logger.warning(f"config.ini 中的 OUTPUT_WIDTH_CHARS 值无效 ({e})。使用默认值 {config_values['output_width_chars']}。")
 
             # 加载 FONT_FILENAME (字符串)
             try:
                 loaded_filename = settings_section.get('FONT_FILENAME', fallback=config_values['font_filename']).strip()
                 if loaded_filename:
                     config_values["font_filename"] = loaded_filename
-                    print(f"  已加载 FONT_FILENAME = {config_values['font_filename']}")
+                    logger.debug(f"已加载 FONT_FILENAME = {config_values['font_filename']}")
                 else:
-                    print(f"  警告: config.ini 中的 FONT_FILENAME 为空。使用默认值 {config_values['font_filename']}。")
+                    logger.warning(f"config.ini 中的 FONT_FILENAME 为空。使用默认值 {config_values['font_filename']}。")
             except KeyError:
-                print(f"  信息: config.ini 中未找到 FONT_FILENAME。使用默认值 {config_values['font_filename']}。")
+                logger.debug(f"config.ini 中未找到 FONT_FILENAME。使用默认值 {config_values['font_filename']}。")
 
             # 加载 FONT_SIZE
             try:
                 loaded_size = settings_section.getint('FONT_SIZE', fallback=config_values['font_size'])
                 if loaded_size > 0:
                     config_values["font_size"] = loaded_size
-                    print(f"  已加载 FONT_SIZE = {config_values['font_size']}")
+                    logger.debug(f"已加载 FONT_SIZE = {config_values['font_size']}")
                 else:
-                    print(f"  警告: config.ini 中的 FONT_SIZE 值 ({loaded_size}) 无效 (必须 > 0)。使用默认值 {config_values['font_size']}。")
+                    logger.warning(f"config.ini 中的 FONT_SIZE 值 ({loaded_size}) 无效 (必须 > 0)。使用默认值 {config_values['font_size']}。")
             except ValueError:
-                print(f"  警告: config.ini 中的 FONT_SIZE 值不是有效的整数。使用默认值 {config_values['font_size']}。")
+                logger.warning(f"config.ini 中的 FONT_SIZE 值不是有效的整数。使用默认值 {config_values['font_size']}。")
             except KeyError:
-                print(f"  信息: config.ini 中未找到 FONT_SIZE。使用默认值 {config_values['font_size']}。")
+                logger.debug(f"config.ini 中未找到 FONT_SIZE。使用默认值 {config_values['font_size']}。")
 
             # --- 新增：加载 THEMES_TO_GENERATE ---
             try:
@@ -133,126 +235,518 @@ def load_config(config_filepath):
 
                         if valid_themes:
                             config_values["themes_to_generate"] = valid_themes
-                            print(f"  已加载 THEMES_TO_GENERATE = {config_values['themes_to_generate']}")
+                            logger.debug(f"已加载 THEMES_TO_GENERATE = {config_values['themes_to_generate']}")
                             if invalid_themes:
-                                print(f"  警告: 在 config.ini 中发现无效的主题名称: {invalid_themes}。这些主题将被忽略。")
+                                logger.warning(f"在 config.ini 中发现无效的主题名称: {invalid_themes}。这些主题将被忽略。")
                         else:
-                            print(f"  警告: config.ini 中的 THEMES_TO_GENERATE ('{themes_str}') 不包含任何有效的主题名称。使用默认值 {config_values['themes_to_generate']}。")
+                            logger.warning(f"config.ini 中的 THEMES_TO_GENERATE ('{themes_str}') 不包含任何有效的主题名称。使用默认值 {config_values['themes_to_generate']}。")
                             # 保持默认值不变
                     else:
-                        print(f"  警告: config.ini 中的 THEMES_TO_GENERATE 值为空或只包含逗号/空格。使用默认值 {config_values['themes_to_generate']}。")
+                        logger.warning(f"config.ini 中的 THEMES_TO_GENERATE 值为空或只包含逗号/空格。使用默认值 {config_values['themes_to_generate']}。")
                         # 保持默认值不变
                 else:
                     # fallback 为 None 表示键不存在
-                    print(f"  信息: config.ini 中未找到 THEMES_TO_GENERATE。使用默认值 {config_values['themes_to_generate']}。")
+                    logger.debug(f"config.ini 中未找到 THEMES_TO_GENERATE。使用默认值 {config_values['themes_to_generate']}。")
                     # 保持默认值不变
             except KeyError: # 虽然 get 有 fallback，但以防万一
-                 print(f"  信息: config.ini 中未找到 THEMES_TO_GENERATE。使用默认值 {config_values['themes_to_generate']}。")
+                 logger.debug(f"config.ini 中未找到 THEMES_TO_GENERATE。使用默认值 {config_values['themes_to_generate']}。")
                  # 保持默认值不变
             except Exception as e_theme: # 捕获其他可能的解析错误
-                print(f"  错误: 读取或解析 THEMES_TO_GENERATE 时出错: {e_theme}。使用默认值 {config_values['themes_to_generate']}。")
+                logger.error(f"读取或解析 THEMES_TO_GENERATE 时出错: {e_theme}。使用默认值 {config_values['themes_to_generate']}。")
                 # 保持默认值不变
 
+            # 加载 CHAR_RAMP (字符串；用双引号包裹以保留首尾空格)
+            loaded_ramp = settings_section.get('CHAR_RAMP', fallback='')
+            if loaded_ramp:
+                if len(loaded_ramp) >= 2 and loaded_ramp[0] == loaded_ramp[-1] == '"':
+                    loaded_ramp = loaded_ramp[1:-1]
+                if loaded_ramp.strip().lower() == AUTO_RAMP_KEYWORD:
+                    loaded_ramp = AUTO_RAMP_KEYWORD
+                if len(loaded_ramp) >= 2 or loaded_ramp == AUTO_RAMP_KEYWORD:
+                    config_values['char_ramp'] = loaded_ramp
+                    logger.debug(f"已加载 CHAR_RAMP = '{config_values['char_ramp']}'")
+                else:
+                    logger.warning(f"config.ini 中的 CHAR_RAMP ('{loaded_ramp}') 至少需要 2 个字符。使用默认梯度 '{ASCII_CHARS}'。")
+
+            # 加载 AUTO_RAMP_LEVELS
+            try:
+                loaded_levels = settings_section.getint('AUTO_RAMP_LEVELS', fallback=config_values['auto_ramp_levels'])
+                if loaded_levels >= 2:
+                    config_values['auto_ramp_levels'] = loaded_levels
+                    logger.debug(f"已加载 AUTO_RAMP_LEVELS = {config_values['auto_ramp_levels']}")
+                else:
+                    logger.warning(f"config.ini 中的 AUTO_RAMP_LEVELS 值 ({loaded_levels}) 无效 (必须 >= 2)。使用默认值 {config_values['auto_ramp_levels']}。")
+            except ValueError:
+                logger.warning(f"config.ini 中的 AUTO_RAMP_LEVELS 值不是有效的整数。使用默认值 {config_values['auto_ramp_levels']}。")
+
         else:
-            print("警告: 在 config.ini 中未找到 [Settings] 部分。将使用所有默认设置。")
+            logger.warning("在 config.ini 中未找到 [Settings] 部分。将使用所有默认设置。")
             # 默认值已在 config_values 中设置好
 
         # --- 加载 [Filter] 部分 (代码不变) ---
         if 'Filter' in parser:
             filter_section = parser['Filter']
-            print("  正在加载 [Filter] 设置...")
+            logger.debug("正在加载 [Filter] 设置...")
             # ... (加载 ENABLE_FILTER, FILTER_TYPE, FILTER_GAUSSIAN_RADIUS, FILTER_MEDIAN_SIZE 的代码保持不变) ...
             # 加载 ENABLE_FILTER
             try:
                 config_values['enable_filter'] = filter_section.getboolean('ENABLE_FILTER', fallback=config_values['enable_filter'])
-                print(f"    已加载 ENABLE_FILTER = {config_values['enable_filter']}")
+                logger.debug(f"已加载 ENABLE_FILTER = {config_values['enable_filter']}")
             except ValueError:
-                print(f"    警告: config.ini 中的 ENABLE_FILTER 值不是有效的布尔值 (True/False)。使用默认值 {config_values['enable_filter']}。")
+                logger.warning(f"config.ini 中的 ENABLE_FILTER 值不是有效的布尔值 (True/False)。使用默认值 {config_values['enable_filter']}。")
             except KeyError:
-                 print(f"    信息: config.ini 中未找到 ENABLE_FILTER。使用默认值 {config_values['enable_filter']}。")
+                 logger.debug(f"config.ini 中未找到 ENABLE_FILTER。使用默认值 {config_values['enable_filter']}。")
 
             # 加载 FILTER_TYPE
             try:
                 loaded_type = filter_section.get('FILTER_TYPE', fallback=config_values['filter_type']).lower().strip()
                 if loaded_type in ['gaussian', 'median']:
                     config_values['filter_type'] = loaded_type
-                    print(f"    已加载 FILTER_TYPE = {config_values['filter_type']}")
+                    logger.debug(f"已加载 FILTER_TYPE = {config_values['filter_type']}")
                 else:
-                    print(f"    警告: config.ini 中的 FILTER_TYPE 值 '{loaded_type}' 无效 (应为 'gaussian' 或 'median')。使用默认值 '{config_values['filter_type']}'。")
+                    logger.warning(f"config.ini 中的 FILTER_TYPE 值 '{loaded_type}' 无效 (应为 'gaussian' 或 'median')。使用默认值 '{config_values['filter_type']}'。")
             except KeyError:
-                print(f"    信息: config.ini 中未找到 FILTER_TYPE。使用默认值 '{config_values['filter_type']}'。")
+                logger.debug(f"config.ini 中未找到 FILTER_TYPE。使用默认值 '{config_values['filter_type']}'。")
 
             # 加载 FILTER_GAUSSIAN_RADIUS
             try:
                 loaded_radius = filter_section.getfloat('FILTER_GAUSSIAN_RADIUS', fallback=config_values['filter_gaussian_radius'])
                 if loaded_radius > 0:
                      config_values['filter_gaussian_radius'] = loaded_radius
-                     print(f"    已加载 FILTER_GAUSSIAN_RADIUS = {config_values['filter_gaussian_radius']}")
+                     logger.debug(f"已加载 FILTER_GAUSSIAN_RADIUS = {config_values['filter_gaussian_radius']}")
                 else:
-                     print(f"    警告: config.ini 中的 FILTER_GAUSSIAN_RADIUS 值 ({loaded_radius}) 无效 (必须 > 0)。使用默认值 {config_values['filter_gaussian_radius']}。")
+                     logger.warning(f"config.ini 中的 FILTER_GAUSSIAN_RADIUS 值 ({loaded_radius}) 无效 (必须 > 0)。使用默认值 {config_values['filter_gaussian_radius']}。")
             except ValueError:
-                print(f"    警告: config.ini 中的 FILTER_GAUSSIAN_RADIUS 值不是有效的浮点数。使用默认值 {config_values['filter_gaussian_radius']}。")
+                logger.warning(f"config.ini 中的 FILTER_GAUSSIAN_RADIUS 值不是有效的浮点数。使用默认值 {config_values['filter_gaussian_radius']}。")
             except KeyError:
-                print(f"    信息: config.ini 中未找到 FILTER_GAUSSIAN_RADIUS。使用默认值 {config_values['filter_gaussian_radius']}。")
+                logger.debug(f"config.ini 中未找到 FILTER_GAUSSIAN_RADIUS。使用默认值 {config_values['filter_gaussian_radius']}。")
 
             # 加载 FILTER_MEDIAN_SIZE
             try:
                 loaded_median_size = filter_section.getint('FILTER_MEDIAN_SIZE', fallback=config_values['filter_median_size'])
                 if loaded_median_size >= 3 and loaded_median_size % 2 != 0:
                     config_values['filter_median_size'] = loaded_median_size
-                    print(f"    已加载 FILTER_MEDIAN_SIZE = {config_values['filter_median_size']}")
+                    logger.debug(f"已加载 FILTER_MEDIAN_SIZE = {config_values['filter_median_size']}")
                 else:
-                    print(f"    警告: config.ini 中的 FILTER_MEDIAN_SIZE 值 ({loaded_median_size}) 无效 (必须是 >= 3 的奇数)。使用默认值 {config_values['filter_median_size']}。")
+                    logger.warning(f"config.ini 中的 FILTER_MEDIAN_SIZE 值 ({loaded_median_size}) 无效 (必须是 >= 3 的奇数)。使用默认值 {config_values['filter_median_size']}。")
             except ValueError:
-                print(f"    警告: config.ini 中的 FILTER_MEDIAN_SIZE 值不是有效的整数。使用默认值 {config_values['filter_median_size']}。")
+                logger.warning(f"config.ini 中的 FILTER_MEDIAN_SIZE 值不是有效的整数。使用默认值 {config_values['filter_median_size']}。")
             except KeyError:
-                print(f"    信息: config.ini 中未找到 FILTER_MEDIAN_SIZE。使用默认值 {config_values['filter_median_size']}。")
+                logger.debug(f"config.ini 中未找到 FILTER_MEDIAN_SIZE。使用默认值 {config_values['filter_median_size']}。")
         else:
-             print("信息: 在 config.ini 中未找到 [Filter] 部分。将使用默认滤波设置 (关闭)。")
+             logger.debug("在 config.ini 中未找到 [Filter] 部分。将使用默认滤波设置 (关闭)。")
              # 默认值已在 config_values 中设置好
 
+        # --- 加载 [Edges] 部分 ---
+        if 'Edges' in parser:
+            edges_section = parser['Edges']
+            try:
+                config_values['enable_edges'] = edges_section.getboolean('ENABLE_EDGES', fallback=config_values['enable_edges'])
+                logger.debug(f"已加载 ENABLE_EDGES = {config_values['enable_edges']}")
+            except ValueError:
+                logger.warning(f"config.ini 中的 ENABLE_EDGES 值不是有效的布尔值 (True/False)。使用默认值 {config_values['enable_edges']}。")
+            try:
+                loaded_threshold = edges_section.getfloat('EDGE_THRESHOLD', fallback=config_values['edge_threshold'])
+                if loaded_threshold > 0:
+                    config_values['edge_threshold'] = loaded_threshold
+                    logger.debug(f"已加载 EDGE_THRESHOLD = {config_values['edge_threshold']}")
+                else:
+                    logger.warning(f"config.ini 中的 EDGE_THRESHOLD 值 ({loaded_threshold}) 无效 (必须 > 0)。使用默认值 {config_values['edge_threshold']}。")
+            except ValueError:
+                logger.warning(f"config.ini 中的 EDGE_THRESHOLD 值不是有效的数字。使用默认值 {config_values['edge_threshold']}。")
+
+        # --- 加载 [Dither] 部分 ---
+        if 'Dither' in parser:
+            loaded_dither = parser['Dither'].get('DITHER_MODE', fallback=config_values['dither_mode']).strip().lower()
+            if loaded_dither in dithering.DITHER_MODES:
+                config_values['dither_mode'] = loaded_dither
+                logger.debug(f"已加载 DITHER_MODE = {config_values['dither_mode']}")
+            else:
+                logger.warning(f"config.ini 中的 DITHER_MODE 值 '{loaded_dither}' 无效 (可选: {', '.join(dithering.DITHER_MODES)})。使用默认值 '{config_values['dither_mode']}'。")
+
+        # --- 加载 [Tone] 部分 ---
+        if 'Tone' in parser:
+            tone_section = parser['Tone']
+            loaded_tone = tone_section.get('TONE_MAP', fallback=config_values['tone_mode']).strip().lower()
+            if loaded_tone in tone_mapping.TONE_MODES:
+                config_values['tone_mode'] = loaded_tone
+                logger.debug(f"已加载 TONE_MAP = {config_values['tone_mode']}")
+            else:
+                logger.warning(f"config.ini 中的 TONE_MAP 值 '{loaded_tone}' 无效 (可选: {', '.join(tone_mapping.TONE_MODES)})。使用默认值 '{config_values['tone_mode']}'。")
+            for key, option, minimum, maximum in (('tone_clip_percent', 'CLIP_PERCENT', 0.0, 49.0),
+                                                  ('tone_clahe_clip_limit', 'CLAHE_CLIP_LIMIT', 1.0, None)):
+                try:
+                    loaded_value = tone_section.getfloat(option, fallback=config_values[key])
+                    if loaded_value >= minimum and (maximum is None or loaded_value <= maximum):
+                        config_values[key] = loaded_value
+                        logger.debug(f"已加载 {option} = {config_values[key]}")
+                    else:
+                        logger.warning(f"config.ini 中的 {option} 值 ({loaded_value}) 超出范围。使用默认值 {config_values[key]}。")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 {option} 值不是有效的数字。使用默认值 {config_values[key]}。")
+            try:
+                loaded_tiles = tone_section.getint('CLAHE_TILES', fallback=config_values['tone_clahe_tiles'])
+                if loaded_tiles >= 1:
+                    config_values['tone_clahe_tiles'] = loaded_tiles
+                    logger.debug(f"已加载 CLAHE_TILES = {config_values['tone_clahe_tiles']}")
+                else:
+                    logger.warning(f"config.ini 中的 CLAHE_TILES 值 ({loaded_tiles}) 无效 (必须 >= 1)。使用默认值 {config_values['tone_clahe_tiles']}。")
+            except ValueError:
+                logger.warning(f"config.ini 中的 CLAHE_TILES 值不是有效的整数。使用默认值 {config_values['tone_clahe_tiles']}。")
+
+        # --- 加载 [Batch] 部分 ---
+        if 'Batch' in parser:
+            try:
+                config_values['dedupe_inputs'] = parser['Batch'].getboolean('DEDUPE_INPUTS', fallback=config_values['dedupe_inputs'])
+                logger.debug(f"已加载 DEDUPE_INPUTS = {config_values['dedupe_inputs']}")
+            except ValueError:
+                logger.warning(f"config.ini 中的 DEDUPE_INPUTS 值不是有效的布尔值 (True/False)。使用默认值 {config_values['dedupe_inputs']}。")
+            try:
+                config_values['enable_pipeline'] = parser['Batch'].getboolean('PIPELINE', fallback=config_values['enable_pipeline'])
+                logger.debug(f"已加载 PIPELINE = {config_values['enable_pipeline']}")
+            except ValueError:
+                logger.warning(f"config.ini 中的 PIPELINE 值不是有效的布尔值 (True/False)。使用默认值 {config_values['enable_pipeline']}。")
+            loaded_budget = parser['Batch'].get('MEMORY_BUDGET_MB', fallback=str(config_values['memory_budget_mb'])).strip().lower()
+            if loaded_budget == 'auto':
+                config_values['memory_budget_mb'] = 'auto'
+            else:
+                try:
+                    if int(loaded_budget) < 0:
+                        raise ValueError(loaded_budget)
+                    config_values['memory_budget_mb'] = int(loaded_budget)
+                    logger.debug(f"已加载 MEMORY_BUDGET_MB = {config_values['memory_budget_mb']}")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 MEMORY_BUDGET_MB 值 ('{loaded_budget}') 无效 (应为 auto、0 或正整数)。使用默认值 {config_values['memory_budget_mb']}。")
+            loaded_archive = parser['Batch'].get('OUTPUT_ARCHIVE', fallback='none').strip().lower()
+            if loaded_archive in OUTPUT_ARCHIVE_FORMATS:
+                config_values['output_archive'] = loaded_archive
+                logger.debug(f"已加载 OUTPUT_ARCHIVE = {loaded_archive}")
+            elif loaded_archive != 'none':
+                logger.warning(f"config.ini 中的 OUTPUT_ARCHIVE 值 ('{loaded_archive}') 无效 (可选: none, {', '.join(OUTPUT_ARCHIVE_FORMATS)})。输出写入目录。")
+            for key, option in (('pipeline_io_threads', 'PIPELINE_IO_THREADS'), ('pipeline_queue_size', 'PIPELINE_QUEUE_SIZE')):
+                try:
+                    loaded_value = parser['Batch'].getint(option, fallback=config_values[key])
+                    if loaded_value >= 1:
+                        config_values[key] = loaded_value
+                        logger.debug(f"已加载 {option} = {config_values[key]}")
+                    else:
+                        logger.warning(f"config.ini 中的 {option} 值 ({loaded_value}) 无效 (必须 >= 1)。使用默认值 {config_values[key]}。")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 {option} 值不是有效的整数。使用默认值 {config_values[key]}。")
+
+        # --- 加载 [Watch] 部分 ---
+        if 'Watch' in parser:
+            watch_section = parser['Watch']
+            for key, option in (('watch_debounce_seconds', 'DEBOUNCE_SECONDS'), ('watch_poll_interval', 'POLL_INTERVAL')):
+                try:
+                    loaded_seconds = watch_section.getfloat(option, fallback=config_values[key])
+                    if loaded_seconds > 0:
+                        config_values[key] = loaded_seconds
+                        logger.debug(f"已加载 {option} = {config_values[key]}")
+                    else:
+                        logger.warning(f"config.ini 中的 {option} 值 ({loaded_seconds}) 无效 (必须 > 0)。使用默认值 {config_values[key]}。")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 {option} 值不是有效的数字。使用默认值 {config_values[key]}。")
+
+        # --- 加载 [Metrics] 部分 ---
+        if 'Metrics' in parser:
+            metrics_section = parser['Metrics']
+            config_values['metrics_textfile'] = metrics_section.get('TEXTFILE', fallback=config_values['metrics_textfile']).strip()
+            logger.debug(f"已加载 TEXTFILE = '{config_values['metrics_textfile']}'")
+            try:
+                loaded_seconds = metrics_section.getfloat('INTERVAL_SECONDS', fallback=config_values['metrics_interval_seconds'])
+                if loaded_seconds > 0:
+                    config_values['metrics_interval_seconds'] = loaded_seconds
+                    logger.debug(f"已加载 INTERVAL_SECONDS = {config_values['metrics_interval_seconds']}")
+                else:
+                    logger.warning(f"config.ini 中的 INTERVAL_SECONDS 值 ({loaded_seconds}) 无效 (必须 > 0)。使用默认值 {config_values['metrics_interval_seconds']}。")
+            except ValueError:
+                logger.warning(f"config.ini 中的 INTERVAL_SECONDS 值不是有效的数字。使用默认值 {config_values['metrics_interval_seconds']}。")
+
+        # --- 加载 [Verify] 部分 ---
+        if 'Verify' in parser:
+            for key, option, minimum, maximum in (('verify_pixel_tolerance', 'PIXEL_TOLERANCE', 0, 255),
+                                                  ('verify_sample_size', 'SAMPLE_SIZE', 1, None)):
+                try:
+                    loaded_value = parser['Verify'].getint(option, fallback=config_values[key])
+                    if loaded_value >= minimum and (maximum is None or loaded_value <= maximum):
+                        config_values[key] = loaded_value
+                        logger.debug(f"已加载 {option} = {config_values[key]}")
+                    else:
+                        logger.warning(f"config.ini 中的 {option} 值 ({loaded_value}) 超出范围。使用默认值 {config_values[key]}。")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 {option} 值不是有效的整数。使用默认值 {config_values[key]}。")
+
+        # --- 加载 [Service] 部分 ---
+        if 'Service' in parser:
+            service_section = parser['Service']
+            loaded_address = service_section.get('ADDRESS', fallback=config_values['service_address']).strip()
+            if loaded_address:
+                config_values['service_address'] = loaded_address # 格式在启动服务时检查
+                logger.debug(f"已加载 ADDRESS = {config_values['service_address']}")
+            for key, option, minimum in (('service_queue_size', 'QUEUE_SIZE', 0), ('service_max_upload_mb', 'MAX_UPLOAD_MB', 1)):
+                try:
+                    loaded_value = service_section.getint(option, fallback=config_values[key])
+                    if loaded_value >= minimum:
+                        config_values[key] = loaded_value
+                        logger.debug(f"已加载 {option} = {config_values[key]}")
+                    else:
+                        logger.warning(f"config.ini 中的 {option} 值 ({loaded_value}) 无效 (必须 >= {minimum})。使用默认值 {config_values[key]}。")
+                except ValueError:
+                    logger.warning(f"config.ini 中的 {option} 值不是有效的整数。使用默认值 {config_values[key]}。")
+
+        # --- 加载 [Profiling] 部分 ---
+        if 'Profiling' in parser:
+            profiling_section = parser['Profiling']
+            try:
+                config_values['enable_profiling'] = profiling_section.getboolean('ENABLE_PROFILING', fallback=config_values['enable_profiling'])
+                logger.debug(f"已加载 ENABLE_PROFILING = {config_values['enable_profiling']}")
+            except ValueError:
+                logger.warning(f"config.ini 中的 ENABLE_PROFILING 值不是有效的布尔值 (True/False)。使用默认值 {config_values['enable_profiling']}。")
+
     except configparser.Error as e:
-        print(f"错误: 读取 config.ini 时出错: {e}。将使用所有默认设置。")
+        logger.error(f"读取 config.ini 时出错: {e}。将使用所有默认设置。")
         # 重置为所有默认值 (确保主题列表也是默认的)
-        config_values = {
-            "output_width_chars": DEFAULT_OUTPUT_WIDTH_CHARS,
-            "font_filename": DEFAULT_FONT_FILENAME,
-            "font_size": DEFAULT_FONT_SIZE,
-            "enable_filter": False,
-            "filter_type": "gaussian",
-            "filter_gaussian_radius": 1.0,
-            "filter_median_size": 3,
-            "themes_to_generate": list(DEFAULT_THEMES_TO_GENERATE) # 确保重置时也使用默认主题
-        }
+        config_values = _default_config_values()
     except Exception as e:
-        print(f"错误: 处理 config.ini 时发生意外错误: {e}。将使用所有默认设置。")
+        logger.error(f"处理 config.ini 时发生意外错误: {e}。将使用所有默认设置。")
         # 重置为所有默认值
-        config_values = {
-            "output_width_chars": DEFAULT_OUTPUT_WIDTH_CHARS,
-            "font_filename": DEFAULT_FONT_FILENAME,
-            "font_size": DEFAULT_FONT_SIZE,
-            "enable_filter": False,
-            "filter_type": "gaussian",
-            "filter_gaussian_radius": 1.0,
-            "filter_median_size": 3,
-            "themes_to_generate": list(DEFAULT_THEMES_TO_GENERATE)
-        }
+        config_values = _default_config_values()
 
-    print("配置加载完成。\n")
+    logger.debug("配置加载完成。")
     return config_values
 
+# --- 字符梯度与查找表 ---
+def build_char_lut(ramp, darkness=None):
+    """
+    构建按 R+G+B 之和 (0..765) 索引的字符查找表 (长度为 CHAR_LUT_SIZE 的字符串)。
+
+    ramp 按从最暗 (墨量最多) 到最亮排列。未提供 darkness 时使用与原逐格计算相同的
+    等分映射 floor((gray/256)*N)；提供 darkness (每个字符归一化后的墨量, 1=最暗, 0=最亮) 时，
+    每个灰度映射到墨量最接近 1 - gray/255 的字符。
+    """
+    num_chars = len(ramp)
+    if num_chars == 0:
+        raise ValueError("字符梯度不能为空。")
+    lut = []
+    for rgb_sum in range(CHAR_LUT_SIZE):
+        gray = rgb_sum / 3.0
+        if darkness is None:
+            index = max(0, min(math.floor((gray / 256.0) * num_chars), num_chars - 1))
+        else:
+            target = 1.0 - gray / 255.0
+            index = min(range(num_chars), key=lambda i: abs(darkness[i] - target))
+        lut.append(ramp[index])
+    return "".join(lut)
+
+def get_default_char_lut():
+    """内置 ASCII_CHARS 的查找表 (每个进程只构建一次)。"""
+    global _default_char_lut
+    if _default_char_lut is None:
+        _default_char_lut = build_char_lut(ASCII_CHARS)
+    return _default_char_lut
+
+def load_font_from_info(font_info):
+    """根据 main 验证过的 font_info 加载字体对象。"""
+    if font_info.get('type') == 'truetype':
+        return ImageFont.truetype(font_info['path'], font_info['size'])
+    return ImageFont.load_default()
+
+def _font_cache_key(font_info):
+    return tuple(sorted(font_info.items()))
+
+def cache_worker_font(font_info, font):
+    """把已经加载的字体放入当前进程的缓存 (main 验证字体时加载的对象可以直接复用)。"""
+    _worker_font_cache[_font_cache_key(font_info)] = font
+
+def get_worker_font(font_info):
+    """
+    返回当前进程缓存的字体对象 (每个进程每种字体只加载一次)。
+    加载失败时回退到默认字体；连默认字体都无法加载时返回 None (不缓存，下次重试)。
+    """
+    font_key = _font_cache_key(font_info)
+    font = _worker_font_cache.get(font_key)
+    if font is not None:
+        return font
+    try:
+        font_type = font_info.get('type')
+        if font_type not in ('truetype', 'default'):
+            logger.error(f"无效的 font_info 类型 '{font_type}'。回退到默认字体。")
+        font = load_font_from_info(font_info)
+    except Exception as e_load_worker:
+        logger.error(f"在工作进程中加载字体失败: {e_load_worker}。回退到默认字体。")
+        try:
+            font = ImageFont.load_default()
+        except Exception as e_load_default_worker:
+            logger.error(f"致命错误: 连默认字体都无法在工作进程中加载: {e_load_default_worker}")
+            return None
+    _worker_font_cache[font_key] = font
+    return font
+
+def measure_glyph_coverage(font, font_key, chars=AUTO_RAMP_CANDIDATES):
+    """
+    测量每个字符在给定字体中的墨量 (字符格内被覆盖的像素比例, 0..1)。
+    结果按 (字体, 字号, 字符集) 缓存，同一进程中只测量一次。
+    """
+    cache_key = (font_key, chars)
+    coverage = _glyph_coverage_cache.get(cache_key)
+    if coverage is not None:
+        return coverage
+
+    # 字符格: 宽度取 'M' 的步进宽度 (等宽字体)，高度与 create_ascii_png 的行高测量方式一致
+    cell_width = max(1, int(math.ceil(font.getlength('M')))) if hasattr(font, 'getlength') else 8
+    bbox = font.getbbox('|M_g(`', anchor='lt') if hasattr(font, 'getbbox') else (0, 0, cell_width, 12)
+    cell_height = max(1, bbox[3] - bbox[1])
+    coverage = {}
+    for char in chars:
+        cell = Image.new('L', (cell_width, cell_height), 0)
+        ImageDraw.Draw(cell).text((0, 0), char, font=font, fill=255, anchor='lt')
+        coverage[char] = ImageStat.Stat(cell).mean[0] / 255.0
+    _glyph_coverage_cache[cache_key] = coverage
+    return coverage
+
+def generate_auto_ramp(coverage, levels=DEFAULT_AUTO_RAMP_LEVELS):
+    """
+    根据实测墨量生成从最暗到最亮的字符梯度，墨量在最大值和最小值之间尽量均匀分布。
+
+    Returns:
+        tuple: (梯度字符串, 每个字符归一化后的墨量列表 (1=最暗, 0=最亮))。
+    """
+    # 墨量相同的字符只保留一个 (按字符排序保证结果稳定)
+    by_coverage = {}
+    for char in sorted(coverage):
+        by_coverage.setdefault(round(coverage[char], 6), char)
+    ordered = sorted(by_coverage.items(), key=lambda item: -item[0])
+    max_cov, min_cov = ordered[0][0], ordered[-1][0]
+    span = (max_cov - min_cov) or 1.0
+    normalized = [((cov - min_cov) / span, char) for cov, char in ordered]
+
+    levels = max(2, min(levels, len(normalized)))
+    chosen = []
+    used = set()
+    for level in range(levels):
+        target = 1.0 - level / (levels - 1)
+        candidates = [item for item in normalized if item[1] not in used]
+        best = min(candidates, key=lambda item: abs(item[0] - target))
+        used.add(best[1])
+        chosen.append(best)
+    chosen.sort(key=lambda item: -item[0])
+    ramp = "".join(char for _, char in chosen)
+    return ramp, [darkness for darkness, _ in chosen]
+
+def prepare_char_lut(char_ramp, font_info, auto_levels=DEFAULT_AUTO_RAMP_LEVELS):
+    """
+    根据配置准备字符梯度和查找表 (在主进程中执行一次，查找表随任务传给工作进程)。
+
+    Returns:
+        tuple: (梯度字符串, 查找表字符串)。
+    """
+    if not char_ramp:
+        return ASCII_CHARS, get_default_char_lut()
+    if char_ramp != AUTO_RAMP_KEYWORD:
+        return char_ramp, build_char_lut(char_ramp)
+    font = get_worker_font(font_info)
+    if font is None:
+        raise ValueError("无法加载字体，不能测量字符墨量")
+    font_key = (font_info.get('path', '<default>'), font_info.get('size'))
+    coverage = measure_glyph_coverage(font, font_key)
+    ramp, darkness = generate_auto_ramp(coverage, auto_levels)
+    return ramp, build_char_lut(ramp, darkness)
+
+# --- 边缘方向字符 ---
+def get_edge_lut(threshold):
+    """
+    构建 (并缓存) 按 (gx << 8) | gy 索引的方向字符表，gx/gy 为带 128 偏移的 Sobel 响应。
+    边缘方向与梯度方向垂直: 水平边缘用 '-' (下方更暗时用 '_')，竖直边缘用 '|'，斜边用 '/' 或 '\\'。
+    """
+    lut = _edge_lut_cache.get(threshold)
+    if lut is not None:
+        return lut
+    threshold_sq = threshold * threshold
+    lut = []
+    for gx in range(256):
+        dx = gx - 128
+        for gy in range(256):
+            dy = gy - 128 # 正值表示下方更亮 (图像 y 轴向下)
+            if dx * dx + dy * dy < threshold_sq:
+                lut.append('')
+                continue
+            # 边缘方向向量为 (-dy, dx)，取 0~180 度
+            angle = math.degrees(math.atan2(dx, -dy)) % 180.0
+            if angle < 22.5 or angle >= 157.5:
+                lut.append('_' if dy < 0 else '-')
+            elif angle < 67.5:
+                lut.append('\\')
+            elif angle < 112.5:
+                lut.append('|')
+            else:
+                lut.append('/')
+    _edge_lut_cache[threshold] = lut
+    return lut
+
+def _pad_replicate(image):
+    """四周各复制扩展 1 个像素 (Pillow 的卷积不处理最外圈像素)。"""
+    width, height = image.size
+    padded = Image.new(image.mode, (width + 2, height + 2))
+    padded.paste(image, (1, 1))
+    padded.paste(image.crop((0, 0, width, 1)), (1, 0))
+    padded.paste(image.crop((0, height - 1, width, height)), (1, height + 1))
+    padded.paste(padded.crop((1, 0, 2, height + 2)), (0, 0))
+    padded.paste(padded.crop((width, 0, width + 1, height + 2)), (width + 1, 0))
+    return padded
+
+def compute_edge_chars(image_rgb, width_chars, height_chars, threshold=DEFAULT_EDGE_THRESHOLD):
+    """
+    在字符网格分辨率上计算梯度，返回按行展开的列表: 边缘字符格为方向字符，其他为 ''。
+    亮度先用 BOX 平均缩小到网格大小 (比点采样更不容易受噪声影响)，再做 3x3 Sobel 卷积。
+    """
+    gray_grid = image_rgb.convert('L').resize((width_chars, height_chars), BOX)
+    padded = _pad_replicate(gray_grid)
+    crop_box = (1, 1, width_chars + 1, height_chars + 1)
+    gx_bytes = padded.filter(SOBEL_X_KERNEL).crop(crop_box).tobytes()
+    gy_bytes = padded.filter(SOBEL_Y_KERNEL).crop(crop_box).tobytes()
+    lut = get_edge_lut(threshold)
+    return [lut[(gx << 8) | gy] for gx, gy in zip(gx_bytes, gy_bytes)]
+
 # --- 图像处理函数 ---
+def sample_grid_image(image_rgb, width_chars, height_chars):
+    """
+    在 RGB 图像上按字符网格点采样，返回 width_chars x height_chars 的 RGB 图像。
+    采样坐标与逐格计算 floor((x+0.5)*xScale), floor((y+0.5)*yScale) 完全一致
+    (Pillow 的最近邻缩放在恰好落在像素边界时取整方向不同，因此不直接使用 resize)；
+    坐标只按行、列各计算一次，每行的取样由 itemgetter 在 C 代码中完成。
+    """
+    original_width, original_height = image_rgb.size
+    x_scale = float(original_width) / width_chars
+    y_scale = float(original_height) / height_chars
+    x_coords = [max(0, min(int(math.floor((x + 0.5) * x_scale)), original_width - 1)) for x in range(width_chars)]
+    y_coords = [max(0, min(int(math.floor((y + 0.5) * y_scale)), original_height - 1)) for y in range(height_chars)]
+    byte_getter = operator.itemgetter(*[3 * x + channel for x in x_coords for channel in range(3)])
+    rows = []
+    for y in y_coords:
+        row_bytes = image_rgb.crop((0, y, original_width, y + 1)).tobytes()
+        rows.append(bytes(byte_getter(row_bytes)))
+    return Image.frombytes('RGB', (width_chars, height_chars), b"".join(rows))
+
 
 # ==============================================================================
 # *** image_to_ascii 函数 (无变化) ***
 # ==============================================================================
-def image_to_ascii(color_image, width_chars, active_theme_name):
+def image_to_ascii(color_image, width_chars, active_theme_name, char_lut=None, edge_threshold=None,
+                   dither_offsets=None, edge_source=None, tone_settings=None):
     """
     将 PIL 彩色图像转换为包含字符和对应原图点采样颜色的数据结构。
     此版本模拟 C++ 逻辑：
     1. 直接在原始彩色图像上采样。
     2. 使用 (R+G+B)/3 计算灰度值。
     3. 字符映射逻辑不考虑背景明暗。
+    char_lut 为 build_char_lut 生成的查找表，None 表示使用内置的 ASCII_CHARS。
+    edge_threshold 不为 None 时启用边缘模式: 梯度幅值超过阈值的字符格使用方向字符。
+    dither_offsets 为 dithering.threshold_offsets 返回的偏移矩阵，None 表示不抖动。
+    edge_source 为计算边缘时做面积平均的图像 (同一图像的缩小版本，见 build_resolution_pyramid)，
+    None 表示使用 color_image。字符和颜色始终在 color_image 上点采样。
+    tone_settings 为色调映射设置 (见 tone_mapping.apply_tone_map)，在采样得到的灰度网格上重新分配灰度，
+    只影响字符的选择；None 表示不映射。
     """
     try:
         # 1. 确保输入是 RGB 并获取尺寸
@@ -260,99 +754,59 @@ def image_to_ascii(color_image, width_chars, active_theme_name):
         original_width, original_height = image_rgb.size
 
         if original_width <= 0 or original_height <= 0:
-            print("错误：原始图像尺寸无效。")
+            logger.error("原始图像尺寸无效。")
             return None
 
         # 2. 计算目标字符网格的高度 (保持宽高比)
         aspect_ratio = original_height / float(original_width)
         # C++ 版本使用 charAspectRatioCorrection = 2.0 (默认)，这里保持 Python 之前的 0.5
-        # 如果想严格模拟 C++ 的默认行为，需要调整这里
-        char_aspect_ratio_correction = 0.5 # 或者调整为 2.0? 取决于 C++ 配置
+        # 如果想严格模拟 C++ 的默认行为，需要调整 CHAR_ASPECT_RATIO_CORRECTION
         width_chars = max(1, int(width_chars))
-        new_height_chars = int(width_chars * aspect_ratio * char_aspect_ratio_correction)
+        new_height_chars = int(width_chars * aspect_ratio * CHAR_ASPECT_RATIO_CORRECTION)
         new_height_chars = max(1, new_height_chars) # 确保至少有一行
 
-        # 3. 准备字符映射
-        num_chars = len(ASCII_CHARS)
-        if num_chars == 0:
-            print("错误：ASCII_CHARS 不能为空。")
+        # 3. 准备字符映射 (按 R+G+B 之和索引的查找表)
+        if char_lut is None:
+            char_lut = get_default_char_lut()
+        if len(char_lut) != CHAR_LUT_SIZE:
+            logger.error(f"字符查找表长度无效 ({len(char_lut)}，应为 {CHAR_LUT_SIZE})。")
             return None
 
-        # 4. 计算采样比例因子
-        xScale = float(original_width) / width_chars
-        yScale = float(original_height) / new_height_chars
+        # 4. 点采样得到字符网格大小的图像 (每格取中心点像素)
+        grid_image = sample_grid_image(image_rgb, width_chars, new_height_chars)
+        grid_bytes = grid_image.tobytes()
+        sampled_colors = list(zip(grid_bytes[0::3], grid_bytes[1::3], grid_bytes[2::3]))
 
-        # 5. 准备像素访问器和结果列表
+        # 5. 每个字符格一次查表得到字符 (色调映射只作用于灰度网格，耗时与网格大小成正比)
+        rgb_sums = list(map(sum, sampled_colors))
+        rgb_sums = tone_mapping.apply_tone_map(rgb_sums, width_chars, new_height_chars, tone_settings)
+        if dither_offsets is None:
+            chars = list(map(char_lut.__getitem__, rgb_sums))
+        else:
+            # 有序抖动: 加上平铺的阈值偏移后查表。查找表两端按偏移幅度扩展 (等价于把和钳制到 0..765)，
+            # 整个网格由 map 在 C 代码中一次完成
+            pad = max(abs(offset) for row in dither_offsets for offset in row)
+            padded_lut = char_lut[0] * pad + char_lut + char_lut[-1] * pad
+            tiled = dithering.tile_offsets(dither_offsets, width_chars, new_height_chars, shift=pad)
+            chars = list(map(padded_lut.__getitem__, map(operator.add, rgb_sums, tiled)))
+
+        # 5b. 边缘模式: 强梯度处改用方向字符 (颜色仍为采样颜色，所有主题都适用)
+        if edge_threshold is not None:
+            edge_chars = compute_edge_chars(edge_source or image_rgb, width_chars, new_height_chars, edge_threshold)
+            chars = [edge_char or char for edge_char, char in zip(edge_chars, chars)]
+
+        # 5c. 按行组合字符和原始采样颜色
         ascii_char_color_data = []
-        try:
-            original_pixels = image_rgb.load() # 优化像素访问
-        except Exception as load_err:
-             print(f"警告: 无法创建像素访问对象: {load_err}. 将使用 getpixel (可能较慢)。")
-             original_pixels = None # 标记，后面用 getpixel
-
-        # 6. 遍历目标字符网格
-        for y_char in range(new_height_chars):
-            row_data = []
-            for x_char in range(width_chars):
-                # a. 计算原始图像中的采样坐标 (中心点)
-                x_orig = int(math.floor((x_char + 0.5) * xScale))
-                y_orig = int(math.floor((y_char + 0.5) * yScale))
-
-                # b. 确保坐标在边界内
-                x_orig = max(0, min(x_orig, original_width - 1))
-                y_orig = max(0, min(y_orig, original_height - 1))
-
-                # c. 获取采样点的 RGB 颜色
-                sampled_color = (0, 0, 0) # Default to black on error
-                try:
-                    if original_pixels:
-                        sampled_color = original_pixels[x_orig, y_orig]
-                    else:
-                        sampled_color = image_rgb.getpixel((x_orig, y_orig))
-
-                    # 确保是有效的 RGB 元组
-                    if not isinstance(sampled_color, tuple) or len(sampled_color) < 3:
-                        # Fallback if pixel access didn't return expected tuple (e.g., for palette images)
-                        pixel_img = image_rgb.crop((x_orig, y_orig, x_orig + 1, y_orig + 1))
-                        sampled_color = pixel_img.convert("RGB").getpixel((0,0))
-                        if not isinstance(sampled_color, tuple) or len(sampled_color) < 3:
-                            print(f"警告：无法在 ({x_orig}, {y_orig}) 获取有效的 RGB 颜色。使用默认黑色。")
-                            sampled_color = (0, 0, 0)
-                except IndexError:
-                    print(f"警告：点采样索引 ({x_orig}, {y_orig}) 超出范围。使用默认黑色。")
-                    sampled_color = (0, 0, 0)
-                except Exception as pixel_err:
-                    print(f"警告：获取像素 ({x_orig}, {y_orig}) 时出错: {pixel_err}。使用默认黑色。")
-                    sampled_color = (0, 0, 0)
-
-                # d. 从采样颜色计算灰度值 (模拟 C++ 的简单平均法)
-                r, g, b = sampled_color[:3] # 取前三个元素以防有 alpha 通道
-                # gray = (int(r) + int(g) + int(b)) // 3 # 整数除法
-                # 使用浮点数除法和 floor 模拟 C++ 的 floor((gray/256.0f)...)
-                gray = (int(r) + int(g) + int(b)) / 3.0
-
-                # e. 映射灰度值到字符索引 (模拟 C++ 逻辑)
-                # C++: floor((gray / 256.0f) * NUM_ASCII_CHARS)
-                # Python: math.floor((gray / 256.0) * num_chars)
-                ascii_index = math.floor((gray / 256.0) * num_chars)
-
-                # f. 确保索引在有效范围内
-                ascii_index = max(0, min(ascii_index, num_chars - 1))
-
-                # g. 选择字符
-                char = ASCII_CHARS[ascii_index]
-
-                # h. 存储字符和原始颜色
-                row_data.append((char, sampled_color[:3]))
-            # i. 添加行数据到结果列表
-            ascii_char_color_data.append(row_data)
-
-        # 7. 返回结果
+        for row_start in range(0, len(sampled_colors), width_chars):
+            row_end = row_start + width_chars
+            ascii_char_color_data.append(list(zip(chars[row_start:row_end], sampled_colors[row_start:row_end])))
+
+        # 6. 返回结果
         return ascii_char_color_data
 
     except Exception as e:
         # 保留原始的异常处理
-        print(f"在主题 '{active_theme_name}' 的 ASCII 转换和颜色采样过程中出错: {e}")
+        logger.error(f"在主题 '{active_theme_name}' 的 ASCII 转换和颜色采样过程中出错: {e}")
         # traceback.print_exc() # 在子进程中打印完整的traceback可能比较混乱，可以选择性注释掉
         return None
 # ==============================================================================
@@ -375,11 +829,11 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
     优化：对于非彩色主题，按行绘制文本以提高性能。
     """
     if not ascii_char_color_data or not ascii_char_color_data[0]:
-        print("错误：没有 ASCII 数据或空行来创建 PNG。")
+        logger.error("没有 ASCII 数据或空行来创建 PNG。")
         return False
 
     if not isinstance(ascii_char_color_data[0][0], tuple) or len(ascii_char_color_data[0][0]) != 2:
-        print("错误：传入 create_ascii_png 的数据结构不正确。应为 list[list[tuple[char, color]]]")
+        logger.error("传入 create_ascii_png 的数据结构不正确。应为 list[list[tuple[char, color]]]")
         return False
 
     is_original_color_theme = theme_name in ["original_dark_bg", "original_light_bg"]
@@ -397,7 +851,7 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
         sample_line_text = "".join([item[0] for item in ascii_char_color_data[0]])
         if not sample_line_text: # 如果第一行全是空字符或无法获取字符
              # 尝试用 'M' 来估算宽度
-             print("警告：无法从第一行获取样本文本，将使用'M'估算宽度。")
+             logger.warning("无法从第一行获取样本文本，将使用'M'估算宽度。")
              sample_line_text = 'M' * len(ascii_char_color_data[0])
              if not sample_line_text: sample_line_text = "M" # 最终后备
 
@@ -411,21 +865,21 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
             text_width = bbox_w[2] - bbox_w[0] if bbox_w else font_size_val * len(sample_line_text) # 从 bbox 获取宽度
 
         except AttributeError: # Pillow < 9.2.0? or other issues
-            print("警告：textbbox 不可用或出错。正在使用较旧的 Pillow 文本测量方法（textsize）。尺寸可能不太准确。")
+            logger.warning("textbbox 不可用或出错。正在使用较旧的 Pillow 文本测量方法（textsize）。尺寸可能不太准确。")
             try:
                 size_h = draw.textsize(sample_text_height, font=font)
                 line_height = size_h[1]
                 size_w = draw.textsize(sample_line_text, font=font)
                 text_width = size_w[0]
             except AttributeError: # Pillow < 8.0.0?
-                print("警告：textsize 不可用。正在使用更旧的 font.getsize。尺寸可能非常不准确。")
+                logger.warning("textsize 不可用。正在使用更旧的 font.getsize。尺寸可能非常不准确。")
                 try:
                     (_, h) = font.getsize('M') # 用 'M' 的高度近似
                     line_height = int(h * 1.2) # 增加一点行间距
                     w = sum(font.getsize(c)[0] for c in sample_line_text)
                     text_width = w
                 except Exception as e_getsize:
-                    print(f"错误: 无法使用任何方法测量文本尺寸: {e_getsize}. 使用默认值。")
+                    logger.error(f"无法使用任何方法测量文本尺寸: {e_getsize}. 使用默认值。")
                     line_height = font_size_val + 4
                     text_width = font_size_val * len(sample_line_text)
 
@@ -453,7 +907,7 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
             if foreground_color is None:
                 # 理论上 load_config 应该确保非 original 主题有 foreground_color
                 # 但作为后备，设置一个默认值
-                print(f"警告：非原始主题 '{theme_name}' 缺少前景色。使用白色。")
+                logger.warning(f"非原始主题 '{theme_name}' 缺少前景色。使用白色。")
                 final_color = "white"
             else:
                 final_color = foreground_color
@@ -466,7 +920,7 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
                         # 对每一行调用一次 draw.text，从左上角 (0, y_text) 开始绘制
                         draw.text((0, y_text), line_text, font=font, fill=final_color, anchor="lt")
                     except Exception as line_err:
-                         print(f"警告：在 y={y_text} 绘制行 '{line_text[:20]}...' 时出错: {line_err}")
+                         logger.warning(f"在 y={y_text} 绘制行 '{line_text[:20]}...' 时出错: {line_err}")
                 # 更新 y 位置，移动到下一行
                 y_text += line_spacing
         else:
@@ -493,7 +947,7 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
                         # anchor='lt' 表示文本的左上角位于 (x_pos, y_text)
                         draw.text((math.floor(x_pos), y_text), char, font=font, fill=final_color, anchor="lt")
                     except Exception as char_err:
-                        print(f"警告：在文本位置 ({x_pos:.0f},{y_text}) 绘制字符 '{char}' 时出错: {char_err}")
+                        logger.warning(f"在文本位置 ({x_pos:.0f},{y_text}) 绘制字符 '{char}' 时出错: {char_err}")
 
                     # 更新 x 位置，使用平均宽度（对于等宽字体较准）(逻辑不变)
                     x_pos += avg_char_width
@@ -516,18 +970,18 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
                     # print(f"    调整 PNG 大小为 {img_width}x{target_height} 以匹配原始宽高比...")
                     output_image = output_image.resize((img_width, target_height), resample_filter)
                 except Exception as resize_err:
-                    print(f"警告: 调整大小失败: {resize_err}. 使用原始渲染大小。")
+                    logger.warning(f"调整大小失败: {resize_err}. 使用原始渲染大小。")
             else:
-                print("警告：无法调整大小，原始图像尺寸无效。")
+                logger.warning("无法调整大小，原始图像尺寸无效。")
         elif RESIZE_OUTPUT:
-            print("警告：请求调整大小但未提供原始图像尺寸。")
+            logger.warning("请求调整大小但未提供原始图像尺寸。")
 
-        # 保存图像 (代码不变)
-        output_image.save(output_path)
+        # 保存图像 (output_path 也可以是 BytesIO 等文件对象，因此显式指定格式)
+        output_image.save(output_path, format='PNG')
         return True
 
     except Exception as e:
-        print(f"在路径 '{output_path}' 为主题 '{theme_name}' 创建或保存 PNG 时出错: {e}")
+        logger.error(f"在路径 '{output_path}' 为主题 '{theme_name}' 创建或保存 PNG 时出错: {e}")
         # traceback.print_exc() # 在子进程中打印完整的traceback可能比较混乱
         return False
 # ==============================================================================
@@ -535,46 +989,201 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
 # ==============================================================================
 
 
+def parse_width_list(text):
+    """
+    解析逗号分隔的输出宽度 (如 '128, 256, 512')，返回去重后从小到大排列的列表。
+    为空、不是整数或不大于 0 时抛出 ValueError。
+    """
+    widths = set()
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        width = int(item) # 不是整数时抛出 ValueError
+        if width <= 0:
+            raise ValueError(f"宽度必须 > 0: {width}")
+        widths.add(width)
+    if not widths:
+        raise ValueError("至少需要一个宽度")
+    return sorted(widths)
+
+
+def output_width_list(output_width_chars):
+    """output_width_chars 可以是单个宽度或宽度列表，统一返回列表。"""
+    if isinstance(output_width_chars, int):
+        return [output_width_chars]
+    return list(output_width_chars)
+
+
+def format_width_tag(output_width_chars):
+    """输出目录名中的宽度部分: 单个宽度为 '1024w'，多个宽度为 '128-256-1024w'。"""
+    return "-".join(str(width) for width in output_width_list(output_width_chars)) + "w"
+
+
+def build_resolution_pyramid(image_rgb, min_width_chars):
+    """
+    逐级做 2x2 平均缩小 (Image.reduce)，返回 [原图, 1/2, 1/4, ...]。
+    最后一级的宽度仍不小于 min_width_chars * PYRAMID_MIN_SCALE。
+    """
+    levels = [image_rgb]
+    while True:
+        width, height = levels[-1].size
+        if width // 2 < min_width_chars * PYRAMID_MIN_SCALE or height < 2:
+            return levels
+        levels.append(levels[-1].reduce(2))
+
+
+def select_pyramid_level(pyramid, width_chars):
+    """返回宽度不小于 width_chars * PYRAMID_MIN_SCALE 的最小层级 (都不满足时返回原图)。"""
+    for level in reversed(pyramid):
+        if level.size[0] >= width_chars * PYRAMID_MIN_SCALE:
+            return level
+    return pyramid[0]
+
+
+def build_output_filename(file_name_no_ext, output_width_chars, theme_name, filter_settings,
+                          edge_threshold=None, dither_settings=None):
+    """返回某个图像在某个主题下的输出 PNG 文件名 (不含目录)。"""
+    # 添加滤波信息到输出文件名
+    filter_suffix = ""
+    if filter_settings.get('enable_filter', False):
+         filter_suffix = f"_filter-{filter_settings.get('filter_type','na')}" # 例如 _filter-gaussian
+
+    edge_suffix = "_edges" if edge_threshold is not None else ""
+    if dither_settings is not None:
+        edge_suffix += f"_{dither_settings['dither_mode']}"
+    if filter_settings.get('tone_map'):
+        edge_suffix += f"_tone-{filter_settings['tone_map']['tone_mode']}"
+    resize_suffix = "_resized" if RESIZE_OUTPUT else ""
+    # 将滤波后缀放在宽度后面，主题前面
+    return f"{file_name_no_ext}_ascii_{output_width_chars}w{filter_suffix}{edge_suffix}_{theme_name}{resize_suffix}.png"
+
+
+def apply_image_filter(img_rgb, filter_settings, short_image_name):
+    """按 filter_settings 对 RGB 图像应用预处理滤波器；未启用或滤波失败时返回原图。"""
+    if not filter_settings.get('enable_filter', False):
+        return img_rgb
+    filter_type = filter_settings.get('filter_type', 'gaussian')
+    gaussian_radius = filter_settings.get('filter_gaussian_radius', 1.0)
+    median_size = filter_settings.get('filter_median_size', 3)
+    logger.debug(f"文件 '{short_image_name}': 启用滤波器。") # 提示滤波已启用
+    try:
+        if filter_type == 'gaussian':
+            logger.debug(f"'{short_image_name}': 应用高斯模糊 (半径={gaussian_radius})...")
+            return img_rgb.filter(ImageFilter.GaussianBlur(radius=gaussian_radius))
+        if filter_type == 'median':
+            # 确保 size 合法 (虽然 load_config 已做检查，双重保险)
+            median_size = median_size if median_size >= 3 and median_size % 2 != 0 else 3
+            logger.debug(f"'{short_image_name}': 应用中值滤波 (尺寸={median_size})...")
+            return img_rgb.filter(ImageFilter.MedianFilter(size=median_size))
+    except Exception as filter_err:
+        logger.warning(f"'{short_image_name}': 应用滤波器 ({filter_type}) 失败: {filter_err}。将使用原始图像进行转换。")
+    return img_rgb
+
+
+def load_image_for_processing(source, filter_settings, short_image_name, timings=None):
+    """
+    打开图像 (source 为路径或文件对象)，转换为 RGB 并按 filter_settings 滤波。
+    返回 (处理用的 RGB 图像, 原始尺寸)；无法打开或解码时抛出异常。
+    给出 timings 字典时累加 'decode' 和 'filter' 阶段的耗时 (秒)。
+    """
+    stage_start = time.perf_counter()
+    with Image.open(source) as img_opened:
+        original_dimensions = img_opened.size
+        img_rgb = img_opened.convert('RGB') # 转换为RGB用于处理
+    filter_start = time.perf_counter()
+    img_filtered = apply_image_filter(img_rgb, filter_settings, short_image_name)
+    if timings is not None:
+        timings['decode'] = timings.get('decode', 0.0) + filter_start - stage_start
+        timings['filter'] = timings.get('filter', 0.0) + time.perf_counter() - filter_start
+    return img_filtered, original_dimensions
+
+
+def render_outputs(img_to_process, original_dimensions, font, themes_config, output_widths, themes_list_to_generate,
+                   char_lut, edge_threshold, dither_settings, short_image_name, output_target,
+                   timings=None, failed_stages=None, tone_settings=None):
+    """
+    为每个宽度 x 主题生成 ASCII 数据并保存 PNG。
+    output_target(宽度, 主题) 返回保存位置 (文件路径或 BytesIO 等文件对象)。
+    返回 [(宽度, 主题, 保存位置, 是否成功)]。
+    给出 timings 字典时累加 'ascii' (生成字符网格) 和 'render' (绘制并编码 PNG) 阶段的耗时；
+    给出 failed_stages 计数器时按阶段记录失败的输出数。
+    tone_settings 为色调映射设置 (filter_settings['tone_map'])，None 表示不映射。
+    """
+    timings = {} if timings is None else timings
+    failed_stages = collections.Counter() if failed_stages is None else failed_stages
+    outputs = []
+    dither_offsets = dither_settings['offsets'] if dither_settings else None
+    # 边缘模式对整幅图像做面积平均: 金字塔只建一次，每个宽度从最接近的层级缩小
+    pyramid = build_resolution_pyramid(img_to_process, output_widths[0]) if edge_threshold is not None else None
+
+    for output_width, theme_name in ((width, theme) for width in output_widths for theme in themes_list_to_generate):
+        theme_details = themes_config.get(theme_name)
+        # theme_name 应该总是有效的，因为 load_config 已经验证过
+        # 但为了安全起见，还是检查一下
+        if not theme_details:
+            logger.warning(f"内部错误: 尝试生成未定义的主题 '{theme_name}'。跳过。")
+            failed_stages['setup'] += 1
+            outputs.append((output_width, theme_name, None, False))
+            continue
+
+        stage_start = time.perf_counter()
+        edge_source = select_pyramid_level(pyramid, output_width) if pyramid else None
+        ascii_char_color_data = image_to_ascii(img_to_process, output_width, theme_name, char_lut,
+                                               edge_threshold, dither_offsets, edge_source, tone_settings)
+        render_start = time.perf_counter()
+        timings['ascii'] = timings.get('ascii', 0.0) + render_start - stage_start
+        if not ascii_char_color_data:
+            logger.error(f"'{short_image_name}': 为主题 '{theme_name}' 生成 ASCII 数据失败。")
+            failed_stages['ascii'] += 1
+            outputs.append((output_width, theme_name, None, False))
+            continue
+
+        target = output_target(output_width, theme_name)
+        png_success = create_ascii_png(
+            ascii_char_color_data, theme_name, target, font,
+            theme_details["background"], theme_details.get("foreground"), original_dimensions
+        )
+        timings['render'] = timings.get('render', 0.0) + time.perf_counter() - render_start
+        if not png_success:
+            logger.error(f"'{short_image_name}': 为主题 '{theme_name}' 创建 PNG 失败。")
+            failed_stages['render'] += 1
+        outputs.append((output_width, theme_name, target, png_success))
+    return outputs
+
+
 # ==============================================================================
 # *** 修改后的 process_image_to_ascii_themes 函数 ***
 # ==============================================================================
 # 修改签名，接收 filter_settings 和 themes_list_to_generate
 def process_image_to_ascii_themes(image_path, font_info, themes_config, base_output_dir,
-                                  output_width_chars, filter_settings, themes_list_to_generate): # <-- 新增 themes_list_to_generate
+                                  output_width_chars, filter_settings, themes_list_to_generate, # <-- 新增 themes_list_to_generate
+                                  char_lut=None, edge_threshold=None, dither_settings=None):
     """
     处理单个图像文件，将其所有指定主题的输出保存在 base_output_dir 下以图像名命名的子目录中。
     此函数在单独的进程中执行，并在开始时加载字体。
     根据 filter_settings 对加载的图像应用滤波器。
-    返回一个字典，包含成功和失败的主题数量。
+    output_width_chars 为单个宽度或宽度列表: 图像只解码和滤波一次，每个宽度 x 主题各生成一个输出。
+    char_lut 为主进程用 prepare_char_lut 准备的字符查找表 (None 表示内置梯度)。
+    edge_threshold 不为 None 时启用边缘方向字符模式。
+    dither_settings 为 {'dither_mode': 名称, 'offsets': 偏移矩阵}，None 表示不抖动。
+    返回一个字典，包含成功和失败的主题数量，以及 'timings' (各阶段耗时，秒)、
+    'bytes_written' (写出的 PNG 字节数) 和 'failed_stages' (按阶段统计的失败输出数)。
     """
-    process_id = os.getpid()
     short_image_name = os.path.basename(image_path)
-    # 使用传入的主题列表计算失败数
-    num_themes_attempted = len(themes_list_to_generate)
-    results = {'success': 0, 'failed': 0}
-    font = None # <-- 在子进程中初始化
-
-    # --- 在子进程开始时加载字体 (代码不变) ---
-    try:
-        font_type = font_info.get('type')
-        if font_type == 'truetype':
-            font = ImageFont.truetype(font_info['path'], font_info['size'])
-        elif font_type == 'default':
-            font = ImageFont.load_default()
-        else:
-            print(f"[PID:{process_id}] 错误: 无效的 font_info 类型 '{font_type}'。回退到默认字体。")
-            font = ImageFont.load_default() # Fallback
-    except Exception as e_load_worker:
-        print(f"[PID:{process_id}] 错误: 在工作进程中加载字体失败: {e_load_worker}。回退到默认字体。")
-        try:
-            font = ImageFont.load_default()
-        except Exception as e_load_default_worker:
-            print(f"[PID:{process_id}] 致命错误: 连默认字体都无法在工作进程中加载: {e_load_default_worker}")
-            results['failed'] = num_themes_attempted # 所有尝试的主题都失败
-            return results
+    # 使用传入的主题列表和宽度列表计算失败数
+    output_widths = output_width_list(output_width_chars)
+    num_themes_attempted = len(themes_list_to_generate) * len(output_widths)
+    failed_stages = collections.Counter()
+    results = {'success': 0, 'failed': 0, 'timings': {}, 'bytes_written': 0, 'failed_stages': failed_stages}
+    # --- 字体在每个工作进程中只加载一次 ---
+    font = get_worker_font(font_info)
+    if font is None:
+        results['failed'] = num_themes_attempted # 所有尝试的主题都失败
+        failed_stages['font'] += num_themes_attempted
+        return results
 
     # --- 处理逻辑 ---
-    original_img = None
     original_dimensions = (0, 0)
 
     base_name = os.path.basename(image_path)
@@ -584,119 +1193,343 @@ def process_image_to_ascii_themes(image_path, font_info, themes_config, base_out
     try:
         os.makedirs(image_specific_output_dir, exist_ok=True)
     except OSError as e:
-        print(f"[PID:{process_id}] 错误: 无法创建输出子目录 '{image_specific_output_dir}': {e}。跳过图像。")
+        logger.error(f"无法创建输出子目录 '{image_specific_output_dir}': {e}。跳过图像 '{short_image_name}'。")
         results['failed'] = num_themes_attempted
+        failed_stages['setup'] += num_themes_attempted
         return results
 
     img_to_process = None # 用于存储可能被滤波处理后的图像
     try:
-        with Image.open(image_path) as img_opened:
-            original_img = img_opened.copy() # 复制一份，避免修改原始对象（如果后续需要）
-            original_dimensions = original_img.size
-            img_to_process = original_img.convert('RGB') # 转换为RGB用于处理
-
-        if not img_to_process: raise ValueError("无法加载或转换图像。")
-
-        # --- 应用滤波器 (代码不变) ---
-        apply_filter = filter_settings.get('enable_filter', False)
-        if apply_filter:
-            filter_type = filter_settings.get('filter_type', 'gaussian')
-            gaussian_radius = filter_settings.get('filter_gaussian_radius', 1.0)
-            median_size = filter_settings.get('filter_median_size', 3)
-            print(f"[PID:{process_id}] 文件 '{short_image_name}': 启用滤波器。") # 提示滤波已启用
-            try:
-                filter_start_time = time.perf_counter()
-                if filter_type == 'gaussian':
-                    print(f"  应用高斯模糊 (半径={gaussian_radius})...")
-                    img_to_process = img_to_process.filter(ImageFilter.GaussianBlur(radius=gaussian_radius))
-                elif filter_type == 'median':
-                    # 确保 size 合法 (虽然 load_config 已做检查，双重保险)
-                    median_size = median_size if median_size >= 3 and median_size % 2 != 0 else 3
-                    print(f"  应用中值滤波 (尺寸={median_size})...")
-                    img_to_process = img_to_process.filter(ImageFilter.MedianFilter(size=median_size))
-                filter_end_time = time.perf_counter()
-                # print(f"  滤波耗时: {filter_end_time - filter_start_time:.4f} 秒") # 可选：打印滤波耗时
-            except Exception as filter_err:
-                 print(f"  警告: 应用滤波器 ({filter_type}) 失败: {filter_err}。将使用原始图像进行转换。")
-                 img_to_process = original_img.convert('RGB') # 确保回退到原始RGB图像
-
+        img_to_process, original_dimensions = load_image_for_processing(
+            image_path, filter_settings, short_image_name, results['timings'])
     except FileNotFoundError:
-        print(f"[PID:{process_id}] 错误: 未找到图像文件 '{image_path}'。跳过。")
+        logger.error(f"未找到图像文件 '{image_path}'。跳过。")
         results['failed'] = num_themes_attempted
+        failed_stages['decode'] += num_themes_attempted
         return results
     except Exception as e:
-        print(f"[PID:{process_id}] 打开/转换/滤波图像 '{short_image_name}' 时出错: {e}")
+        logger.error(f"打开/转换/滤波图像 '{short_image_name}' 时出错: {e}")
         results['failed'] = num_themes_attempted
+        failed_stages['decode'] += num_themes_attempted
         return results
 
-    # --- 后续处理使用 img_to_process (可能已滤波) ---
-    # --- 修改循环：使用传入的 themes_list_to_generate ---
-    for theme_name in themes_list_to_generate:
-        theme_details = themes_config.get(theme_name)
-        # theme_name 应该总是有效的，因为 load_config 已经验证过
-        # 但为了安全起见，还是检查一下
-        if not theme_details:
-            print(f"[PID:{process_id}] 内部错误警告: 尝试生成未定义的主题 '{theme_name}'。跳过。")
+    def output_path(output_width, theme_name):
+        return os.path.join(image_specific_output_dir, build_output_filename(
+            file_name_no_ext, output_width, theme_name, filter_settings, edge_threshold, dither_settings))
+
+    for output_width, theme_name, output_filepath, png_success in render_outputs(
+            img_to_process, original_dimensions, font, themes_config, output_widths, themes_list_to_generate,
+            char_lut, edge_threshold, dither_settings, short_image_name, output_path,
+            results['timings'], failed_stages, filter_settings.get('tone_map')):
+        if png_success:
+            results['success'] += 1
+            try:
+                results['bytes_written'] += os.path.getsize(output_filepath)
+            except OSError:
+                pass
+            logger.debug(f"'{short_image_name}': 已保存 {os.path.join(file_name_no_ext, os.path.basename(output_filepath))}")
+        else:
             results['failed'] += 1
-            continue
 
-        bg_color = theme_details["background"]
-        fg_color = theme_details.get("foreground")
+    return results
 
-        # --- 调用 image_to_ascii 时传入处理过的图像 ---
-        ascii_char_color_data = image_to_ascii(img_to_process, output_width_chars, theme_name) # <--- 使用 img_to_process
-        if not ascii_char_color_data:
-            print(f"[PID:{process_id}] 错误: 为主题 '{theme_name}' 生成 ASCII 数据失败。")
-            results['failed'] += 1
+
+def process_image_batch(image_paths, font_info, themes_config, base_output_dir,
+                        output_width_chars, filter_settings, themes_list_to_generate,
+                        char_lut=None, edge_threshold=None, dither_settings=None):
+    """
+    在一个任务中依次处理多张图像 (小图像打包后减少任务提交和进程间通信的开销)。
+    其余参数与 process_image_to_ascii_themes 相同。
+    返回 [(图像路径, 结果字典)]，单张图像出错不影响同一批的其他图像。
+    """
+    batch_results = []
+    for image_path in image_paths:
+        try:
+            image_results = process_image_to_ascii_themes(
+                image_path, font_info, themes_config, base_output_dir, output_width_chars,
+                filter_settings, themes_list_to_generate, char_lut, edge_threshold, dither_settings)
+        except Exception as e:
+            logger.error(f"处理图像 '{os.path.basename(image_path)}' 时出错: {e}")
+            num_outputs = len(themes_list_to_generate) * len(output_width_list(output_width_chars))
+            image_results = {'success': 0, 'failed': num_outputs, 'failed_stages': {'worker': num_outputs}}
+        batch_results.append((image_path, image_results))
+    return batch_results
+
+
+def render_image_bytes(image_bytes, image_path, font_info, themes_config, output_width_chars, filter_settings,
+                       themes_list_to_generate, char_lut=None, edge_threshold=None, dither_settings=None):
+    """
+    流水线模式的计算阶段 (在工作进程中执行): 解码读取线程读入的图像字节，
+    为每个宽度 x 主题渲染并编码 PNG，文件由写入线程保存。
+    返回 {'outputs': [(宽度, 主题, PNG 字节或 None)], 'failed': 未生成的输出数,
+          'timings': 各阶段耗时, 'failed_stages': 按阶段统计的失败输出数}。
+    """
+    short_image_name = os.path.basename(image_path)
+    output_widths = output_width_list(output_width_chars)
+    num_outputs = len(themes_list_to_generate) * len(output_widths)
+    failed_stages = collections.Counter()
+    result = {'outputs': [], 'failed': num_outputs, 'timings': {}, 'failed_stages': failed_stages}
+    font = get_worker_font(font_info)
+    if font is None:
+        failed_stages['font'] += num_outputs
+        return result
+    try:
+        img_to_process, original_dimensions = load_image_for_processing(
+            io.BytesIO(image_bytes), filter_settings, short_image_name, result['timings'])
+    except Exception as e:
+        logger.error(f"打开/转换/滤波图像 '{short_image_name}' 时出错: {e}")
+        failed_stages['decode'] += num_outputs
+        return result
+
+    for output_width, theme_name, buffer, png_success in render_outputs(
+            img_to_process, original_dimensions, font, themes_config, output_widths, themes_list_to_generate,
+            char_lut, edge_threshold, dither_settings, short_image_name, lambda width, theme: io.BytesIO(),
+            result['timings'], failed_stages, filter_settings.get('tone_map')):
+        result['outputs'].append((output_width, theme_name, buffer.getvalue() if png_success else None))
+    result['failed'] = sum(1 for _, _, png in result['outputs'] if png is None)
+    return result
+
+
+def estimate_image_cost(image_path, output_width_chars, num_themes):
+    """
+    只读取图像头，估算处理成本: 源像素数 (解码、滤波) + 每个宽度、每个主题的字符格数 * SCHEDULE_CELL_COST (渲染)。
+    output_width_chars 为单个宽度或宽度列表。无法读取图像头时返回 None。
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    cells = 0
+    for width_chars in output_width_list(output_width_chars):
+        cells += width_chars * max(1, int(width_chars * (height / float(width)) * CHAR_ASPECT_RATIO_CORRECTION))
+    return width * height + num_themes * cells * SCHEDULE_CELL_COST
+
+
+def plan_directory_tasks(image_paths, output_width_chars, num_themes, num_workers,
+                         batch_target_cost=SCHEDULE_BATCH_TARGET_COST):
+    """
+    按估算成本安排目录批处理的任务，返回任务列表 (每个任务是一组图像路径)，按成本从大到小排列:
+    大图像各自成为一个任务并最先提交，使最慢的任务不会拖在最后；
+    小图像打包成多图任务 (每个任务的成本约为 batch_target_cost)，减少每个任务的固定开销。
+    无法读取图像头的文件各自成为一个任务，放在最后。
+    """
+    costs = {path: estimate_image_cost(path, output_width_chars, num_themes) for path in image_paths}
+    known = sorted((path for path in image_paths if costs[path] is not None), key=costs.get, reverse=True)
+    unknown = [path for path in image_paths if costs[path] is None]
+    total_cost = sum(costs[path] for path in known)
+    # 目标不超过 总成本 / (工作进程数 * 每进程最少任务数)，图像都很小时也能分给所有工作进程
+    batch_target = min(batch_target_cost, total_cost / float(max(1, num_workers * SCHEDULE_MIN_TASKS_PER_WORKER)))
+
+    tasks = [] # (成本, 路径列表)
+    batch, batch_cost = [], 0
+    for path in known:
+        cost = costs[path]
+        if cost >= batch_target:
+            tasks.append((cost, [path]))
             continue
+        batch.append(path)
+        batch_cost += cost
+        if batch_cost >= batch_target or len(batch) >= SCHEDULE_MAX_BATCH_IMAGES:
+            tasks.append((batch_cost, batch))
+            batch, batch_cost = [], 0
+    if batch:
+        tasks.append((batch_cost, batch))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    packed = sum(1 for _, paths in tasks if len(paths) > 1)
+    if packed:
+        logger.info(f"调度: {len(image_paths)} 个图像分为 {len(tasks) + len(unknown)} 个任务 "
+                    f"({sum(len(paths) for _, paths in tasks if len(paths) > 1)} 个小图像打包为 {packed} 个任务)，大任务先提交。")
+    return [paths for _, paths in tasks] + [[path] for path in unknown]
+
+
+def select_admissible_tasks(pending, in_flight_count, in_flight_memory, max_in_flight, memory_budget):
+    """
+    从 pending ([(任务, 估算内存)]，按提交优先级排列) 中取出现在可以提交的任务并返回 (按原顺序)。
+    已提交的任务数不超过 max_in_flight；memory_budget 不为 None 时估算内存之和不超过预算:
+    装不下的大任务留到有内存释放后再提交，其间较小的任务可以先运行；
+    没有任务在运行时总是提交第一个，超出预算的单个任务也能 (单独) 完成。
+    """
+    admitted = []
+    for task in list(pending):
+        if in_flight_count >= max_in_flight:
+            break
+        task_memory = task[1] or 0
+        if memory_budget is not None and in_flight_count and in_flight_memory + task_memory > memory_budget:
+            continue
+        pending.remove(task)
+        admitted.append(task)
+        in_flight_count += 1
+        in_flight_memory += task_memory
+    return admitted
 
-        # 添加滤波信息到输出文件名 (代码不变)
-        filter_suffix = ""
-        if apply_filter:
-             filter_suffix = f"_filter-{filter_settings.get('filter_type','na')}" # 例如 _filter-gaussian
 
-        resize_suffix = "_resized" if RESIZE_OUTPUT else ""
-        # 将滤波后缀放在宽度后面，主题前面
-        output_filename = f"{file_name_no_ext}_ascii_{output_width_chars}w{filter_suffix}_{theme_name}{resize_suffix}.png"
-        output_filepath = os.path.join(image_specific_output_dir, output_filename)
+def resolve_memory_budget(memory_budget_mb):
+    """
+    把配置的内存预算转换为字节数: 'auto' 为物理内存的 MEMORY_BUDGET_AUTO_FRACTION，0 为不限制。
+    返回字节数，不限制或无法获取物理内存大小时返回 None。
+    """
+    if memory_budget_mb == 'auto':
+        try:
+            physical_bytes = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            logger.debug("无法获取物理内存大小，不限制内存。")
+            return None
+        return int(physical_bytes * MEMORY_BUDGET_AUTO_FRACTION) if physical_bytes > 0 else None
+    return memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
 
-        # 使用在子进程中加载的 font 对象
-        png_success = create_ascii_png(
-            ascii_char_color_data, theme_name, output_filepath, font,
-            bg_color, fg_color, original_dimensions
-        )
 
-        if png_success:
-            results['success'] += 1
-        else:
-            results['failed'] += 1
-            print(f"[PID:{process_id}] 错误: 为主题 '{theme_name}' 创建 PNG 失败。")
+def measure_cell_size(font_info):
+    """返回 (字符宽度, 行距) 像素数，与 create_ascii_png 的排版方式一致，用于估算画布大小。"""
+    font = get_worker_font(font_info)
+    try:
+        draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+        bbox_h = draw.textbbox((0, 0), '|M_g(`', font=font, anchor="lt")
+        return max(1.0, draw.textlength('M', font=font)), max(1, bbox_h[3] - bbox_h[1] + 2)
+    except Exception as e:
+        logger.debug(f"测量字符尺寸失败: {e}，按字号估算。")
+        font_size = getattr(font, 'size', DEFAULT_FONT_SIZE)
+        return font_size * 0.6, font_size + 4
 
-    return results
 
+def estimate_image_memory(image_path, output_width_chars, cell_size, filter_settings, edge_threshold=None):
+    """
+    只读取图像头，估算处理这张图像时工作进程的峰值内存 (字节):
+    源图像 (解码结果和 RGB 副本，启用滤波/边缘模式时再加上滤波结果和金字塔)
+    + 最大宽度的画布和缩放后的副本 (主题依次渲染，同一时刻只有一个) + 字符格数据。
+    无法读取图像头时返回 None。
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    source_copies = 2 + (1 if filter_settings.get('enable_filter', False) else 0) + (0.5 if edge_threshold is not None else 0)
+    source_bytes = width * height * MEMORY_BYTES_PER_PIXEL * source_copies
+    char_width, line_spacing = cell_size
+    render_bytes = 0
+    for width_chars in output_width_list(output_width_chars):
+        rows = max(1, int(width_chars * (height / float(width)) * CHAR_ASPECT_RATIO_CORRECTION))
+        canvas_width = int(math.ceil(width_chars * char_width))
+        canvas_pixels = canvas_width * rows * line_spacing
+        if RESIZE_OUTPUT:
+            canvas_pixels += canvas_width * int(canvas_width * height / float(width))
+        render_bytes = max(render_bytes, canvas_pixels * MEMORY_BYTES_PER_PIXEL + width_chars * rows * MEMORY_BYTES_PER_CELL)
+    return int(MEMORY_WORKER_BASE_BYTES + source_bytes + render_bytes)
+
+
+def _file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DEDUPE_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def find_duplicate_images(image_paths):
+    """
+    找出内容完全相同的输入图像: 先按文件大小分组，只对大小相同的文件计算哈希 (BLAKE2b)。
+    返回 (需要渲染的路径列表, {代表路径: [内容相同的其他路径]})，每组按路径排序取第一个作为代表。
+    无法读取的文件视为不重复 (由渲染步骤报告错误)。
+    """
+    by_size = collections.defaultdict(list)
+    for path in image_paths:
+        try:
+            by_size[os.path.getsize(path)].append(path)
+        except OSError:
+            continue
+    duplicates = {}
+    skipped = set()
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        by_digest = collections.defaultdict(list)
+        for path in sorted(same_size):
+            try:
+                by_digest[_file_digest(path)].append(path)
+            except OSError as e:
+                logger.debug(f"计算 '{path}' 的哈希失败: {e}")
+        for group in by_digest.values():
+            if len(group) > 1:
+                duplicates[group[0]] = group[1:]
+                skipped.update(group[1:])
+    return [path for path in image_paths if path not in skipped], duplicates
 
-# ==============================================================================
-# *** 修改后的 process_directory 函数 ***
-# ==============================================================================
-# 修改签名，接收 filter_settings, config_filepath, 和 themes_list_to_generate
-def process_directory(dir_path, font_info, themes_config, output_width_chars,
-                      filter_settings, config_filepath, themes_list_to_generate): # <-- 新增 themes_list_to_generate
+
+def link_duplicate_outputs(source_path, duplicate_paths, base_output_dir, output_width_chars,
+                           filter_settings, themes_list_to_generate, edge_threshold=None, dither_settings=None):
     """
-    扫描目录，使用进程池并行处理所有支持的图像。
-    传递 font_info, filter_settings 和 themes_list_to_generate 给子进程。
-    在主输出目录创建后，复制 config.ini。
-    目录名包含滤波器信息。
+    把代表图像的输出以重复图像应有的文件名放到各自的子目录中: 优先硬链接，文件系统不支持时复制。
+    返回 {'success': 数量, 'failed': 数量} (按宽度 x 主题计数，与 process_image_to_ascii_themes 一致)。
     """
-    print(f"\n正在处理目录: {dir_path}")
-    # 计算可能的总失败数（如果一个文件失败，所有主题都计入）
-    num_themes_per_file = len(themes_list_to_generate)
-    overall_results = {'processed_files': 0, 'total_success': 0, 'total_failed': 0, 'output_location': None}
-    start_dir_processing_time = time.perf_counter()
+    results = {'success': 0, 'failed': 0}
+    source_stem, _ = os.path.splitext(os.path.basename(source_path))
+    outputs = [(width, theme) for width in output_width_list(output_width_chars) for theme in themes_list_to_generate]
+    for duplicate_path in duplicate_paths:
+        duplicate_stem, _ = os.path.splitext(os.path.basename(duplicate_path))
+        duplicate_dir = os.path.join(base_output_dir, duplicate_stem)
+        try:
+            os.makedirs(duplicate_dir, exist_ok=True)
+        except OSError as e:
+            logger.error(f"无法创建输出子目录 '{duplicate_dir}': {e}。")
+            results['failed'] += len(outputs)
+            continue
+        for output_width, theme_name in outputs:
+            source_output = os.path.join(base_output_dir, source_stem, build_output_filename(
+                source_stem, output_width, theme_name, filter_settings, edge_threshold, dither_settings))
+            duplicate_output = os.path.join(duplicate_dir, build_output_filename(
+                duplicate_stem, output_width, theme_name, filter_settings, edge_threshold, dither_settings))
+            if not os.path.exists(source_output):
+                results['failed'] += 1 # 代表图像的这个主题渲染失败
+                continue
+            if os.path.abspath(duplicate_output) == os.path.abspath(source_output):
+                results['success'] += 1 # 同名不同扩展名的文件共用同一个输出
+                continue
+            try:
+                if os.path.lexists(duplicate_output):
+                    os.remove(duplicate_output)
+                try:
+                    os.link(source_output, duplicate_output)
+                except OSError:
+                    import shutil # 延迟导入: 只在无法硬链接时需要
+                    shutil.copy2(source_output, duplicate_output)
+                results['success'] += 1
+            except OSError as e:
+                logger.warning(f"无法为重复图像 '{os.path.basename(duplicate_path)}' 生成输出: {e}")
+                results['failed'] += 1
+    return results
+
+
+# --- 性能分析报告 ---
+def write_profile_report(profile_stats_dir, report_dir):
+    """合并工作进程的性能统计，在 report_dir 中写出文本报告和折叠栈文件。"""
+    import profiling # 延迟导入: 只有启用性能分析时才需要 cProfile/pstats
+    report_path = os.path.join(report_dir, profiling.PROFILE_REPORT_FILENAME)
+    collapsed_path = os.path.join(report_dir, profiling.PROFILE_COLLAPSED_FILENAME)
+    try:
+        merged_count = profiling.merge_profile_stats(profile_stats_dir, report_path, collapsed_path)
+    except Exception as e:
+        logger.warning(f"合并性能分析统计失败: {e}")
+        return False
+    if merged_count == 0:
+        logger.warning(f"在 '{profile_stats_dir}' 中未找到性能分析统计文件。")
+        return False
+    logger.info(f"已合并 {merged_count} 个工作进程的性能统计。")
+    logger.info(f"  报告: {report_path}")
+    logger.info(f"  折叠栈 (火焰图): {collapsed_path}")
+    return True
+
 
+def directory_output_path(dir_path, output_width_chars, filter_settings):
+    """返回目录模式的主输出目录路径 (与输入目录同级，名称包含宽度和滤波器类型)，不创建目录。"""
     dir_name = os.path.basename(os.path.normpath(dir_path))
     parent_dir = os.path.dirname(os.path.abspath(dir_path))
 
-    # --- 确定滤波器标识用于文件夹命名 (代码不变) ---
+    # --- 确定滤波器标识用于文件夹命名 ---
     filter_tag = "nofilter"
     if filter_settings.get("enable_filter", False):
         filter_type = filter_settings.get("filter_type", "gaussian")
@@ -705,96 +1538,1008 @@ def process_directory(dir_path, font_info, themes_config, output_width_chars,
         elif filter_type == 'median':
             filter_tag = 'median'
 
-    # --- 主输出目录名包含宽度和滤波器类型 (代码不变) ---
-    main_output_dir = os.path.join(parent_dir, f"{dir_name}_ascii_art_{output_width_chars}w_{filter_tag}")
-    overall_results['output_location'] = main_output_dir
+    # --- 主输出目录名包含宽度和滤波器类型 ---
+    return os.path.join(parent_dir, f"{dir_name}_ascii_art_{format_width_tag(output_width_chars)}_{filter_tag}")
+
 
+def prepare_directory_output(dir_path, output_width_chars, filter_settings, config_filepath):
+    """
+    创建目录模式的主输出目录 (见 directory_output_path) 并复制 config.ini。
+    返回主输出目录路径；无法创建时返回 None。
+    """
+    main_output_dir = directory_output_path(dir_path, output_width_chars, filter_settings)
     try:
         os.makedirs(main_output_dir, exist_ok=True)
-        print(f"主输出目录: {main_output_dir}")
+        logger.info(f"主输出目录: {main_output_dir}")
+    except OSError as e:
+        logger.error(f"无法创建主输出目录 '{main_output_dir}': {e}。")
+        return None
 
-        # --- 复制配置文件 (代码不变) ---
-        if os.path.exists(config_filepath):
-            try:
-                dest_config_path = os.path.join(main_output_dir, "config_used.txt")
-                shutil.copy2(config_filepath, dest_config_path) # copy2 尝试保留元数据
-                print(f"  已将配置文件复制到: {dest_config_path}")
-            except Exception as copy_err:
-                print(f"  警告：复制配置文件 '{config_filepath}' 到输出目录失败: {copy_err}")
-        else:
-             print(f"  警告：未找到原始配置文件 '{config_filepath}'，无法复制。")
+    copy_config_to_output(config_filepath, main_output_dir)
+    return main_output_dir
+
+
+def copy_config_to_output(config_filepath, output_dir):
+    """把使用的 config.ini 复制为输出目录中的 config_used.txt，返回是否成功。"""
+    if not os.path.exists(config_filepath):
+        logger.warning(f"未找到原始配置文件 '{config_filepath}'，无法复制。")
+        return False
+    import shutil # 延迟导入: 只在复制配置文件时需要
+    dest_config_path = os.path.join(output_dir, "config_used.txt")
+    try:
+        shutil.copy2(config_filepath, dest_config_path) # copy2 尝试保留元数据
+    except Exception as copy_err:
+        logger.warning(f"复制配置文件 '{config_filepath}' 到输出目录失败: {copy_err}")
+        return False
+    logger.info(f"已将配置文件复制到: {dest_config_path}")
+    return True
 
+
+def open_output_archive(main_output_dir, archive_format, config_filepath):
+    """
+    创建输出归档 (主输出目录名 + .zip 或 .tar) 并写入 config_used.txt，返回 archive_io.ArchiveWriter；
+    无法创建时返回 None。
+    """
+    archive_path = main_output_dir + ('.zip' if archive_format == 'zip' else '.tar')
+    try:
+        writer = archive_io.ArchiveWriter(archive_path)
+    except OSError as e:
+        logger.error(f"无法创建输出归档 '{archive_path}': {e}。")
+        return None
+    logger.info(f"输出归档: {archive_path}")
+    try:
+        with open(config_filepath, 'rb') as f:
+            writer.add("config_used.txt", f.read())
     except OSError as e:
-        print(f"错误：无法创建主输出目录 '{main_output_dir}': {e}。")
+        logger.warning(f"无法把配置文件 '{config_filepath}' 写入输出归档: {e}")
+    return writer
+
+
+# ==============================================================================
+# *** 修改后的 process_directory 函数 ***
+# ==============================================================================
+# 修改签名，接收 filter_settings, config_filepath, 和 themes_list_to_generate
+def process_directory(dir_path, font_info, themes_config, output_width_chars,
+                      filter_settings, config_filepath, themes_list_to_generate, # <-- 新增 themes_list_to_generate
+                      enable_profiling=False, char_lut=None, edge_threshold=None, dither_settings=None,
+                      dedupe_inputs=True, pipeline_settings=None, memory_budget=None, tuning=None, metrics=None,
+                      output_archive=None):
+    """
+    扫描目录，使用进程池并行处理所有支持的图像。
+    传递 font_info, filter_settings 和 themes_list_to_generate 给子进程。
+    在主输出目录创建后，复制 config.ini。
+    目录名包含滤波器信息。
+    enable_profiling 为 True 时，每个工作任务在 cProfile 下运行，结束后合并报告。
+    目录中只有一个图像时直接在主进程中处理，不创建进程池；
+    多个图像时按只读图像头估算的成本安排任务 (大图像先提交，小图像打包，见 plan_directory_tasks)。
+    dedupe_inputs 为 True 时，内容完全相同的图像只渲染一次，其余的输出通过硬链接 (或复制) 生成。
+    pipeline_settings 为 {'io_threads': 线程数, 'queue_size': 队列长度} 时使用流水线模式 (见 process_directory_pipelined)。
+    memory_budget 为内存预算 (字节，None 表示不限制): 按图像头估算每个任务的峰值内存，
+    同时运行的任务估算之和不超过预算，大图像在内存不足时延后处理而不是一起运行。
+    tuning 为 --calibrate 得到的设置 {'workers': 数量, 'backend': 'process' 或 'thread', 'batch_target_cost': 成本}，
+    None 表示默认 (每个 CPU 一个工作进程)。
+    metrics 为 batch_metrics.BatchMetrics 时记录每张图像的结果、各阶段耗时和写出的字节数 (--metrics-file)。
+    output_archive 为 'zip' 或 'tar' 时所有输出写入一个归档 (主输出目录名 + 扩展名)，不创建输出目录:
+    总是使用流水线模式，工作进程返回编码好的 PNG，由一个写入线程写入归档。
+    """
+    logger.info(f"正在处理目录: {dir_path}")
+    # 计算可能的总失败数（如果一个文件失败，所有主题都计入）
+    num_themes_per_file = len(themes_list_to_generate)
+    num_outputs_per_file = num_themes_per_file * len(output_width_list(output_width_chars))
+    overall_results = {'processed_files': 0, 'total_success': 0, 'total_failed': 0, 'output_location': None}
+    start_dir_processing_time = time.perf_counter()
+
+    if output_archive:
+        main_output_dir = directory_output_path(dir_path, output_width_chars, filter_settings)
+    else:
+        main_output_dir = prepare_directory_output(dir_path, output_width_chars, filter_settings, config_filepath)
+    if main_output_dir is None:
         overall_results['total_failed'] = 1 # 标记失败，因为无法创建输出目录
         return overall_results # 提前返回
+    overall_results['output_location'] = main_output_dir
 
     # --- 扫描和处理逻辑 ---
-    print("正在扫描支持的图像文件...")
+    logger.info("正在扫描支持的图像文件...")
     found_files = []
     try:
         for entry in os.scandir(dir_path):
              if entry.is_file() and entry.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
                  found_files.append(entry.path)
     except Exception as e:
-        print(f"扫描目录 '{dir_path}' 时出错: {e}")
+        logger.error(f"扫描目录 '{dir_path}' 时出错: {e}")
         overall_results['total_failed'] = 1
         return overall_results
 
     if not found_files:
-        print("在目录中未找到支持的图像文件。")
+        logger.info("在目录中未找到支持的图像文件。")
         return overall_results
 
+    overall_results['processed_files'] = len(found_files)
+    duplicates = {}
+    if dedupe_inputs:
+        found_files, duplicates = find_duplicate_images(found_files)
+        num_duplicates = sum(len(paths) for paths in duplicates.values())
+        overall_results['renders_saved'] = num_duplicates
+        if num_duplicates:
+            logger.info(f"发现 {num_duplicates} 个与其他文件内容相同的图像，每组只渲染一次。")
     num_files = len(found_files)
-    print(f"找到 {num_files} 个支持的图像文件。开始并行处理...")
-    overall_results['processed_files'] = num_files
+    if metrics is not None:
+        metrics.add_planned(overall_results['processed_files']) # 包括重复图像，与处理摘要一致
+
+    archive_writer = None
+    if output_archive:
+        archive_writer = open_output_archive(main_output_dir, output_archive, config_filepath)
+        if archive_writer is None:
+            overall_results['total_failed'] = 1
+            return overall_results
+        overall_results['output_location'] = archive_writer.path
+        if pipeline_settings is None:
+            pipeline_settings = {"io_threads": DEFAULT_PIPELINE_IO_THREADS, "queue_size": DEFAULT_PIPELINE_QUEUE_SIZE}
+
+    def save_to_archive(image_path, output_width, theme_name, png_bytes):
+        # 内容相同的图像在归档中各有自己的成员，使用同一份 PNG 字节
+        for path in [image_path] + duplicates.get(image_path, []):
+            stem, _ = os.path.splitext(os.path.basename(path))
+            archive_writer.add(f"{stem}/" + build_output_filename(stem, output_width, theme_name, filter_settings,
+                                                                  edge_threshold, dither_settings), png_bytes)
+
+    # 除图像路径外，所有任务共用的参数
+    common_args = (
+        font_info,                     # <-- 传递 font_info
+        themes_config,
+        main_output_dir,               # <-- 使用新的目录名
+        output_width_chars,
+        filter_settings,               # <-- 传递 filter_settings
+        themes_list_to_generate,       # <-- 新增：传递主题列表
+        char_lut,                      # 字符查找表 (主进程中准备一次)
+        edge_threshold,                # 边缘模式阈值 (None 表示关闭)
+        dither_settings                # 抖动设置 (None 表示不抖动)
+    )
+
+    # 内存准入控制用的峰值内存估算 (只读取图像头)
+    cell_size = measure_cell_size(font_info) if memory_budget is not None else None
+    if memory_budget is not None:
+        logger.info(f"内存预算: {memory_budget / 2**20:.0f} MB")
+
+    def task_image_memory(image_path):
+        if cell_size is None:
+            return 0
+        return estimate_image_memory(image_path, output_width_chars, cell_size, filter_settings, edge_threshold)
+
+    # 每个任务处理一组图像 (大图像单独一组，小图像打包)，见 plan_directory_tasks
+    task_function = process_image_batch
+    profile_stats_dir = None
+    if enable_profiling:
+        import profiling # 延迟导入: 只有启用性能分析时才需要 cProfile/pstats
+        profile_stats_dir = os.path.join(main_output_dir, profiling.PROFILE_STATS_DIRNAME)
+        logger.info(f"性能分析已启用，工作进程统计将写入: {profile_stats_dir}")
+        # 由 run_profiled 包装实际的任务函数，统计写入每个工作进程自己的文件
+        task_function = functools.partial(profiling.run_profiled, profile_stats_dir, process_image_batch)
+
+    def record_batch(image_paths, get_batch_results, progress):
+        try:
+            batch_results = get_batch_results()
+        except Exception as exc:
+            logger.error(f"处理图像 {', '.join(os.path.basename(path) for path in image_paths)} 时主进程捕获到异常: {exc}")
+            # 如果子进程异常退出，假设这些文件的所有主题都失败了
+            batch_results = [(path, None) for path in image_paths]
+        for image_path, image_results in batch_results:
+            image_basename = os.path.basename(image_path)
+            if metrics is not None:
+                metrics.observe_image(image_results, num_outputs_per_file)
+            if image_results is None:
+                overall_results['total_failed'] += num_outputs_per_file
+                image_failed = True
+            else:
+                overall_results['total_success'] += image_results.get('success', 0)
+                overall_results['total_failed'] += image_results.get('failed', 0)
+                image_failed = image_results.get('failed', 0) > 0
+                logger.debug(f"处理完成: '{image_basename}' (成功 {image_results.get('success', 0)}, 失败 {image_results.get('failed', 0)})")
+            for duplicate_path in duplicates.get(image_path, []):
+                if archive_writer is not None:
+                    # 重复图像的归档成员已由 save_to_archive 与代表图像一起写入
+                    rendered = (image_results or {}).get('success', 0)
+                    duplicate_results = {'success': rendered, 'failed': num_outputs_per_file - rendered}
+                else:
+                    duplicate_results = link_duplicate_outputs(image_path, [duplicate_path], main_output_dir,
+                                                               output_width_chars, filter_settings,
+                                                               themes_list_to_generate, edge_threshold, dither_settings)
+                overall_results['total_success'] += duplicate_results['success']
+                overall_results['total_failed'] += duplicate_results['failed']
+                if metrics is not None:
+                    metrics.observe_duplicate(duplicate_results['success'], duplicate_results['failed'])
+            progress.update(done=1, failed=1 if image_failed else 0)
+
+    if (num_files > 1 or archive_writer is not None) and pipeline_settings is not None:
+        logger.info(f"找到 {num_files} 个支持的图像文件。开始流水线处理...")
+        max_workers = tuning['workers'] if tuning else os.cpu_count() or 1
+        if metrics is not None:
+            metrics.set_workers(max_workers)
+        # 按估算成本从大到小的顺序读取 (流水线中每个任务只处理一张图像)
+        ordered_files = [path for image_paths in plan_directory_tasks(
+            found_files, output_width_chars, num_themes_per_file, max_workers) for path in image_paths]
+        with log_utils.ProgressLine(total=num_files, label="处理图像") as progress:
+            process_directory_pipelined(ordered_files, common_args, max_workers, pipeline_settings,
+                                        profile_stats_dir, record_batch, progress,
+                                        image_memory=task_image_memory, memory_budget=memory_budget,
+                                        save_output=save_to_archive if archive_writer is not None else None)
+    elif num_files == 1:
+        # 只有一个文件时在主进程中直接处理: 创建进程池、启动工作进程和重新加载字体的开销都省掉了
+        logger.info("找到 1 个支持的图像文件。开始处理...")
+        if metrics is not None:
+            metrics.set_workers(1)
+        with log_utils.ProgressLine(total=num_files, label="处理图像") as progress:
+            record_batch(found_files, lambda: task_function(found_files, *common_args), progress)
+    else:
+        import concurrent.futures # 延迟导入: 只有并行处理时才需要
+        logger.info(f"找到 {num_files} 个支持的图像文件。开始并行处理...")
+        max_workers = tuning['workers'] if tuning else os.cpu_count() or 1
+        if metrics is not None:
+            metrics.set_workers(max_workers)
+        tasks = plan_directory_tasks(found_files, output_width_chars, num_themes_per_file, max_workers,
+                                     tuning['batch_target_cost'] if tuning else SCHEDULE_BATCH_TARGET_COST)
+        # 内存预算: 每个任务的峰值内存为其中最大的图像 (同一任务内的图像依次处理)
+        pending = [(image_paths, max((task_image_memory(path) or 0) for path in image_paths)) for image_paths in tasks]
+        futures = {}
+        in_flight_memory = 0
+        delayed_logged = False
+        # 使用 try...finally 确保 executor 被关闭
+        # initializer 让工作进程使用与主进程相同的日志级别
+        if tuning and tuning['backend'] == 'thread' and not enable_profiling:
+            # 线程后端: 省去进程启动和结果传输，在 Pillow 的 C 代码 (释放 GIL) 占大部分时间时可能更快
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=log_utils.init_worker_logging,
+                initargs=(logging.getLogger().getEffectiveLevel(),)
+            )
+        try:
+            # 单行实时进度 (完成数/总数、速度、剩余时间、失败数)；每个文件的详情只在调试级别输出
+            with log_utils.ProgressLine(total=num_files, label="处理图像") as progress:
+                while pending or futures:
+                    # 任务已按估算成本从大到小排列；每个工作进程同时只分到一个任务，估算内存之和不超过预算
+                    for image_paths, task_memory in select_admissible_tasks(
+                            pending, len(futures), in_flight_memory, max_workers, memory_budget):
+                        if memory_budget is not None and task_memory > memory_budget:
+                            task_name = os.path.basename(image_paths[0]) + (f" 等 {len(image_paths)} 个图像" if len(image_paths) > 1 else "")
+                            logger.warning(f"'{task_name}' 的估算内存 ({task_memory / 2**20:.0f} MB) "
+                                           f"超过预算 ({memory_budget / 2**20:.0f} MB)，将单独处理。")
+                        future = executor.submit(task_function, image_paths, *common_args)
+                        futures[future] = (image_paths, task_memory)
+                        in_flight_memory += task_memory
+                    if pending and memory_budget is not None and len(futures) < max_workers and not delayed_logged:
+                        delayed_logged = True
+                        logger.info(f"内存预算 {memory_budget / 2**20:.0f} MB 已占满，部分大图像将延后处理。")
+                    done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        image_paths, task_memory = futures.pop(future)
+                        in_flight_memory -= task_memory
+                        record_batch(image_paths, future.result, progress)
+
+        finally:
+            logger.debug("正在关闭进程池...")
+            executor.shutdown(wait=True)
+            logger.debug("进程池已关闭。")
+
+    if archive_writer is not None:
+        try:
+            archive_writer.close()
+        except OSError as e:
+            logger.error(f"完成输出归档 '{archive_writer.path}' 时出错: {e}")
+            overall_results['total_failed'] += overall_results['total_success']
+            overall_results['total_success'] = 0
 
-    max_workers = None
-    futures = {}
-    # 使用 try...finally 确保 executor 被关闭
-    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    if enable_profiling:
+        write_profile_report(profile_stats_dir, main_output_dir)
+
+    end_dir_processing_time = time.perf_counter()
+    logger.info(f"目录 '{dir_path}' 处理总耗时: {end_dir_processing_time - start_dir_processing_time:.4f} 秒")
+
+    return overall_results
+
+
+def process_directory_pipelined(image_paths, common_args, max_workers, pipeline_settings,
+                                profile_stats_dir, record_batch, progress, image_memory=None, memory_budget=None,
+                                read_image=None, output_subdir=None, reader_threads=None, save_output=None):
+    """
+    流水线模式的目录处理: 读取线程把文件读入内存，进程池解码、渲染并编码 PNG，写入线程保存文件，
+    阶段之间用有界队列连接 (见 pipeline.run_pipeline)，读写等待与计算重叠，内存中的图像数量有上限。
+    common_args 与 process_image_batch 除图像路径外的参数相同；
+    每张图像完成后调用 record_batch([路径], 取结果函数, progress)。
+    profile_stats_dir 不为空时工作进程的计算任务在 cProfile 下运行。
+    image_memory(路径) 返回估算的峰值内存；memory_budget 不为 None 时计算阶段中的估算之和不超过预算。
+    read_image(路径) 返回图像字节 (默认读取文件，归档输入时从归档中读取成员)；
+    output_subdir(路径) 返回该图像输出子目录相对于主输出目录的路径 (默认为不含扩展名的文件名)，
+    输出文件名使用子目录的最后一级；reader_threads 覆盖读取线程数 (顺序读取的归档为 1)。
+    save_output(路径, 宽度, 主题, PNG 字节) 不为 None 时由它保存输出 (如写入输出归档)，只使用一个写入线程。
+    """
+    import concurrent.futures # 延迟导入: 只有并行处理时才需要
+    import pipeline # 延迟导入: 只有流水线模式才需要
+    (font_info, themes_config, main_output_dir, output_width_chars, filter_settings,
+     themes_list_to_generate, char_lut, edge_threshold, dither_settings) = common_args
+    compute_function = render_image_bytes
+    if profile_stats_dir:
+        import profiling # 延迟导入: 只有启用性能分析时才需要 cProfile/pstats
+        compute_function = functools.partial(profiling.run_profiled, profile_stats_dir, render_image_bytes)
+
+    def read(image_path):
+        if read_image is not None:
+            return read_image(image_path)
+        with open(image_path, 'rb') as f:
+            return f.read()
+
+    def compute(image_path, image_bytes):
+        return executor.submit(compute_function, image_bytes, image_path, font_info, themes_config, output_width_chars,
+                               filter_settings, themes_list_to_generate, char_lut, edge_threshold, dither_settings)
+
+    def write(image_path, render_result):
+        if output_subdir is not None:
+            relative_dir = output_subdir(image_path)
+        else:
+            relative_dir, _ = os.path.splitext(os.path.basename(image_path))
+        file_name_no_ext = os.path.basename(relative_dir)
+        image_specific_output_dir = os.path.join(main_output_dir, relative_dir)
+        failed_stages = collections.Counter(render_result.get('failed_stages', {}))
+        image_results = {'success': 0, 'failed': render_result['failed'], 'timings': dict(render_result.get('timings', {})),
+                         'bytes_written': 0, 'failed_stages': failed_stages}
+        if not render_result['outputs']:
+            return image_results
+        write_start = time.perf_counter()
+        if save_output is None:
+            os.makedirs(image_specific_output_dir, exist_ok=True)
+        for output_width, theme_name, png_bytes in render_result['outputs']:
+            if png_bytes is None:
+                continue
+            output_filename = build_output_filename(file_name_no_ext, output_width, theme_name,
+                                                    filter_settings, edge_threshold, dither_settings)
+            try:
+                if save_output is not None:
+                    save_output(image_path, output_width, theme_name, png_bytes)
+                else:
+                    with open(os.path.join(image_specific_output_dir, output_filename), 'wb') as f:
+                        f.write(png_bytes)
+                image_results['success'] += 1
+                image_results['bytes_written'] += len(png_bytes)
+            except OSError as e:
+                logger.error(f"保存 '{output_filename}' 失败: {e}")
+                image_results['failed'] += 1
+                failed_stages['write'] += 1
+        image_results['timings']['write'] = time.perf_counter() - write_start
+        return image_results
+
+    def on_done(image_path, image_results):
+        record_batch([image_path], lambda: [(image_path, image_results)], progress)
+
+    def on_error(image_path, stage, exc):
+        stage_names = {'read': "读取", 'compute': "处理", 'write': "保存"}
+        logger.error(f"{stage_names.get(stage, stage)}图像 '{os.path.basename(image_path)}' 时出错: {exc}")
+        num_outputs = len(themes_list_to_generate) * len(output_width_list(output_width_chars))
+        image_results = {'success': 0, 'failed': num_outputs, 'failed_stages': {stage: num_outputs}}
+        record_batch([image_path], lambda: [(image_path, image_results)], progress)
+
+    io_threads = pipeline_settings['io_threads']
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=log_utils.init_worker_logging,
+        initargs=(logging.getLogger().getEffectiveLevel(),)
+    )
     try:
-        for image_file_path in found_files:
-            # --- 修改：在 submit 时传递 themes_list_to_generate ---
-            future = executor.submit(
-                process_image_to_ascii_themes, # Target function
-                image_file_path,               # Args...
-                font_info,                     # <-- 传递 font_info
-                themes_config,
-                main_output_dir,               # <-- 使用新的目录名
-                output_width_chars,
-                filter_settings,               # <-- 传递 filter_settings
-                themes_list_to_generate        # <-- 新增：传递主题列表
-            )
-            futures[future] = image_file_path
+        # 每个工作进程手上最多再有一个排队的任务，计算阶段之外的图像都在有界队列中
+        pipeline.run_pipeline(image_paths, read, compute, write, on_done, on_error,
+                              reader_threads=reader_threads or io_threads,
+                              writer_threads=1 if save_output is not None else io_threads,
+                              queue_size=pipeline_settings['queue_size'], max_in_flight=2 * max_workers,
+                              cost=image_memory, cost_budget=memory_budget)
+    finally:
+        logger.debug("正在关闭进程池...")
+        executor.shutdown(wait=True)
+        logger.debug("进程池已关闭。")
 
-        processed_count = 0
-        print("--- 开始处理文件 (每个文件完成后会显示结果) ---")
-        for future in concurrent.futures.as_completed(futures):
-            image_path = futures[future]
-            image_basename = os.path.basename(image_path)
-            processed_count += 1
+
+def process_archive(archive_path, font_info, themes_config, output_width_chars, filter_settings, config_filepath,
+                    themes_list_to_generate, char_lut=None, edge_threshold=None, dither_settings=None,
+                    pipeline_settings=None, tuning=None, metrics=None, output_archive=None):
+    """
+    处理 zip / tar 归档中所有支持的图像，不解压到磁盘: 读取线程把成员读入内存，进程池解码和渲染，
+    写入线程保存输出 (流水线模式，见 process_directory_pipelined)。
+    主输出目录与归档同级 (去掉扩展名的归档名 + 宽度和滤波器类型)，每个成员的输出子目录为它在归档中的路径 (不含扩展名)。
+    zip 按未压缩大小从大到小读取；tar 只能顺序读取，按归档中的顺序用一个读取线程读取。
+    pipeline_settings 为 None 时使用默认的线程数和队列长度。
+    output_archive 为 'zip' 或 'tar' 时所有输出写入一个归档 (见 process_directory)。
+    返回与 process_directory 相同格式的结果字典。
+    """
+    logger.info(f"正在处理归档: {archive_path}")
+    num_outputs_per_file = len(themes_list_to_generate) * len(output_width_list(output_width_chars))
+    overall_results = {'processed_files': 0, 'total_success': 0, 'total_failed': 0, 'output_location': None}
+    start_time = time.perf_counter()
+
+    output_base = os.path.join(os.path.dirname(os.path.abspath(archive_path)), archive_io.archive_stem(archive_path))
+    if output_archive:
+        main_output_dir = directory_output_path(output_base, output_width_chars, filter_settings)
+    else:
+        main_output_dir = prepare_directory_output(output_base, output_width_chars, filter_settings, config_filepath)
+    if main_output_dir is None:
+        overall_results['total_failed'] = 1
+        return overall_results
+    overall_results['output_location'] = main_output_dir
+
+    try:
+        reader = archive_io.ArchiveReader(archive_path)
+    except Exception as e:
+        logger.error(f"无法打开归档 '{archive_path}': {e}")
+        overall_results['total_failed'] = 1
+        return overall_results
+
+    with reader:
+        try:
+            members = reader.list_members(SUPPORTED_IMAGE_EXTENSIONS)
+        except Exception as e:
+            logger.error(f"读取归档 '{archive_path}' 的成员列表时出错: {e}")
+            overall_results['total_failed'] = 1
+            return overall_results
+        output_subdirs = {} # 成员名 -> 输出子目录 (相对于主输出目录)
+        for name, _ in members:
+            safe_path = archive_io.safe_member_path(name)
+            if safe_path is None:
+                logger.warning(f"跳过路径不安全的归档成员 '{name}'。")
+                continue
+            output_subdirs[name] = os.path.splitext(safe_path)[0].replace('/', os.sep)
+        if reader.is_zip:
+            members = sorted(members, key=lambda member: member[1], reverse=True) # 大图像先处理
+        member_names = [name for name, _ in members if name in output_subdirs]
+        if not member_names:
+            logger.info("在归档中未找到支持的图像文件。")
+            return overall_results
+        num_files = len(member_names)
+        overall_results['processed_files'] = num_files
+
+        def record_batch(image_paths, get_batch_results, progress):
+            for name, image_results in get_batch_results():
+                if metrics is not None:
+                    metrics.observe_image(image_results, num_outputs_per_file)
+                if image_results is None:
+                    overall_results['total_failed'] += num_outputs_per_file
+                    image_failed = True
+                else:
+                    overall_results['total_success'] += image_results.get('success', 0)
+                    overall_results['total_failed'] += image_results.get('failed', 0)
+                    image_failed = image_results.get('failed', 0) > 0
+                    logger.debug(f"处理完成: '{name}' (成功 {image_results.get('success', 0)}, 失败 {image_results.get('failed', 0)})")
+                progress.update(done=1, failed=1 if image_failed else 0)
+
+        max_workers = tuning['workers'] if tuning else os.cpu_count() or 1
+        if metrics is not None:
+            metrics.add_planned(num_files)
+            metrics.set_workers(max_workers)
+        common_args = (font_info, themes_config, main_output_dir, output_width_chars, filter_settings,
+                       themes_list_to_generate, char_lut, edge_threshold, dither_settings)
+        if pipeline_settings is None:
+            pipeline_settings = {"io_threads": DEFAULT_PIPELINE_IO_THREADS, "queue_size": DEFAULT_PIPELINE_QUEUE_SIZE}
+        archive_writer = None
+        if output_archive:
+            archive_writer = open_output_archive(main_output_dir, output_archive, config_filepath)
+            if archive_writer is None:
+                overall_results['total_failed'] = 1
+                return overall_results
+            overall_results['output_location'] = archive_writer.path
+
+        def save_to_archive(name, output_width, theme_name, png_bytes):
+            relative_dir = output_subdirs[name].replace(os.sep, '/')
+            archive_writer.add(f"{relative_dir}/" + build_output_filename(
+                relative_dir.rsplit('/', 1)[-1], output_width, theme_name, filter_settings,
+                edge_threshold, dither_settings), png_bytes)
+
+        logger.info(f"在归档中找到 {num_files} 个支持的图像文件。开始处理...")
+        with log_utils.ProgressLine(total=num_files, label="处理图像") as progress:
+            process_directory_pipelined(member_names, common_args, max_workers, pipeline_settings, None,
+                                        record_batch, progress, read_image=reader.read,
+                                        output_subdir=output_subdirs.get, reader_threads=None if reader.is_zip else 1,
+                                        save_output=save_to_archive if archive_writer is not None else None)
+        if archive_writer is not None:
+            try:
+                archive_writer.close()
+            except OSError as e:
+                logger.error(f"完成输出归档 '{archive_writer.path}' 时出错: {e}")
+                overall_results['total_failed'] += overall_results['total_success']
+                overall_results['total_success'] = 0
+
+    logger.info(f"归档 '{archive_path}' 处理总耗时: {time.perf_counter() - start_time:.4f} 秒")
+    return overall_results
+
+
+def calibrate_directory(dir_path, font_info, themes_config, output_width_chars, filter_settings,
+                        config_filepath, themes_list_to_generate, char_lut=None, edge_threshold=None,
+                        dither_settings=None, sample_size=None):
+    """
+    在 dir_path 中图像的一个样本上试运行 process_directory，比较工作进程数、进程/线程后端和打包大小，
+    把最快的设置保存为本机的校准配置 (见 calibration.py)，之后处理目录时自动使用。
+    返回结果字典: 'calibration_settings'、'calibration_trials'、'calibration_profile' (保存路径，失败时为 None)。
+    """
+    import shutil # 延迟导入: 只有校准时需要
+    import tempfile
+    import calibration # 延迟导入: 只有校准时需要
+    results = {'calibration_settings': None, 'calibration_trials': [], 'calibration_profile': None}
+    try:
+        found_files = sorted(entry.path for entry in os.scandir(dir_path)
+                             if entry.is_file() and entry.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS))
+    except OSError as e:
+        logger.error(f"扫描目录 '{dir_path}' 时出错: {e}")
+        return results
+    if not found_files:
+        logger.error("在目录中未找到支持的图像文件，无法校准。")
+        return results
+    sample = calibration.pick_sample(found_files, sample_size or calibration.DEFAULT_SAMPLE_SIZE)
+    logger.info(f"校准: 使用 {len(sample)} 个样本图像 (共 {len(found_files)} 个)，"
+                f"输出宽度 {format_width_tag(output_width_chars)}，主题 {themes_list_to_generate}。")
+
+    with tempfile.TemporaryDirectory(prefix="ascii_calibration_") as temp_dir:
+        sample_dir = os.path.join(temp_dir, "sample")
+        os.makedirs(sample_dir)
+        for index, path in enumerate(sample):
+            # 加序号避免不同扩展名的同名文件冲突；优先硬链接，避免复制大文件
+            sample_path = os.path.join(sample_dir, f"{index:03d}_{os.path.basename(path)}")
+            try:
+                os.link(path, sample_path)
+            except OSError:
+                shutil.copy2(path, sample_path)
+
+        def run_trial(settings):
+            output_dir = None
+            root_logger = logging.getLogger()
+            log_level = root_logger.level
+            root_logger.setLevel(logging.WARNING) # 试运行的逐次日志和进度行没有意义
+            try:
+                start = time.perf_counter()
+                trial_results = process_directory(
+                    sample_dir, font_info, themes_config, output_width_chars, filter_settings, config_filepath,
+                    themes_list_to_generate, char_lut=char_lut, edge_threshold=edge_threshold,
+                    dither_settings=dither_settings, dedupe_inputs=False, tuning=settings)
+                elapsed = time.perf_counter() - start
+                output_dir = trial_results.get('output_location')
+            except Exception as e:
+                logger.error(f"试运行出错: {e}")
+                return None
+            finally:
+                root_logger.setLevel(log_level)
+                if output_dir:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+            if trial_results.get('total_success', 0) == 0 or elapsed <= 0:
+                return None
+            return len(sample) / elapsed
+
+        # 预热一次 (文件缓存、字体)，不计入结果
+        logger.info("校准: 预热...")
+        run_trial({'workers': os.cpu_count() or 1, 'backend': 'process', 'batch_target_cost': SCHEDULE_BATCH_TARGET_COST})
+        logger.info("校准: 试运行候选设置...")
+        best, trials = calibration.calibrate(run_trial, SCHEDULE_BATCH_TARGET_COST)
+
+    results['calibration_trials'] = trials
+    if not any(trial['images_per_second'] for trial in trials):
+        logger.error("所有试运行都失败了，未保存校准配置。")
+        return results
+    results['calibration_settings'] = best
+    context = {'input_dir': os.path.abspath(dir_path), 'sample_images': len(sample),
+               'output_widths': output_width_list(output_width_chars), 'themes': list(themes_list_to_generate)}
+    results['calibration_profile'] = calibration.save_profile(
+        os.path.dirname(os.path.abspath(config_filepath)), best, trials, context)
+    return results
+
+
+def verify_engines(input_path, font_info, themes_config, output_width_chars, filter_settings,
+                   themes_list_to_generate, char_lut=None, edge_threshold=None, dither_settings=None,
+                   pixel_tolerance=0, sample_size=None):
+    """
+    用参考实现 (reference_engine.py: 基线版本 image_to_ascii / create_ascii_png 的冻结副本) 校验优化实现:
+    对输入 (单个文件，或目录中按大小分层抽取的样本) 的每个宽度 x 主题，字符网格必须完全一致，
+    PNG 逐像素比较，各通道差值超过 pixel_tolerance 的像素计为不一致；同时统计两种实现的耗时。
+    参考实现只支持内置梯度且没有边缘模式和色调映射: 配置了这些选项时，校验改用内置梯度、关闭边缘模式和色调映射。
+    返回结果字典: 'verify_images'、'verify_cases'、'verify_grid_mismatches'、'verify_png_mismatches'、
+    'verify_mismatches' (不一致项的说明)、'verify_timings' ({'reference'/'optimized': {阶段: 秒}})、
+    'verify_speedups' ({阶段: 参考耗时 / 优化耗时})。
+    """
+    import tempfile
+    import contextlib
+    import calibration # 延迟导入: 复用按大小分层抽样
+    import verification # 延迟导入: 只有校验时需要
+    import reference_engine # 参考实现
+    results = {'verify_images': 0, 'verify_cases': 0, 'verify_grid_mismatches': 0, 'verify_png_mismatches': 0,
+               'verify_mismatches': [], 'verify_tolerance': pixel_tolerance,
+               'verify_timings': {'reference': {'ascii': 0.0, 'render': 0.0}, 'optimized': {'ascii': 0.0, 'render': 0.0}}}
+
+    if os.path.isdir(input_path):
+        try:
+            found_files = sorted(entry.path for entry in os.scandir(input_path)
+                                 if entry.is_file() and entry.name.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS))
+        except OSError as e:
+            logger.error(f"扫描目录 '{input_path}' 时出错: {e}")
+            return results
+        sample = calibration.pick_sample(found_files, sample_size or verification.DEFAULT_SAMPLE_SIZE)
+    else:
+        sample = [input_path]
+    if not sample:
+        logger.error("未找到支持的图像文件，无法校验。")
+        return results
+
+    if edge_threshold is not None or (char_lut is not None and char_lut != get_default_char_lut()):
+        logger.warning("参考实现只支持内置梯度，且没有边缘模式: 本次校验使用内置梯度、关闭边缘模式。")
+    if filter_settings.get('tone_map'):
+        logger.warning("参考实现没有色调映射: 本次校验关闭色调映射。")
+    font = get_worker_font(font_info)
+    if font is None:
+        return results
+    dither_offsets = dither_settings['offsets'] if dither_settings else None
+    timings = results['verify_timings']
+
+    def record_mismatch(kind, description):
+        results[kind] += 1
+        if len(results['verify_mismatches']) < verification.MAX_REPORTED_MISMATCHES:
+            results['verify_mismatches'].append(description)
+        logger.warning(description)
+
+    logger.info(f"正在校验 {len(sample)} 个图像 (每个 {len(output_width_list(output_width_chars))} 个宽度 x "
+                f"{len(themes_list_to_generate)} 个主题，像素容差 {pixel_tolerance})...")
+    with tempfile.TemporaryDirectory(prefix="ascii_verify_") as temp_dir, \
+            log_utils.ProgressLine(total=len(sample), label="校验图像") as progress:
+        for image_path in sample:
+            short_image_name = os.path.basename(image_path)
+            try:
+                img_to_process, original_dimensions = load_image_for_processing(image_path, filter_settings, short_image_name)
+            except Exception as e:
+                logger.error(f"打开/转换/滤波图像 '{short_image_name}' 时出错: {e}")
+                progress.update(done=1, failed=1)
+                continue
+            results['verify_images'] += 1
+            image_failed = False
+            for output_width in output_width_list(output_width_chars):
+                for theme_name in themes_list_to_generate:
+                    theme_details = themes_config[theme_name]
+                    case_name = f"'{short_image_name}' {output_width}w {theme_name}"
+                    results['verify_cases'] += 1
+                    # 参考实现用 print 输出进度和错误，校验时不显示
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        reference_grid, seconds = verification.timed(
+                            reference_engine.image_to_ascii, img_to_process, output_width, theme_name, dither_offsets)
+                    timings['reference']['ascii'] += seconds
+                    optimized_grid, seconds = verification.timed(
+                        image_to_ascii, img_to_process, output_width, theme_name, None, None, dither_offsets)
+                    timings['optimized']['ascii'] += seconds
+                    grid_mismatch = verification.compare_grids(reference_grid, optimized_grid)
+                    if grid_mismatch:
+                        record_mismatch('verify_grid_mismatches', f"{case_name}: {grid_mismatch}")
+                        image_failed = True
+                        continue # 网格不同时 PNG 必然不同，不再比较
+
+                    reference_path = os.path.join(temp_dir, "reference.png")
+                    optimized_path = os.path.join(temp_dir, "optimized.png")
+                    render_args = (theme_details["background"], theme_details.get("foreground"), original_dimensions)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        reference_ok, seconds = verification.timed(
+                            reference_engine.create_ascii_png, reference_grid, theme_name, reference_path, font, *render_args)
+                    timings['reference']['render'] += seconds
+                    optimized_ok, seconds = verification.timed(
+                        create_ascii_png, optimized_grid, theme_name, optimized_path, font, *render_args)
+                    timings['optimized']['render'] += seconds
+                    if not (reference_ok and optimized_ok):
+                        record_mismatch('verify_png_mismatches', f"{case_name}: PNG 生成失败 "
+                                        f"(参考: {'成功' if reference_ok else '失败'}，优化: {'成功' if optimized_ok else '失败'})")
+                        image_failed = True
+                        continue
+                    png_mismatch = verification.describe_image_mismatch(
+                        verification.compare_images(reference_path, optimized_path, pixel_tolerance), pixel_tolerance)
+                    if png_mismatch:
+                        record_mismatch('verify_png_mismatches', f"{case_name}: {png_mismatch}")
+                        image_failed = True
+            progress.update(done=1, failed=1 if image_failed else 0)
+    results['verify_speedups'] = {stage: verification.speedup(timings['reference'][stage], timings['optimized'][stage])
+                                  for stage in timings['reference']}
+    return results
+
+
+# --- 热文件夹监视模式 ---
+def _init_warm_worker(log_level, font_info):
+    """
+    监视/服务模式进程池 initializer: 配置日志并预先加载字体，第一张图像不必再等待。
+    工作进程忽略 SIGINT，Ctrl+C 只由主进程处理 (等待正在处理的图像完成后退出)。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log_utils.init_worker_logging(log_level)
+    get_worker_font(font_info)
+
+
+def watch_directory(dir_path, font_info, themes_config, output_width_chars,
+                    filter_settings, config_filepath, themes_list_to_generate,
+                    char_lut=None, edge_threshold=None, dither_settings=None,
+                    debounce=folder_watch.DEFAULT_DEBOUNCE_SECONDS,
+                    poll_interval=folder_watch.DEFAULT_POLL_INTERVAL, tuning=None, metrics=None):
+    """
+    监视目录 (热文件夹)，持续处理新增或修改的图像，直到按下 Ctrl+C。
+    进程池和字体在整个运行期间保持预热；每个文件版本 (修改时间, 大小) 只处理一次，
+    处理中被再次修改的文件在当前任务完成后重新处理。
+    启动时目录中已有、但输出目录中还没有对应子目录的图像也会处理。
+    tuning 不为 None 时使用其中校准得到的工作进程数。
+    metrics 为 batch_metrics.BatchMetrics 时记录每张处理完成的图像 (--metrics-file)。
+    """
+    import concurrent.futures # 延迟导入: 只有并行处理时才需要
+    logger.info(f"正在监视目录: {dir_path}")
+    num_outputs_per_file = len(themes_list_to_generate) * len(output_width_list(output_width_chars))
+    overall_results = {'processed_files': 0, 'total_success': 0, 'total_failed': 0, 'output_location': None}
+
+    main_output_dir = prepare_directory_output(dir_path, output_width_chars, filter_settings, config_filepath)
+    if main_output_dir is None:
+        overall_results['total_failed'] = 1
+        return overall_results
+    overall_results['output_location'] = main_output_dir
+
+    processed = {} # 路径 -> 已提交处理的文件签名
+    in_flight = {} # future -> (路径, 提交时间)
+    rerun = set() # 处理期间又被修改的文件
+
+    def submit(path, signature):
+        processed[path] = signature
+        task_args = (path, font_info, themes_config, main_output_dir, output_width_chars,
+                     filter_settings, themes_list_to_generate, char_lut, edge_threshold, dither_settings)
+        in_flight[executor.submit(process_image_to_ascii_themes, *task_args)] = (path, time.perf_counter())
+        if metrics is not None:
+            metrics.add_planned(1)
+
+    def collect(futures):
+        for future in futures:
+            path, submitted_at = in_flight.pop(future)
+            image_basename = os.path.basename(path)
+            overall_results['processed_files'] += 1
             try:
                 image_results = future.result()
+                if metrics is not None:
+                    metrics.observe_image(image_results, num_outputs_per_file)
                 overall_results['total_success'] += image_results.get('success', 0)
                 overall_results['total_failed'] += image_results.get('failed', 0)
-                print(f"  [进度 {processed_count}/{num_files}] 处理完成: '{image_basename}'")
+                logger.info(f"已处理 '{image_basename}' (成功 {image_results.get('success', 0)}, "
+                            f"失败 {image_results.get('failed', 0)})，耗时 {time.perf_counter() - submitted_at:.2f} 秒")
             except Exception as exc:
-                 print(f"  [进度 {processed_count}/{num_files}] 处理图像 '{image_basename}' 时主进程捕获到异常: {exc}")
-                 # 如果子进程异常退出，假设该文件的所有主题都失败了
-                 overall_results['total_failed'] += num_themes_per_file
-        print("--- 所有文件处理任务已完成 ---")
-
+                logger.error(f"处理图像 '{image_basename}' 时主进程捕获到异常: {exc}")
+                if metrics is not None:
+                    metrics.observe_image(None, num_outputs_per_file)
+                overall_results['total_failed'] += num_outputs_per_file
+            if path in rerun:
+                rerun.discard(path)
+                signature = folder_watch.file_signature(path)
+                if signature is not None and signature != processed.get(path):
+                    submit(path, signature)
+
+    num_workers = tuning['workers'] if tuning else os.cpu_count() or 1
+    if metrics is not None:
+        metrics.set_workers(num_workers)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_warm_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(), font_info)
+    )
+    try:
+        # 预热: 立即启动全部工作进程 (进程池默认按需启动)，字体在 initializer 中加载
+        concurrent.futures.wait([executor.submit(os.getpid) for _ in range(num_workers)])
+        logger.info(f"已启动 {num_workers} 个工作进程。")
+
+        with folder_watch.FolderWatcher(dir_path, SUPPORTED_IMAGE_EXTENSIONS, debounce, poll_interval) as watcher:
+            # 已有输出子目录的现有文件视为已处理；其余现有文件经过同样的防抖后处理
+            for path, signature in watcher.scan().items():
+                file_name_no_ext, _ = os.path.splitext(os.path.basename(path))
+                if os.path.isdir(os.path.join(main_output_dir, file_name_no_ext)):
+                    processed[path] = signature
+            watcher.watch_existing()
+            logger.info(f"监视方式: {watcher.mode} (防抖 {debounce} 秒)。按 Ctrl+C 停止。")
+            try:
+                while True:
+                    for path in watcher.poll():
+                        signature = folder_watch.file_signature(path)
+                        if signature is None or processed.get(path) == signature:
+                            continue
+                        if any(running_path == path for running_path, _ in in_flight.values()):
+                            rerun.add(path) # 避免两个任务同时写同一个输出
+                        else:
+                            submit(path, signature)
+                    collect([future for future in list(in_flight) if future.done()])
+            except KeyboardInterrupt:
+                logger.info(f"收到中断信号，等待 {len(in_flight)} 个正在处理的图像完成...")
+                rerun.clear()
+                collect(list(concurrent.futures.as_completed(list(in_flight))))
     finally:
-        print("正在关闭进程池...")
+        logger.debug("正在关闭进程池...")
         executor.shutdown(wait=True)
-        print("进程池已关闭。")
+        logger.debug("进程池已关闭。")
 
+    return overall_results
 
-    end_dir_processing_time = time.perf_counter()
-    print(f"目录 '{dir_path}' 处理总耗时: {end_dir_processing_time - start_dir_processing_time:.4f} 秒")
 
-    return overall_results
+# --- 本地转换服务模式 ---
+SERVICE_MAX_WIDTH_CHARS = 4096 # 服务请求允许的最大字符宽度
+SERVICE_FILTER_TYPES = ('none', 'gaussian', 'median')
+
+
+def render_ascii_png_bytes(image_bytes, font_info, theme_name, output_width_chars, filter_settings,
+                           char_lut=None, edge_threshold=None, dither_settings=None):
+    """
+    服务模式的工作进程任务: 把内存中的图像字节渲染为单个主题的 PNG 字节。
+    返回 {'png': PNG 字节或 None, 'error': 失败原因或 None, 'timings': {阶段: 秒}}。
+    """
+    result = {'png': None, 'error': None, 'timings': {}}
+    timings = result['timings']
+    font = get_worker_font(font_info)
+    if font is None:
+        result['error'] = "字体加载失败"
+        return result
+
+    stage_start = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img_opened:
+            original_dimensions = img_opened.size
+            img_rgb = img_opened.convert('RGB')
+    except Exception as e:
+        result['error'] = f"无法解码图像: {e}"
+        return result
+    now = time.perf_counter()
+    timings['decode'], stage_start = now - stage_start, now
+
+    img_rgb = apply_image_filter(img_rgb, filter_settings, "请求图像")
+    now = time.perf_counter()
+    timings['filter'], stage_start = now - stage_start, now
+
+    dither_offsets = dither_settings['offsets'] if dither_settings else None
+    ascii_char_color_data = image_to_ascii(img_rgb, output_width_chars, theme_name, char_lut,
+                                           edge_threshold, dither_offsets, tone_settings=filter_settings.get('tone_map'))
+    now = time.perf_counter()
+    timings['ascii'], stage_start = now - stage_start, now
+    if not ascii_char_color_data:
+        result['error'] = "生成 ASCII 数据失败"
+        return result
+
+    theme_details = COLOR_THEMES[theme_name]
+    buffer = io.BytesIO()
+    if not create_ascii_png(ascii_char_color_data, theme_name, buffer, font,
+                            theme_details["background"], theme_details.get("foreground"), original_dimensions):
+        result['error'] = "创建 PNG 失败"
+        return result
+    timings['render'] = time.perf_counter() - stage_start
+    result['png'] = buffer.getvalue()
+    return result
+
+
+def parse_render_params(query, default_width, default_theme, default_filter_settings):
+    """
+    把服务请求的查询参数 (parse_qs 的结果) 转换为渲染参数，未给出的参数使用配置中的值。
+    支持 width, theme, filter (none/gaussian/median), radius, median_size, tone (none/autocontrast/equalize/clahe)；
+    参数无效时抛出 ValueError。
+    """
+    def single(name):
+        values = query.get(name)
+        return values[-1].strip() if values else None
+
+    params = {'output_width_chars': default_width, 'theme_name': default_theme,
+              'filter_settings': dict(default_filter_settings)}
+    width_text = single('width')
+    if width_text is not None:
+        try:
+            width = int(width_text)
+        except ValueError:
+            raise ValueError(f"width 必须是整数: '{width_text}'") from None
+        if not 1 <= width <= SERVICE_MAX_WIDTH_CHARS:
+            raise ValueError(f"width 必须在 1 到 {SERVICE_MAX_WIDTH_CHARS} 之间: {width}")
+        params['output_width_chars'] = width
+
+    theme = single('theme')
+    if theme is not None:
+        if theme not in COLOR_THEMES:
+            raise ValueError(f"未知主题 '{theme}' (可选: {', '.join(COLOR_THEMES)})")
+        params['theme_name'] = theme
+
+    filter_settings = params['filter_settings']
+    filter_type = single('filter')
+    if filter_type is not None:
+        filter_type = filter_type.lower()
+        if filter_type not in SERVICE_FILTER_TYPES:
+            raise ValueError(f"未知滤波器 '{filter_type}' (可选: {', '.join(SERVICE_FILTER_TYPES)})")
+        filter_settings['enable_filter'] = filter_type != 'none'
+        if filter_type != 'none':
+            filter_settings['filter_type'] = filter_type
+    radius_text = single('radius')
+    if radius_text is not None:
+        try:
+            radius = float(radius_text)
+        except ValueError:
+            raise ValueError(f"radius 必须是数字: '{radius_text}'") from None
+        if not radius > 0:
+            raise ValueError(f"radius 必须 > 0: {radius}")
+        filter_settings['filter_gaussian_radius'] = radius
+    median_text = single('median_size')
+    if median_text is not None:
+        try:
+            median_size = int(median_text)
+        except ValueError:
+            raise ValueError(f"median_size 必须是整数: '{median_text}'") from None
+        if median_size < 3 or median_size % 2 == 0:
+            raise ValueError(f"median_size 必须是 >= 3 的奇数: {median_size}")
+        filter_settings['filter_median_size'] = median_size
+    tone_mode = single('tone')
+    if tone_mode is not None:
+        tone_mode = tone_mode.lower()
+        if tone_mode not in tone_mapping.TONE_MODES:
+            raise ValueError(f"未知色调映射 '{tone_mode}' (可选: {', '.join(tone_mapping.TONE_MODES)})")
+        if tone_mode == 'none':
+            filter_settings['tone_map'] = None
+        else:
+            filter_settings['tone_map'] = dict(filter_settings.get('tone_map') or {}, tone_mode=tone_mode)
+    return params
+
+
+def serve(address, font_info, output_width_chars, filter_settings, default_theme,
+          char_lut=None, edge_threshold=None, dither_settings=None,
+          queue_size=DEFAULT_SERVICE_QUEUE_SIZE, max_upload_mb=DEFAULT_SERVICE_MAX_UPLOAD_MB):
+    """
+    以本地服务方式运行 (见 ascii_service)，直到按下 Ctrl+C。
+    工作进程在启动时创建并加载字体，之后所有请求复用；字符梯度、边缘和抖动设置取自配置。
+    返回 {'requests_total': 渲染请求数, 'requests_failed': 失败或被拒绝的请求数}。
+    """
+    import concurrent.futures # 延迟导入: 只有并行处理时才需要
+    import ascii_service # 延迟导入: 只有服务模式需要 http.server
+    try:
+        ascii_service.parse_address(address)
+    except ValueError as e:
+        logger.error(f"无法启动服务: {e}")
+        return {'requests_total': 0, 'requests_failed': 0}
+    num_workers = os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_warm_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(), font_info)
+    )
+    try:
+        # 预热: 立即启动全部工作进程，字体在 initializer 中加载
+        concurrent.futures.wait([executor.submit(os.getpid) for _ in range(num_workers)])
+
+        def parse_params(query):
+            return parse_render_params(query, output_width_chars, default_theme, filter_settings)
+
+        def submit(image_bytes, params):
+            return executor.submit(render_ascii_png_bytes, image_bytes, font_info, params['theme_name'],
+                                   params['output_width_chars'], params['filter_settings'],
+                                   char_lut, edge_threshold, dither_settings)
+
+        return ascii_service.run_service(address, submit, parse_params, num_workers, queue_size,
+                                         max_upload_mb * 1024 * 1024)
+    finally:
+        logger.debug("正在关闭进程池...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        logger.debug("进程池已关闭。")
+
+
+# --- stdin/stdout 管道模式 ---
+PIPE_FORMATS = ('png', 'text') # --pipe-format 可选的输出格式
+
+
+def render_pipe_output(image_bytes, font_info, theme_name, output_width_chars, filter_settings, output_format='png',
+                       char_lut=None, edge_threshold=None, dither_settings=None):
+    """
+    管道模式 (--pipe) 的渲染: 把内存中的一张图像渲染为单个主题的 PNG 字节，
+    或 UTF-8 文本 (每行字符一行，不需要字体和主题)。失败时记录错误并返回 None。
+    """
+    if output_format == 'text':
+        try:
+            img_to_process, _ = load_image_for_processing(io.BytesIO(image_bytes), filter_settings, "管道输入")
+        except Exception as e:
+            logger.error(f"无法解码管道输入的图像: {e}")
+            return None
+        dither_offsets = dither_settings['offsets'] if dither_settings else None
+        ascii_char_color_data = image_to_ascii(img_to_process, output_width_chars, theme_name, char_lut,
+                                               edge_threshold, dither_offsets, tone_settings=filter_settings.get('tone_map'))
+        if not ascii_char_color_data:
+            return None
+        return "".join("".join(char for char, _ in row) + "\n" for row in ascii_char_color_data).encode('utf-8')
+
+    result = render_ascii_png_bytes(image_bytes, font_info, theme_name, output_width_chars, filter_settings,
+                                    char_lut, edge_threshold, dither_settings)
+    if result['png'] is None:
+        logger.error(f"渲染管道输入失败: {result['error']}")
+    return result['png']
 
 
 # --- 输入和摘要函数 (无变化) ---
@@ -851,19 +2596,61 @@ def print_summary(results, duration):
         if (success_count > 0 or fail_count > 0) and output_location:
             print(f"输出基目录：{os.path.dirname(output_location)}")
             print(f"图像子目录：{os.path.basename(output_location)}")
-    elif input_type == 'directory':
+    elif input_type in ('directory', 'archive'):
         processed_files = results.get('processed_files', 0)
         success_count = results.get('total_success', 0)
         fail_count = results.get('total_failed', 0)
-        print(f"输入类型：目录")
+        print(f"输入类型：{'目录' if input_type == 'directory' else '归档 (zip/tar)'}")
         print(f"找到/尝试处理的图像文件数：{processed_files}")
         if themes_generated:
             print(f"每个文件尝试生成的主题: {themes_generated}")
         print(f"成功生成的 PNG 总数（跨所有文件和主题）：{success_count}")
         print(f"失败/跳过的主题尝试总数（跨所有文件）：{fail_count}")
+        if results.get('renders_saved'):
+            print(f"内容重复、复用已有渲染的图像数：{results['renders_saved']}")
         if output_location:
-            print(f"主输出目录：{output_location}")
-            print(f" (每个图像的结果保存在其对应的子目录中)")
+            if output_location.endswith(archive_io.ARCHIVE_EXTENSIONS):
+                print(f"输出归档：{output_location}")
+                print(" (每个图像的结果保存在归档中对应的子目录中)")
+            else:
+                print(f"主输出目录：{output_location}")
+                print(" (每个图像的结果保存在其对应的子目录中)")
+    elif input_type == 'calibration':
+        settings = results.get('calibration_settings')
+        print("运行方式：性能校准")
+        print(f"试运行次数：{len(results.get('calibration_trials', []))}")
+        if settings:
+            best_throughput = max(trial['images_per_second'] or 0 for trial in results['calibration_trials'])
+            print(f"最快设置：{settings['backend']} 后端，工作数 {settings['workers']}，"
+                  f"打包成本 {settings['batch_target_cost']:.0f} ({best_throughput:.2f} 张/秒)")
+        if results.get('calibration_profile'):
+            print(f"已保存到：{results['calibration_profile']} (之后在本机处理目录时自动使用)")
+        else:
+            print("状态：失败（未保存校准配置）")
+    elif input_type == 'verification':
+        grid_mismatches = results.get('verify_grid_mismatches', 0)
+        png_mismatches = results.get('verify_png_mismatches', 0)
+        print("运行方式：参考实现校验")
+        print(f"校验的图像数：{results.get('verify_images', 0)} (宽度 x 主题组合 {results.get('verify_cases', 0)} 个)")
+        print(f"  - 字符网格不一致：{grid_mismatches}")
+        print(f"  - PNG 超出像素容差 ({results.get('verify_tolerance', 0)})：{png_mismatches}")
+        for description in results.get('verify_mismatches', []):
+            print(f"    {description}")
+        timings = results.get('verify_timings', {})
+        for stage, stage_name in (('ascii', "字符网格"), ('render', "PNG 渲染")):
+            reference_seconds = timings.get('reference', {}).get(stage, 0.0)
+            optimized_seconds = timings.get('optimized', {}).get(stage, 0.0)
+            ratio = results.get('verify_speedups', {}).get(stage)
+            print(f"{stage_name}耗时：参考 {reference_seconds:.4f} 秒，优化 {optimized_seconds:.4f} 秒"
+                  + (f" (加速 {ratio:.1f}x)" if ratio else ""))
+        if not results.get('verify_cases'):
+            print("状态：失败（没有可校验的图像）")
+        else:
+            print(f"状态：{'通过' if not (grid_mismatches or png_mismatches) else '不一致'}")
+    elif input_type == 'service':
+        print("运行方式：本地转换服务")
+        print(f"渲染请求总数：{results.get('requests_total', 0)}")
+        print(f"  - 失败/被拒绝的请求数：{results.get('requests_failed', 0)}")
     else:
         print(f"状态：未知 ({input_type})")
 
@@ -876,12 +2663,57 @@ def print_summary(results, duration):
 # ==============================================================================
 # *** 修改后的 main 函数 ***
 # ==============================================================================
-def main():
+def parse_args(argv=None):
+    """解析命令行参数。未提供输入路径时，main 会交互式询问。"""
+    parser = argparse.ArgumentParser(description="ASCII 艺术生成器")
+    parser.add_argument("input_path", nargs="?", default=None,
+                        help="图像文件、目录或 zip/tar 归档的路径 (省略时交互式输入)")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="输出每个文件的详细信息 (调试级别)")
+    parser.add_argument("-q", "--quiet", action="count", default=0,
+                        help="只输出警告和错误")
+    parser.add_argument("--widths", type=parse_width_list, default=None, metavar="LIST",
+                        help="逗号分隔的输出宽度 (字符数)，例如 128,256,512；"
+                             "每个图像只解码一次，生成所有宽度 (覆盖 config.ini 的 OUTPUT_WIDTH_CHARS)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="目录模式使用流水线: 读取/写入在线程中进行，与进程池中的渲染重叠 (也可在 config.ini [Batch] PIPELINE 中启用)")
+    parser.add_argument("--output-archive", choices=OUTPUT_ARCHIVE_FORMATS, default=None,
+                        help="目录/归档模式把所有输出写入一个不压缩的 zip 或 tar 归档，而不是大量小文件 "
+                             "(覆盖 config.ini [Batch] OUTPUT_ARCHIVE)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="在输入目录的样本上试运行不同的并行设置，保存本机最快的设置供之后的运行使用")
+    parser.add_argument("--verify", action="store_true",
+                        help="用参考实现 (基线版本的 image_to_ascii / create_ascii_png，见 reference_engine.py) "
+                             "校验输入文件或目录样本的字符网格和 PNG，报告不一致项和加速比 (容差和样本数见 config.ini [Verify])")
+    parser.add_argument("--metrics-file", default=None, metavar="PATH",
+                        help="运行期间定期把 Prometheus 文本格式的指标写入 PATH (textfile collector)，"
+                             "结束时写入最终值 (覆盖 config.ini [Metrics] TEXTFILE)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="监视输入目录，持续处理新增或修改的图像 (按 Ctrl+C 停止)")
+    parser.add_argument("--pipe", action="store_true",
+                        help="管道模式: 从 stdin 读取一张图像，把结果写到 stdout (不创建文件，不交互式询问)；"
+                             "使用配置中的第一个宽度和第一个主题")
+    parser.add_argument("--framed", action="store_true",
+                        help="管道模式的输入和输出都是分帧的图像流 (每帧为 8 字节大端长度 + 数据，失败的图像输出空帧)；隐含 --pipe")
+    parser.add_argument("--pipe-format", choices=PIPE_FORMATS, default='png',
+                        help="管道模式的输出格式: png (默认) 或 text (UTF-8 字符画文本)")
+    parser.add_argument("--serve", nargs="?", const="", default=None, metavar="ADDRESS",
+                        help="以本地转换服务方式运行，监听 host:port 或 unix:/path.sock "
+                             "(省略地址时使用 config.ini [Service] ADDRESS)")
+    return parser.parse_args(argv)
+
+
+def main(args=None):
     """主执行函数。"""
-    print("--- ASCII 艺术生成器 ---")
+    if args is None:
+        args = parse_args()
+    log_utils.setup_logging(args.verbose - args.quiet)
+    logger.info("--- ASCII 艺术生成器 ---")
     results = {'input_type': 'unknown'}
     start_time = time.perf_counter()
     font_info = None
+    metrics_exporter = None
+    pipe_mode = args.pipe or args.framed # 管道模式下 stdout 只输出结果数据，不打印摘要
 
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -890,10 +2722,13 @@ def main():
 
         # --- 加载配置 (现在包含滤波和主题列表设置) ---
         config = load_config(config_filepath)
-        output_width_chars = config["output_width_chars"]
+        output_widths = args.widths or config["output_widths"]
+        # 单个宽度时保持为整数；多个宽度时以列表传给处理函数，每个图像只解码一次
+        output_width_chars = output_widths[0] if len(output_widths) == 1 else output_widths
         font_filename = config["font_filename"]
         font_size = config["font_size"]
         themes_to_generate = config["themes_to_generate"] # <-- 获取主题列表
+        enable_profiling = config["enable_profiling"]
         results['themes_generated_list'] = themes_to_generate # <-- 存储用于摘要
         # --- 提取滤波设置 (代码不变) ---
         filter_settings = {
@@ -901,7 +2736,16 @@ def main():
             "filter_type": config.get("filter_type", "gaussian"),
             "filter_gaussian_radius": config.get("filter_gaussian_radius", 1.0),
             "filter_median_size": config.get("filter_median_size", 3),
+            # 色调映射作用于采样后的字符网格 (不是源图像)，随滤波设置一起传给工作进程
+            "tone_map": None,
         }
+        if config["tone_mode"] != 'none':
+            filter_settings["tone_map"] = {
+                "tone_mode": config["tone_mode"],
+                "clip_percent": config["tone_clip_percent"],
+                "clahe_tiles": config["tone_clahe_tiles"],
+                "clahe_clip_limit": config["tone_clahe_clip_limit"],
+            }
 
         # --- 确定滤波器标识用于文件夹命名 (代码不变) ---
         filter_tag = "nofilter"
@@ -914,38 +2758,41 @@ def main():
 
         # 打印应用的滤波设置（如果启用）(代码不变)
         if filter_settings["enable_filter"]:
-             print(f"图像预处理滤波器已启用: 类型={filter_settings['filter_type']} (标识: {filter_tag})")
+             logger.info(f"图像预处理滤波器已启用: 类型={filter_settings['filter_type']} (标识: {filter_tag})")
              if filter_settings['filter_type'] == 'gaussian':
-                 print(f"  高斯模糊半径: {filter_settings['filter_gaussian_radius']}")
+                 logger.info(f"高斯模糊半径: {filter_settings['filter_gaussian_radius']}")
              elif filter_settings['filter_type'] == 'median':
-                 print(f"  中值滤波尺寸: {filter_settings['filter_median_size']}")
+                 logger.info(f"中值滤波尺寸: {filter_settings['filter_median_size']}")
         else:
-             print(f"图像预处理滤波器已禁用 (标识: {filter_tag})。")
-        print("-" * 20) # 分隔线
+             logger.info(f"图像预处理滤波器已禁用 (标识: {filter_tag})。")
+        logger.info("-" * 20) # 分隔线
 
 
         # --- 新增：检查是否有主题需要生成 ---
         if not themes_to_generate:
-            print("错误：根据配置文件，没有有效的主题需要生成。请检查 config.ini。")
+            logger.error("根据配置文件，没有有效的主题需要生成。请检查 config.ini。")
             results['input_type'] = 'no_themes' # 特殊状态码
             duration = time.perf_counter() - start_time
-            print_summary(results, duration)
+            if not pipe_mode:
+                print_summary(results, duration)
             sys.exit(1) # 退出，因为无事可做
 
-        print(f"将为每个图像生成以下主题: {themes_to_generate}")
-        print("-" * 20) # 分隔线
+        logger.info(f"将为每个图像生成以下主题: {themes_to_generate}")
+        logger.info(f"输出宽度 (字符): {', '.join(str(width) for width in output_widths)}")
+        logger.info("-" * 20) # 分隔线
 
 
-        print("检查字体设置...")
+        logger.info("检查字体设置...")
         # --- 字体加载逻辑 (代码不变) ---
         preferred_font_loaded = False
+        validated_font = None
         local_font_path = os.path.join(script_dir, font_filename)
         try:
              # 1. 尝试本地路径
-             print(f"尝试本地路径: {local_font_path} (大小: {font_size})")
+             logger.debug(f"尝试本地路径: {local_font_path} (大小: {font_size})")
              if os.path.exists(local_font_path):
-                 _ = ImageFont.truetype(local_font_path, font_size)
-                 print(f"成功验证本地字体 '{font_filename}'。")
+                 validated_font = ImageFont.truetype(local_font_path, font_size)
+                 logger.info(f"成功验证本地字体 '{font_filename}'。")
                  font_info = {'type': 'truetype', 'path': local_font_path, 'size': font_size}
                  results['font_used'] = f"本地 '{font_filename}'"
                  results['font_size_used'] = font_size
@@ -953,102 +2800,266 @@ def main():
 
              # 2. 尝试系统路径
              if not preferred_font_loaded:
-                 print(f"警告: 本地未找到。尝试系统字体 '{font_filename}'...")
+                 logger.warning(f"本地未找到。尝试系统字体 '{font_filename}'...")
                  try:
-                     _ = ImageFont.truetype(font_filename, font_size)
-                     print(f"成功验证系统字体 '{font_filename}'。")
+                     validated_font = ImageFont.truetype(font_filename, font_size)
+                     logger.info(f"成功验证系统字体 '{font_filename}'。")
                      font_info = {'type': 'truetype', 'path': font_filename, 'size': font_size}
                      results['font_used'] = f"系统 '{font_filename}'"
                      results['font_size_used'] = font_size
                      preferred_font_loaded = True
                  except IOError:
-                     print(f"警告: 系统中也未找到 '{font_filename}'。将使用默认字体。")
+                     logger.warning(f"系统中也未找到 '{font_filename}'。将使用默认字体。")
 
         except IOError as e:
-             print(f"警告: 验证首选字体 '{font_filename}' 时出错: {e}。将使用默认字体。")
+             logger.warning(f"验证首选字体 '{font_filename}' 时出错: {e}。将使用默认字体。")
         except Exception as e:
-             print(f"警告: 验证首选字体 '{font_filename}' 时发生意外错误: {e}。将使用默认字体。")
+             logger.warning(f"验证首选字体 '{font_filename}' 时发生意外错误: {e}。将使用默认字体。")
 
          # 3. 如果首选字体验证失败，设置使用默认字体
         if not preferred_font_loaded:
-             print("设置使用 Pillow 内置默认字体。")
+             logger.info("设置使用 Pillow 内置默认字体。")
              font_info = {'type': 'default'}
              results['font_used'] = "Pillow 内置默认字体"
              try:
-                 temp_default_font = ImageFont.load_default()
-                 bbox = temp_default_font.getbbox("M") if hasattr(temp_default_font, 'getbbox') else (0,0,6,10) # Fallback size estimate
+                 validated_font = ImageFont.load_default()
+                 bbox = validated_font.getbbox("M") if hasattr(validated_font, 'getbbox') else (0,0,6,10) # Fallback size estimate
                  default_font_approx_height = bbox[3] - bbox[1]
                  results['font_size_used'] = f"~{default_font_approx_height}px (内置)"
-                 del temp_default_font
              except Exception:
                  results['font_size_used'] = "未知 (内置)"
 
 
         # --- 字体信息准备完成 ---
         if font_info is None:
-            print("致命错误：未能确定要使用的字体信息。")
+            logger.error("致命错误：未能确定要使用的字体信息。")
             sys.exit(1)
+        # 验证时加载的字体直接放入本进程的缓存: 在主进程中处理 (单个文件) 和生成自动梯度时不再重新加载，
+        # 以 fork 方式创建的工作进程也会继承这份缓存
+        if validated_font is not None:
+            cache_worker_font(font_info, validated_font)
 
-        input_path = get_input_path()
+        # --- 字符梯度与查找表 (auto 时按所用字体实测墨量生成) ---
+        try:
+            char_ramp, char_lut = prepare_char_lut(config["char_ramp"], font_info, config["auto_ramp_levels"])
+        except Exception as ramp_err:
+            logger.warning(f"准备字符梯度失败: {ramp_err}。使用内置梯度 '{ASCII_CHARS}'。")
+            char_ramp, char_lut = ASCII_CHARS, get_default_char_lut()
+        logger.info(f"字符梯度 ({len(char_ramp)} 级): '{char_ramp}'")
+        edge_threshold = config["edge_threshold"] if config["enable_edges"] else None
+        if edge_threshold is not None:
+            logger.info(f"边缘方向字符模式已启用 (梯度阈值 {edge_threshold})。")
+        dither_settings = None
+        dither_offsets = dithering.threshold_offsets(config["dither_mode"], len(char_ramp))
+        if dither_offsets is not None:
+            dither_settings = {"dither_mode": config["dither_mode"], "offsets": dither_offsets}
+            logger.info(f"字符网格抖动已启用: {config['dither_mode']}")
+        if filter_settings["tone_map"]:
+            logger.info(f"字符网格色调映射已启用: {config['tone_mode']}")
+
+        if args.serve is not None:
+            results['input_type'] = 'service'
+            results.update(serve(
+                args.serve or config["service_address"],
+                font_info,
+                output_widths[0],  # 请求未指定宽度时使用配置中的第一个 (最小) 宽度
+                filter_settings,
+                themes_to_generate[0],  # 请求未指定主题时使用配置中的第一个主题
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings,
+                queue_size=config["service_queue_size"],
+                max_upload_mb=config["service_max_upload_mb"]
+            ))
+            print_summary(results, time.perf_counter() - start_time)
+            return
+
+        if pipe_mode:
+            import stream_frames # 延迟导入: 只有管道模式需要
+            if args.input_path:
+                logger.warning(f"管道模式从 stdin 读取图像，忽略输入路径 '{args.input_path}'。")
+            if len(output_widths) > 1 or len(themes_to_generate) > 1:
+                logger.info(f"管道模式每张图像只输出一个结果: 宽度 {output_widths[0]}，主题 '{themes_to_generate[0]}'。")
+            pipe_results = stream_frames.run_pipe(
+                lambda image_bytes: render_pipe_output(image_bytes, font_info, themes_to_generate[0], output_widths[0],
+                                                       filter_settings, args.pipe_format, char_lut,
+                                                       edge_threshold, dither_settings),
+                args.framed)
+            if pipe_results['images_total'] == 0 and not pipe_results['images_failed']:
+                logger.error("stdin 中没有图像数据。")
+            logger.info(f"管道模式完成: {pipe_results['images_total']} 张图像，失败 {pipe_results['images_failed']}，"
+                        f"耗时 {time.perf_counter() - start_time:.2f} 秒。")
+            sys.exit(0 if pipe_results['images_total'] and not pipe_results['images_failed'] else 1) # 便于 xargs / shell 判断失败
+
+        input_path = args.input_path if args.input_path else get_input_path()
         if input_path is None:
-            print("操作已取消。")
+            logger.info("操作已取消。")
             duration = time.perf_counter() - start_time
             print_summary(results, duration)
             sys.exit(0)
 
         processing_start_time = time.perf_counter()
+        # 本机的校准配置 (--calibrate 生成)，不存在时为 None (使用默认设置)
+        tuning = None
+        if not args.calibrate and (os.path.isdir(input_path) or archive_io.is_archive_path(input_path)):
+            import calibration # 延迟导入: 只有处理目录时才需要
+            tuning = calibration.load_profile(script_dir)
+            if tuning:
+                logger.info(f"使用本机校准配置: {tuning['backend']} 后端，工作数 {tuning['workers']}，"
+                            f"打包成本 {tuning['batch_target_cost']:.0f}")
+
+        metrics = None
+        metrics_path = args.metrics_file or config["metrics_textfile"]
+        if metrics_path and not (args.calibrate or args.verify):
+            import batch_metrics # 延迟导入: 只有导出指标时才需要
+            metrics = batch_metrics.BatchMetrics(mode='watch' if args.watch else 'directory' if os.path.isdir(input_path)
+                                                 else 'archive' if archive_io.is_archive_path(input_path) else 'file')
+            metrics_exporter = batch_metrics.TextfileExporter(metrics_path, metrics, config["metrics_interval_seconds"]).start()
+            logger.info(f"指标将每 {config['metrics_interval_seconds']:g} 秒写入: {metrics_path}")
+
+        output_archive = args.output_archive or config["output_archive"]
+        if output_archive and (args.watch or args.verify or args.calibrate or os.path.isfile(input_path)) \
+                and not archive_io.is_archive_path(input_path):
+            logger.warning("输出归档只用于目录和归档输入，本次运行忽略 OUTPUT_ARCHIVE / --output-archive。")
+
+        if args.verify and not os.path.exists(input_path):
+            logger.error(f"输入路径 '{input_path}' 不是有效的文件或目录。")
+            results['input_type'] = 'invalid'
+
+        elif (args.watch or args.calibrate) and not os.path.isdir(input_path):
+            logger.error(f"{'校准' if args.calibrate else '监视模式'}需要一个目录，'{input_path}' 不是目录。")
+            results['input_type'] = 'invalid'
 
-        if os.path.isfile(input_path):
+        elif args.verify:
+            results['input_type'] = 'verification'
+            results.update(verify_engines(
+                input_path,
+                font_info,
+                COLOR_THEMES,
+                output_width_chars,
+                filter_settings,
+                themes_to_generate,
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings,
+                pixel_tolerance=config["verify_pixel_tolerance"],
+                sample_size=config["verify_sample_size"]
+            ))
+
+        elif args.calibrate:
+            results['input_type'] = 'calibration'
+            results.update(calibrate_directory(
+                input_path,
+                font_info,
+                COLOR_THEMES,
+                output_width_chars,
+                filter_settings,
+                config_filepath,
+                themes_to_generate,
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings
+            ))
+
+        elif archive_io.is_archive_path(input_path):
+            results['input_type'] = 'archive'
+            pipeline_settings = {"io_threads": config["pipeline_io_threads"], "queue_size": config["pipeline_queue_size"]}
+            results.update(process_archive(
+                input_path,
+                font_info,
+                COLOR_THEMES,
+                output_width_chars,
+                filter_settings,
+                config_filepath,
+                themes_to_generate,
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings,
+                pipeline_settings=pipeline_settings,
+                tuning=tuning,
+                metrics=metrics,
+                output_archive=output_archive
+            ))
+
+        elif os.path.isfile(input_path):
             results['input_type'] = 'file'
             file_dir = os.path.dirname(os.path.abspath(input_path))
             file_name_no_ext, _ = os.path.splitext(os.path.basename(input_path))
             # --- 主输出目录命名 (代码不变) ---
-            base_output_dir = os.path.join(file_dir, f"{file_name_no_ext}_ascii_art_{output_width_chars}w_{filter_tag}")
+            base_output_dir = os.path.join(file_dir, f"{file_name_no_ext}_ascii_art_{format_width_tag(output_width_chars)}_{filter_tag}")
 
-            print(f"\n正在处理单个文件: {os.path.basename(input_path)}")
-            print(f"主输出目录: {base_output_dir}")
+            logger.info(f"正在处理单个文件: {os.path.basename(input_path)}")
+            logger.info(f"主输出目录: {base_output_dir}")
 
             # --- 创建目录并复制配置文件 (单文件模式) (代码不变) ---
             try:
                 os.makedirs(base_output_dir, exist_ok=True)
-                # --- 复制配置文件 ---
-                if os.path.exists(config_filepath):
-                    try:
-                        dest_config_path = os.path.join(base_output_dir, "config_used.txt")
-                        shutil.copy2(config_filepath, dest_config_path)
-                        print(f"  已将配置文件复制到: {dest_config_path}")
-                    except Exception as copy_err:
-                        print(f"  警告：复制配置文件 '{config_filepath}' 到输出目录失败: {copy_err}")
-                else:
-                     print(f"  警告：未找到原始配置文件 '{config_filepath}'，无法复制。")
+                copy_config_to_output(config_filepath, base_output_dir)
 
                 # --- 处理单文件，传递 filter_settings 和 themes_to_generate ---
-                img_results = process_image_to_ascii_themes(
+                task_args = (
                     input_path,
                     font_info,
                     COLOR_THEMES,        # 传递完整的 COLOR_THEMES 字典
                     base_output_dir,     # <-- 使用新的目录名
                     output_width_chars,
                     filter_settings,     # <-- 传递 filter_settings
-                    themes_to_generate   # <-- 新增：传递要生成的主题列表
+                    themes_to_generate,  # <-- 新增：传递要生成的主题列表
+                    char_lut,
+                    edge_threshold,
+                    dither_settings
                 )
+                if enable_profiling:
+                    import profiling # 延迟导入: 只有启用性能分析时才需要 cProfile/pstats
+                    profile_stats_dir = os.path.join(base_output_dir, profiling.PROFILE_STATS_DIRNAME)
+                    img_results = profiling.run_profiled(profile_stats_dir, process_image_to_ascii_themes, *task_args)
+                    write_profile_report(profile_stats_dir, base_output_dir)
+                else:
+                    img_results = process_image_to_ascii_themes(*task_args)
+                if metrics is not None:
+                    metrics.set_workers(1)
+                    metrics.add_planned(1)
+                    metrics.observe_image(img_results, len(themes_to_generate) * len(output_widths))
                 results['total_success'] = img_results.get('success', 0)
                 results['total_failed'] = img_results.get('failed', 0)
                 # output_location 对于单文件是指包含该文件输出的那个子目录
                 results['output_location'] = os.path.join(base_output_dir, file_name_no_ext)
-                print(f"处理完成: '{os.path.basename(input_path)}'")
+                logger.info(f"处理完成: '{os.path.basename(input_path)}'")
 
             except OSError as e:
-                 print(f"错误：无法创建主输出目录 '{base_output_dir}': {e}。")
-                 results['total_failed'] = len(themes_to_generate) # 标记失败
+                 logger.error(f"无法创建主输出目录 '{base_output_dir}': {e}。")
+                 results['total_failed'] = len(themes_to_generate) * len(output_widths) # 标记失败
 
             except Exception as single_err:
-                 print(f"处理单文件 '{input_path}' 时发生顶层错误: {single_err}")
+                 logger.error(f"处理单文件 '{input_path}' 时发生顶层错误: {single_err}")
                  traceback.print_exc() # 打印详细错误
-                 results['total_failed'] = len(themes_to_generate) # 假定所有主题都失败了
+                 results['total_failed'] = len(themes_to_generate) * len(output_widths) # 假定所有主题都失败了
+
+        elif args.watch and os.path.isdir(input_path):
+            results['input_type'] = 'directory'
+            dir_results = watch_directory(
+                input_path,
+                font_info,
+                COLOR_THEMES,
+                output_width_chars,
+                filter_settings,
+                config_filepath,
+                themes_to_generate,
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings,
+                debounce=config["watch_debounce_seconds"],
+                poll_interval=config["watch_poll_interval"],
+                tuning=tuning,
+                metrics=metrics
+            )
+            results.update(dir_results)
 
         elif os.path.isdir(input_path):
             results['input_type'] = 'directory'
+            pipeline_settings = None
+            if args.pipeline or config["enable_pipeline"]:
+                pipeline_settings = {"io_threads": config["pipeline_io_threads"], "queue_size": config["pipeline_queue_size"]}
             # --- 处理目录，传递 filter_settings, config_filepath 和 themes_to_generate ---
             dir_results = process_directory(
                 input_path,
@@ -1057,32 +3068,47 @@ def main():
                 output_width_chars,
                 filter_settings,       # <-- 传递 filter_settings
                 config_filepath,       # <-- 传递 config_filepath
-                themes_to_generate     # <-- 新增：传递主题列表
+                themes_to_generate,    # <-- 新增：传递主题列表
+                enable_profiling=enable_profiling,
+                char_lut=char_lut,
+                edge_threshold=edge_threshold,
+                dither_settings=dither_settings,
+                dedupe_inputs=config["dedupe_inputs"],
+                pipeline_settings=pipeline_settings,
+                memory_budget=resolve_memory_budget(config["memory_budget_mb"]),
+                tuning=tuning,
+                metrics=metrics,
+                output_archive=output_archive
              )
             results.update(dir_results)
 
         else:
-            print(f"错误：输入路径 '{input_path}' 不是有效的文件或目录。")
+            logger.error(f"输入路径 '{input_path}' 不是有效的文件或目录。")
             results['input_type'] = 'invalid'
 
+        if metrics_exporter is not None:
+            metrics_exporter.close() # 写入最终值 (running 为 0)
         processing_end_time = time.perf_counter()
         total_processing_duration = processing_end_time - processing_start_time
         # 将总时长传递给 print_summary
         results['total_duration_incl_load'] = time.perf_counter() - start_time
         # 使用 processing_duration 显示处理时间
         print_summary(results, total_processing_duration)
+        if results['input_type'] == 'verification' and (
+                not results['verify_cases'] or results['verify_grid_mismatches'] or results['verify_png_mismatches']):
+            sys.exit(1) # 校验不通过时以非零状态退出，便于在脚本中使用
 
 
     except Exception as e:
-        print("\n--- 发生未处理的全局异常 ---")
-        print(f"错误类型: {type(e).__name__}")
-        print(f"错误信息: {e}")
-        traceback.print_exc()
+        logger.exception(f"发生未处理的全局异常: {type(e).__name__}: {e}")
         results['input_type'] = 'runtime_error'
+        if metrics_exporter is not None:
+            metrics_exporter.close()
         duration = time.perf_counter() - start_time
         if 'font_used' not in results: results['font_used'] = '加载失败或未知'
         if 'font_size_used' not in results: results['font_size_used'] = '未知'
-        print_summary(results, duration)
+        if not pipe_mode:
+            print_summary(results, duration)
         sys.exit(1)
 
 # --- 主程序入口 (确保在 __main__ 下) ---
@@ -1096,13 +3122,17 @@ if __name__ == "__main__":
         except Exception as cd_err:
              print(f"警告：无法切换目录到 {application_path}: {cd_err}")
 
-    # 确保在 Windows 等平台上多进程正常工作
-    multiprocessing.freeze_support() # <--- 支持冻结环境下的多进程
+        # 确保在 Windows 等平台上多进程正常工作 (只有打包环境需要，普通运行时不导入 multiprocessing)
+        import multiprocessing
+        multiprocessing.freeze_support() # <--- 支持冻结环境下的多进程
 
-    main()
+    cli_args = parse_args()
+    main(cli_args)
 
-    print("\n处理完成。按 Enter 键退出...")
-    try:
-        input()
-    except EOFError:
-        pass
+    # 交互式运行时等待用户按键；通过命令行传入路径时直接退出，便于脚本调用
+    if not cli_args.input_path and cli_args.serve is None:
+        print("\n处理完成。按 Enter 键退出...")
+        try:
+            input()
+        except EOFError:
+            pass
@@ -7,6 +7,7 @@ import traceback
 import time
 # import numpy as np # NumPy is no longer needed for the core conversion logic
 import configparser # 导入配置解析器
+import dithering # 字符网格有序抖动 (与 ASCII.py 共用)
 
 # --- 默认配置 (如果 config.txt 不存在或无效则使用) ---
 DEFAULT_OUTPUT_WIDTH_CHARS = 128 # 默认 ASCII 表示宽度
@@ -135,6 +136,18 @@ def load_config(config_filepath):
             "font_size": DEFAULT_FONT_SIZE,
         }
 
+    # --- 加载 [Dither] 部分 (可选) ---
+    try:
+        if 'Dither' in parser:
+            dither_mode = parser['Dither'].get('DITHER_MODE', fallback='none').split('#')[0].strip().lower()
+            if dither_mode in dithering.DITHER_MODES:
+                config_values["dither_mode"] = dither_mode
+                print(f"  已加载 DITHER_MODE = {dither_mode}")
+            else:
+                print(f"  警告: config.ini 中的 DITHER_MODE 值 '{dither_mode}' 无效。不使用抖动。")
+    except configparser.Error as e:
+        print(f"警告: 读取 [Dither] 部分时出错: {e}。不使用抖动。")
+
     print("配置加载完成。\n")
     return config_values
 
@@ -144,13 +157,14 @@ def load_config(config_filepath):
 # ==============================================================================
 # *** 修改后的 image_to_ascii 函数 ***
 # ==============================================================================
-def image_to_ascii(color_image, width_chars, active_theme_name):
+def image_to_ascii(color_image, width_chars, active_theme_name, dither_offsets=None):
     """
     将 PIL 彩色图像转换为包含字符和对应原图点采样颜色的数据结构。
     此版本模拟 C++ 逻辑：
     1. 直接在原始彩色图像上采样。
     2. 使用 (R+G+B)/3 计算灰度值。
     3. 字符映射逻辑不考虑背景明暗。
+    dither_offsets 为 dithering.threshold_offsets 返回的偏移矩阵 (None 表示不抖动)，逐格加在 R+G+B 之和上。
     """
     try:
         # 1. 确保输入是 RGB 并获取尺寸
@@ -227,7 +241,12 @@ def image_to_ascii(color_image, width_chars, active_theme_name):
                 r, g, b = sampled_color[:3] # 取前三个元素以防有 alpha 通道
                 # gray = (int(r) + int(g) + int(b)) // 3 # 整数除法
                 # 使用浮点数除法和 floor 模拟 C++ 的 floor((gray/256.0f)...)
-                gray = (int(r) + int(g) + int(b)) / 3.0
+                # 有序抖动: 按字符格位置加上阈值偏移 (单位为 R+G+B 之和)
+                dither_offset = 0
+                if dither_offsets is not None:
+                    dither_size = len(dither_offsets)
+                    dither_offset = dither_offsets[y_char % dither_size][x_char % dither_size]
+                gray = (int(r) + int(g) + int(b) + dither_offset) / 3.0
 
                 # e. 映射灰度值到字符索引 (模拟 C++ 逻辑)
                 # C++: floor((gray / 256.0f) * NUM_ASCII_CHARS)
@@ -416,10 +435,13 @@ def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色
 
 
 # --- 核心处理函数 (无变化) ---
-def process_image_to_ascii_themes(image_path, font, themes_config, base_output_dir, output_width_chars):
+def process_image_to_ascii_themes(image_path, font, themes_config, base_output_dir, output_width_chars,
+                                  dither_mode='none'):
     """
     处理单个图像文件，将其所有主题输出保存在 base_output_dir 下以图像名命名的子目录中。
+    dither_mode 为 'none'、'bayer' 或 'bluenoise'。
     """
+    dither_offsets = dithering.threshold_offsets(dither_mode, len(ASCII_CHARS))
     print(f"\n正在处理图像: {image_path}")
     results = {'success': 0, 'failed': 0}
     original_img = None
@@ -476,7 +498,8 @@ def process_image_to_ascii_themes(image_path, font, themes_config, base_output_d
         ascii_char_color_data = image_to_ascii(
             color_image=original_img,
             width_chars=output_width_chars,
-            active_theme_name=theme_name # 参数仍然传递，但函数内部不再使用它来调整映射
+            active_theme_name=theme_name, # 参数仍然传递，但函数内部不再使用它来调整映射
+            dither_offsets=dither_offsets
         )
         ascii_conv_end = time.perf_counter()
 
@@ -489,7 +512,8 @@ def process_image_to_ascii_themes(image_path, font, themes_config, base_output_d
 
         # 2. 创建 PNG (保存到 image_specific_output_dir)
         resize_suffix = "_resized" if RESIZE_OUTPUT else ""
-        output_filename = f"{file_name_no_ext}_ascii_{theme_name}_{output_width_chars}w{resize_suffix}.png"
+        dither_suffix = f"_{dither_mode}" if dither_offsets is not None else ""
+        output_filename = f"{file_name_no_ext}_ascii_{theme_name}_{output_width_chars}w{dither_suffix}{resize_suffix}.png"
         output_filepath = os.path.join(image_specific_output_dir, output_filename)
 
         png_create_start = time.perf_counter()
@@ -518,7 +542,7 @@ def process_image_to_ascii_themes(image_path, font, themes_config, base_output_d
     return results
 
 # --- process_directory 函数 (无变化) ---
-def process_directory(dir_path, font, themes_config, output_width_chars):
+def process_directory(dir_path, font, themes_config, output_width_chars, dither_mode='none'):
     """
     扫描目录，处理所有支持的图像，并将每个图像的结果保存到单独的子目录中。
     """
@@ -566,7 +590,8 @@ def process_directory(dir_path, font, themes_config, output_width_chars):
             font=font,
             themes_config=themes_config,
             base_output_dir=main_output_dir,
-            output_width_chars=output_width_chars
+            output_width_chars=output_width_chars,
+            dither_mode=dither_mode
         )
         overall_results['total_success'] += image_results['success']
         overall_results['total_failed'] += image_results['failed']
@@ -654,6 +679,7 @@ def main():
         output_width_chars = config["output_width_chars"]
         font_filename = config["font_filename"]
         font_size = config["font_size"]
+        dither_mode = config.get("dither_mode", "none")
 
         print("正在加载字体...")
         font = None
@@ -707,7 +733,8 @@ def main():
                 font,
                 COLOR_THEMES,
                 base_output_dir,
-                output_width_chars
+                output_width_chars,
+                dither_mode
             )
             results['total_success'] = img_results['success']
             results['total_failed'] = img_results['failed']
@@ -718,7 +745,8 @@ def main():
                 input_path,
                 font,
                 COLOR_THEMES,
-                output_width_chars
+                output_width_chars,
+                dither_mode
              )
             results.update(dir_results)
 
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+zip / tar 归档的读取和写入 (ASCII.py 处理归档输入、把输出写入单个归档时使用)。
+
+成员直接从归档读入内存后交给工作进程解码，不需要先解压到磁盘。
+- zip: 按成员随机读取，多个读取线程可以同时读 (ZipFile 内部对文件位置加锁)；
+- tar (含 .tar.gz / .tar.bz2 / .tar.xz): 压缩的 tar 只能顺序读取，读取时加锁，
+  调用方应按 list_members 返回的归档顺序读取 (单个读取线程)。
+写入见 ArchiveWriter: 所有输出写入一个归档文件，网络文件系统上只有少量元数据操作。
+
+本模块不依赖 ASCII.py。
+"""
+import io
+import os
+import time
+import tarfile
+import zipfile
+import threading
+import posixpath
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS
+
+
+def is_archive_path(path):
+    """按扩展名判断 path 是否为支持的归档文件。"""
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def archive_stem(path):
+    """去掉归档扩展名的文件名 (如 'photos.tar.gz' -> 'photos')。"""
+    name = os.path.basename(path)
+    for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
+
+def safe_member_path(name):
+    """
+    把成员名规范化为安全的相对路径 ('/' 分隔)；绝对路径、包含 '..' 或为空时返回 None。
+    输出文件按成员路径命名，这样可以避免写到输出目录之外。
+    """
+    normalized = posixpath.normpath(name.replace('\\', '/'))
+    if normalized.startswith('/') or normalized == '.' or normalized.split('/')[0] == '..' or ':' in normalized.split('/')[0]:
+        return None
+    return normalized
+
+
+class ArchiveReader:
+    """
+    只读打开 zip 或 tar 归档。
+    list_members(extensions) 返回匹配扩展名的成员 [(成员名, 未压缩大小)]，read(成员名) 返回成员的字节。
+    read 可以在多个线程中调用。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.is_zip = path.lower().endswith(ZIP_EXTENSIONS)
+        self._lock = threading.Lock()
+        if self.is_zip:
+            self._zip = zipfile.ZipFile(path)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path, 'r:*')
+        self._tar_members = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def list_members(self, extensions):
+        """返回扩展名 (小写) 在 extensions 中的普通文件成员 [(成员名, 大小)]，按归档中的顺序。"""
+        members = []
+        if self.is_zip:
+            for info in self._zip.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(extensions):
+                    members.append((info.filename, info.file_size))
+        else:
+            for member in self._tar.getmembers():
+                if member.isfile() and member.name.lower().endswith(extensions):
+                    self._tar_members[member.name] = member
+                    members.append((member.name, member.size))
+        return members
+
+    def read(self, name):
+        """读取成员的全部字节。"""
+        if self.is_zip:
+            return self._zip.read(name)
+        with self._lock: # TarFile 共用一个文件位置，不能并发读取
+            extracted = self._tar.extractfile(self._tar_members.get(name) or name)
+            if extracted is None:
+                raise KeyError(f"归档成员不是普通文件: {name}")
+            with extracted:
+                return extracted.read()
+
+
+class ArchiveWriter:
+    """
+    把输出写入单个 zip 或 tar 归档 (按 path 的扩展名选择)，代替大量小文件。
+    PNG 已经压缩，zip 成员使用 ZIP_STORED (不再压缩)，tar 不压缩。
+    写入时使用 path + '.partial'，close(commit=True) 后才改名为 path，中断的运行不会留下看似完整的归档。
+    add 可以在多个线程中调用 (内部加锁)，但为了顺序写入，调用方通常只用一个写入线程。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + ".partial"
+        self.is_zip = path.lower().endswith(ZIP_EXTENSIONS)
+        self._lock = threading.Lock()
+        if self.is_zip:
+            self._archive = zipfile.ZipFile(self.partial_path, 'w', compression=zipfile.ZIP_STORED)
+        else:
+            self._archive = tarfile.open(self.partial_path, 'w')
+        self._closed = False
+
+    def add(self, name, data):
+        """把 data (bytes) 写为成员 name ('/' 分隔的相对路径)，返回写入的字节数。"""
+        with self._lock:
+            if self.is_zip:
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                info.external_attr = 0o644 << 16
+                self._archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                self._archive.addfile(info, io.BytesIO(data))
+        return len(data)
+
+    def close(self, commit=True):
+        """结束写入。commit 为 True 时把归档改名为最终路径，否则保留 .partial 文件。可重复调用。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._archive.close()
+        if commit:
+            os.replace(self.partial_path, self.path)
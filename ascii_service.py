@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+本地转换服务 (ASCII.py --serve 使用)。
+
+在本机 TCP 端口或 Unix 套接字上提供 HTTP 接口，工作进程和字体在整个运行期间保持预热:
+- POST /render?width=120&theme=dark&filter=gaussian  请求体为图像字节，返回 PNG；
+  响应头 Server-Timing 给出本次请求各阶段的耗时。
+- GET  /metrics  Prometheus 文本格式的队列深度、请求计数和各阶段累计耗时。
+- GET  /health   存活检查。
+已接受的请求 (排队 + 处理中) 达到上限时立即返回 503 和 Retry-After，而不是无限排队。
+
+本模块不依赖 ASCII.py: 请求参数的解析和渲染任务的提交由调用方以函数形式传入。
+"""
+import os
+import stat
+import time
+import socket
+import logging
+import threading
+import socketserver
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+UNIX_ADDRESS_PREFIX = "unix:"
+RETRY_AFTER_SECONDS = 1
+METRIC_PREFIX = "ascii_service"
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def parse_address(text):
+    """
+    解析监听地址，返回 (地址族, 地址)。
+    'unix:/path/to.sock' -> ('unix', '/path/to.sock')；'host:port' 或 'port' -> ('tcp', (host, port))。
+    """
+    text = text.strip()
+    if text.startswith(UNIX_ADDRESS_PREFIX):
+        path = text[len(UNIX_ADDRESS_PREFIX):]
+        if not path:
+            raise ValueError("Unix 套接字地址缺少路径 (格式: unix:/path/to.sock)")
+        return 'unix', path
+    host, separator, port = text.rpartition(':')
+    if not separator:
+        host, port = "127.0.0.1", text
+    try:
+        port_number = int(port)
+    except ValueError:
+        raise ValueError(f"无效的监听地址 '{text}' (格式: host:port 或 unix:/path/to.sock)") from None
+    if not 0 <= port_number <= 65535:
+        raise ValueError(f"端口超出范围: {port_number}")
+    return 'tcp', (host.strip('[]') or "127.0.0.1", port_number)
+
+
+class ServiceMetrics:
+    """线程安全的服务统计: 准入控制、请求计数和各阶段累计耗时。"""
+
+    def __init__(self, capacity, workers):
+        self.capacity = capacity
+        self.workers = workers
+        self.start_time = time.time()
+        self.pending = 0 # 已接受、尚未完成的请求 (排队 + 处理中)
+        self.status_counts = collections.Counter()
+        self.stage_sums = collections.defaultdict(float)
+        self.stage_counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def try_admit(self):
+        """请求数未达上限时占用一个名额并返回 True，否则返回 False (调用方应返回 503)。"""
+        with self._lock:
+            if self.pending >= self.capacity:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def record_status(self, status):
+        with self._lock:
+            self.status_counts[status] += 1
+
+    def record_stages(self, stage_seconds):
+        with self._lock:
+            for stage, seconds in stage_seconds.items():
+                self.stage_sums[stage] += seconds
+                self.stage_counts[stage] += 1
+
+    def snapshot(self):
+        """返回当前统计的字典副本。"""
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'queue_depth': max(0, self.pending - self.workers),
+                'status_counts': dict(self.status_counts),
+                'stage_sums': dict(self.stage_sums),
+                'stage_counts': dict(self.stage_counts),
+            }
+
+    def render_prometheus(self):
+        """返回 Prometheus 文本格式的统计。"""
+        data = self.snapshot()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            full_name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{full_name}{labels} {value}")
+
+        metric("queue_depth", "gauge", "等待空闲工作进程的请求数", [("", data['queue_depth'])])
+        metric("in_flight", "gauge", "已接受、尚未完成的请求数 (排队 + 处理中)", [("", data['pending'])])
+        metric("capacity", "gauge", "同时接受的请求数上限 (超过时返回 503)", [("", self.capacity)])
+        metric("workers", "gauge", "工作进程数", [("", self.workers)])
+        metric("uptime_seconds", "gauge", "服务运行时间", [("", f"{time.time() - self.start_time:.3f}")])
+        metric("requests_total", "counter", "按 HTTP 状态码统计的渲染请求数",
+               [(f'{{code="{code}"}}', count) for code, count in sorted(data['status_counts'].items())])
+        stages = sorted(data['stage_counts'])
+        metric("stage_seconds_sum", "counter", "各阶段累计耗时 (秒)",
+               [(f'{{stage="{stage}"}}', f"{data['stage_sums'][stage]:.6f}") for stage in stages])
+        metric("stage_seconds_count", "counter", "各阶段的计时次数",
+               [(f'{{stage="{stage}"}}', data['stage_counts'][stage]) for stage in stages])
+        return "\n".join(lines) + "\n"
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """处理 /render、/metrics 和 /health 请求。服务上下文在 self.server 的属性中。"""
+
+    server_version = "ASCIIService/1.0"
+    protocol_version = "HTTP/1.1" # 支持 keep-alive，调用方可复用连接
+
+    def log_message(self, format, *args):
+        # Unix 套接字的 client_address 为空，不使用默认的 address_string
+        logger.debug("HTTP " + (format % args))
+
+    def _send(self, status, body, content_type="text/plain; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_text(self, status, message, headers=None):
+        self.server.metrics.record_status(status)
+        self._send(status, message + "\n", headers=headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send(200, self.server.metrics.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/health":
+            self._send(200, "ok\n")
+        else:
+            self._send(404, "未知路径 (可用: POST /render, GET /metrics, GET /health)\n")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        metrics = self.server.metrics
+        if url.path != "/render":
+            self.close_connection = True # 请求体未读取，不能复用连接
+            self._send(404, "未知路径 (可用: POST /render)\n")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.close_connection = True
+            self._send_error_text(411, "需要 Content-Length")
+            return
+        if length <= 0 or length > self.server.max_body_bytes:
+            self.close_connection = True
+            self._send_error_text(413, f"请求体大小必须在 1 到 {self.server.max_body_bytes} 字节之间")
+            return
+        try:
+            params = self.server.parse_params(parse_qs(url.query))
+        except ValueError as e:
+            self.close_connection = True
+            self._send_error_text(400, f"参数无效: {e}")
+            return
+        # 背压: 达到上限时立即拒绝 (此时还没有读取请求体，拒绝的代价很小)
+        if not metrics.try_admit():
+            self.close_connection = True
+            self._send_error_text(503, "服务繁忙，请稍后重试",
+                                  headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+        try:
+            receive_start = time.perf_counter()
+            image_bytes = self.rfile.read(length)
+            submit_time = time.perf_counter()
+            result = self.server.submit(image_bytes, params).result()
+            total = time.perf_counter() - receive_start
+        except Exception as e: # 工作进程崩溃 (BrokenProcessPool) 或任务抛出异常
+            logger.error(f"渲染任务失败: {e}")
+            self.close_connection = True
+            self._send_error_text(500, "渲染任务失败")
+            return
+        finally:
+            metrics.release()
+
+        # 工作进程内各阶段耗时之外的部分为排队和进程间传输
+        worker_timings = result.get('timings', {})
+        stages = {'receive': submit_time - receive_start}
+        stages['queue'] = max(0.0, total - stages['receive'] - sum(worker_timings.values()))
+        stages.update(worker_timings)
+        stages['total'] = total
+        metrics.record_stages(stages)
+        server_timing = ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items())
+
+        if result.get('png') is None:
+            self._send_error_text(422, f"无法渲染图像: {result.get('error') or '未知错误'}",
+                                  headers={"Server-Timing": server_timing})
+            return
+        metrics.record_status(200)
+        self._send(200, result['png'], "image/png", headers={"Server-Timing": server_timing})
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _remove_stale_socket(path):
+    """删除残留的 Unix 套接字文件 (只删除套接字，不删除普通文件)。"""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_service(address, submit, parse_params, workers, queue_size, max_body_bytes):
+    """
+    启动服务并一直运行，直到按下 Ctrl+C。
+    同时接受的请求数上限为 workers + queue_size；请求体超过 max_body_bytes 字节时返回 413。
+    submit(image_bytes, params) 提交渲染任务并返回 Future，其结果为
+    {'png': PNG 字节或 None, 'error': 错误说明, 'timings': {阶段: 秒}}；
+    parse_params(query) 把查询参数 (parse_qs 的结果) 转换为 params，参数无效时抛出 ValueError。
+    返回 {'requests_total': 渲染请求数, 'requests_failed': 失败或被拒绝的请求数}。
+    """
+    family, bind_address = parse_address(address)
+    if family == 'unix':
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError("当前平台不支持 Unix 套接字")
+        _remove_stale_socket(bind_address)
+        server = _UnixHTTPServer(bind_address, _RequestHandler)
+    else:
+        if bind_address[0] not in LOCAL_HOSTS:
+            logger.warning(f"服务监听在非本机地址 {bind_address[0]}，其他机器也可以访问。")
+        server = ThreadingHTTPServer(bind_address, _RequestHandler)
+    server.metrics = ServiceMetrics(workers + queue_size, workers)
+    server.submit = submit
+    server.parse_params = parse_params
+    server.max_body_bytes = max_body_bytes
+
+    listen_text = f"unix:{bind_address}" if family == 'unix' else f"http://{bind_address[0]}:{server.server_address[1]}"
+    logger.info(f"服务已启动: {listen_text} (工作进程 {workers}，排队上限 {queue_size})。按 Ctrl+C 停止。")
+    logger.info("  POST /render?width=&theme=&filter=   GET /metrics   GET /health")
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，正在停止服务...")
+    finally:
+        server.server_close()
+        if family == 'unix':
+            _remove_stale_socket(bind_address)
+
+    status_counts = server.metrics.snapshot()['status_counts']
+    total = sum(status_counts.values())
+    return {'requests_total': total, 'requests_failed': total - status_counts.get(200, 0)}
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+批处理运行指标的 Prometheus 文本格式导出 (ASCII.py --metrics-file 使用)。
+
+BatchMetrics 在主进程中汇总每张图像的处理结果 (工作进程返回的各阶段耗时、写出的字节数、
+失败阶段)；TextfileExporter 在后台线程中定期把指标写入文件，供 node_exporter 的
+textfile collector 读取。写入时先写临时文件再改名，读取方不会看到写了一半的文件。
+
+本模块不依赖 ASCII.py。
+"""
+import os
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "ascii_batch"
+DEFAULT_EXPORT_INTERVAL = 10.0 # 秒
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # 阶段耗时直方图上界 (秒)
+
+
+class BatchMetrics:
+    """线程安全的批处理指标: 图像/输出计数、按阶段的失败数和耗时直方图、写出字节数、工作进程利用率。"""
+
+    def __init__(self, mode="directory"):
+        self.mode = mode
+        self.start_time = time.time()
+        self.workers = 0
+        self.images_planned = 0
+        self.images_deduplicated = 0
+        self.running = True
+        self.image_counts = collections.Counter() # status -> 数量
+        self.output_counts = collections.Counter() # status -> 数量
+        self.failure_counts = collections.Counter() # stage -> 失败的输出数
+        self.bytes_written = 0
+        self.busy_seconds = 0.0
+        self.stage_buckets = collections.defaultdict(lambda: [0] * len(STAGE_BUCKETS))
+        self.stage_sums = collections.defaultdict(float)
+        self.stage_counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def set_workers(self, workers):
+        with self._lock:
+            self.workers = workers
+
+    def add_planned(self, count):
+        with self._lock:
+            self.images_planned += count
+
+    def observe_image(self, image_results, outputs_per_image):
+        """
+        记录一张图像的结果。image_results 为工作进程返回的结果字典
+        ({'success', 'failed', 'timings', 'bytes_written', 'failed_stages'})，
+        None 表示任务异常退出 (所有输出计为失败，失败阶段为 'worker')。
+        """
+        with self._lock:
+            if image_results is None:
+                self.image_counts['failed'] += 1
+                self.output_counts['failed'] += outputs_per_image
+                self.failure_counts['worker'] += outputs_per_image
+                return
+            failed = image_results.get('failed', 0)
+            self.image_counts['failed' if failed else 'success'] += 1
+            self.output_counts['success'] += image_results.get('success', 0)
+            self.output_counts['failed'] += failed
+            for stage, count in image_results.get('failed_stages', {}).items():
+                self.failure_counts[stage] += count
+            self.bytes_written += image_results.get('bytes_written', 0)
+            timings = image_results.get('timings', {})
+            for stage, seconds in timings.items():
+                self.stage_sums[stage] += seconds
+                self.stage_counts[stage] += 1
+                buckets = self.stage_buckets[stage]
+                for index, upper in enumerate(STAGE_BUCKETS):
+                    if seconds <= upper:
+                        buckets[index] += 1
+            self.busy_seconds += sum(timings.values())
+
+    def observe_duplicate(self, success, failed):
+        """
+        记录一张与已渲染图像内容相同的图像: 输出由链接/复制 (或归档中共用的 PNG 数据) 生成，没有重新渲染，
+        所以不计入阶段耗时和写出字节数。success/failed 为它的输出数 (宽度 x 主题)。
+        """
+        with self._lock:
+            self.images_deduplicated += 1
+            self.image_counts['failed' if failed else 'success'] += 1
+            self.output_counts['success'] += success
+            self.output_counts['failed'] += failed
+            if failed:
+                self.failure_counts['duplicate'] += failed
+
+    def finish(self):
+        with self._lock:
+            self.running = False
+
+    def render_prometheus(self):
+        """返回 Prometheus 文本格式的指标。"""
+        with self._lock:
+            now = time.time()
+            elapsed = max(1e-9, now - self.start_time)
+            lines = []
+
+            def metric(name, metric_type, help_text, samples):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{full_name}{labels} {value}")
+
+            mode_label = f'mode="{self.mode}"'
+            metric("running", "gauge", "运行中为 1，结束后为 0", [(f"{{{mode_label}}}", int(self.running))])
+            metric("start_time_seconds", "gauge", "运行开始时间 (Unix 时间戳)", [("", f"{self.start_time:.3f}")])
+            metric("last_update_time_seconds", "gauge", "本文件的写入时间 (Unix 时间戳)", [("", f"{now:.3f}")])
+            metric("images_planned", "gauge", "本次运行计划处理的图像数", [("", self.images_planned)])
+            metric("images_total", "counter", "已处理的图像数 (按结果)",
+                   [(f'{{status="{status}"}}', self.image_counts[status]) for status in ("success", "failed")])
+            metric("images_deduplicated_total", "counter", "内容与其他图像相同、复用已有渲染的图像数 (已计入 images_total)",
+                   [("", self.images_deduplicated)])
+            metric("outputs_total", "counter", "生成的输出 PNG 数 (宽度 x 主题，按结果)",
+                   [(f'{{status="{status}"}}', self.output_counts[status]) for status in ("success", "failed")])
+            metric("failures_total", "counter", "按失败阶段统计的未生成输出数",
+                   [(f'{{stage="{stage}"}}', count) for stage, count in sorted(self.failure_counts.items())])
+            metric("bytes_written_total", "counter", "写出的 PNG 字节数", [("", self.bytes_written)])
+
+            full_name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# HELP {full_name} 每张图像各阶段的耗时 (秒)")
+            lines.append(f"# TYPE {full_name} histogram")
+            for stage in sorted(self.stage_counts):
+                for upper, count in zip(STAGE_BUCKETS, self.stage_buckets[stage]):
+                    lines.append(f'{full_name}_bucket{{stage="{stage}",le="{upper}"}} {count}')
+                lines.append(f'{full_name}_bucket{{stage="{stage}",le="+Inf"}} {self.stage_counts[stage]}')
+                lines.append(f'{full_name}_sum{{stage="{stage}"}} {self.stage_sums[stage]:.6f}')
+                lines.append(f'{full_name}_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+
+            metric("workers", "gauge", "工作进程 (或线程) 数", [("", self.workers)])
+            metric("worker_busy_seconds_total", "counter", "工作进程处理图像的累计时间", [("", f"{self.busy_seconds:.6f}")])
+            utilization = self.busy_seconds / (elapsed * self.workers) if self.workers else 0.0
+            metric("worker_utilization", "gauge", "工作进程平均利用率 (0-1，自运行开始)",
+                   [("", f"{min(1.0, utilization):.4f}")])
+            return "\n".join(lines) + "\n"
+
+
+class TextfileExporter:
+    """
+    在后台线程中每 interval 秒把 metrics 写入 path (先写 path.tmp 再改名)。
+
+    用法:
+        with TextfileExporter(path, metrics):
+            ... # 处理过程中更新 metrics
+        # 退出时写入最终状态 (running 为 0)；也可以显式调用 start() / close()
+    """
+
+    def __init__(self, path, metrics, interval=DEFAULT_EXPORT_INTERVAL):
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def start(self):
+        """写入一次并启动后台线程，返回 self。"""
+        self.write()
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """停止后台线程并写入最终状态 (running 为 0)。可重复调用。"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.metrics.finish()
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """立即写入一次，返回是否成功 (失败只记录警告，不影响处理)。"""
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.metrics.render_prometheus())
+            os.replace(temp_path, self.path)
+            return True
+        except OSError as e:
+            logger.warning(f"无法写入指标文件 '{self.path}': {e}")
+            return False
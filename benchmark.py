@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+简单的性能基准脚本。
+
+在合成图片上比较 pixel.py 的两种缩小采样方式 (nearest / average) 的耗时，
+分别测试能被像素块大小整除 (走 Image.reduce) 和不能整除 (走 BOX 重采样) 的尺寸。
+另外在新的解释器进程中测量冷启动耗时 (导入模块、启动到开始处理、转换一张小图)，
+可用 --skip-startup 跳过。
+结果输出到标准输出，可用 --output 同时写入文件 (例如 bench_output.txt)。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from PIL import Image
+
+import pixel
+
+DEFAULT_SIZES = ("3840x2160", "3833x2157") # 能整除 / 不能整除 8 的尺寸
+DEFAULT_PIXEL_SIZES = (4, 8, 16)
+DEFAULT_REPEAT = 5
+STARTUP_IMAGE_SIZE = (64, 64) # 冷启动测试用的小图
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_synthetic_image(width, height):
+    """生成带噪声的合成 RGB 图片 (纯色图会让某些路径显得过快)。"""
+    noise = Image.effect_noise((width, height), 64)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    return Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def time_call(func, repeat):
+    """运行 func repeat 次，返回耗时的中位数 (秒)。"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def bench_sampling(img, pixel_sizes, repeat):
+    """返回 [(像素块大小, 采样方式, 中位耗时)]。"""
+    rows = []
+    width, height = img.size
+    for pixel_size in pixel_sizes:
+        small_width = max(1, width // pixel_size)
+        small_height = max(1, height // pixel_size)
+        for sampling in pixel.SAMPLING_MODES:
+            duration = time_call(
+                lambda: pixel.downsample_image(img, pixel_size, small_width, small_height, sampling),
+                repeat)
+            rows.append((pixel_size, sampling, duration))
+    return rows
+
+
+def bench_startup(repeat):
+    """
+    在新的解释器进程中测量冷启动耗时，返回 [(说明, 中位耗时)]。
+    "ASCII.py 启动到处理前" 传入一个不存在的路径: 包含导入、读取配置、验证字体和准备字符查找表，
+    但不包含转换本身 (转换耗时取决于 config.ini 中的输出宽度)。
+    """
+    python = sys.executable
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, "startup.png")
+        make_synthetic_image(*STARTUP_IMAGE_SIZE).save(image_path)
+        cases = [
+            ("解释器 (python -c pass)", [python, "-c", "pass"]),
+            ("import ASCII", [python, "-c", "import ASCII"]),
+            ("import pixel", [python, "-c", "import pixel"]),
+            ("ASCII.py 启动到处理前", [python, os.path.join(SCRIPT_DIR, "ASCII.py"), "-q",
+                                       os.path.join(temp_dir, "missing")]),
+            ("pixel.py 转换一张小图", [python, os.path.join(SCRIPT_DIR, "pixel.py"), "-q", "-s", "8", image_path]),
+        ]
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [SCRIPT_DIR, env.get("PYTHONPATH")]))
+        rows = []
+        for label, command in cases:
+            duration = time_call(
+                lambda: subprocess.run(command, cwd=temp_dir, env=env, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False),
+                repeat)
+            rows.append((label, duration))
+    return rows
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="像素化采样方式性能基准")
+    parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES),
+                        help="合成图片尺寸，格式 WxH (默认: %(default)s)")
+    parser.add_argument("--pixel-sizes", type=pixel.parse_pixel_sizes,
+                        default=list(DEFAULT_PIXEL_SIZES), help="像素块大小，逗号分隔 (默认: 4,8,16)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每项重复次数 (取中位数)")
+    parser.add_argument("--skip-startup", action="store_true", help="不测量冷启动耗时")
+    parser.add_argument("--output", default=None, help="同时把结果写入此文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    lines = []
+    for size_text in args.sizes:
+        width, height = parse_size(size_text)
+        img = make_synthetic_image(width, height)
+        lines.append(f"== 缩小采样 {width}x{height} (中位数, 重复 {args.repeat} 次) ==")
+        timings = {}
+        for pixel_size, sampling, duration in bench_sampling(img, args.pixel_sizes, args.repeat):
+            timings[(pixel_size, sampling)] = duration
+            divisible = width % pixel_size == 0 and height % pixel_size == 0
+            path = "reduce" if sampling == 'average' and divisible else (
+                "box" if sampling == 'average' else "nearest")
+            lines.append(f"  {pixel_size:>3}px  {sampling:<8} [{path:<7}] {duration * 1000:8.2f} ms")
+        for pixel_size in args.pixel_sizes:
+            nearest = timings[(pixel_size, 'nearest')]
+            average = timings[(pixel_size, 'average')]
+            ratio = average / nearest if nearest > 0 else float('inf')
+            lines.append(f"  {pixel_size:>3}px  average/nearest = {ratio:.2f}x")
+
+    if not args.skip_startup:
+        lines.append(f"== 冷启动 (新进程, 中位数, 重复 {args.repeat} 次) ==")
+        for label, duration in bench_startup(args.repeat):
+            lines.append(f"  {label:<24} {duration * 1000:8.1f} ms")
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+按主机保存的性能校准配置 (ASCII.py --calibrate 使用)。
+
+在实际输入的一个样本上试运行几组设置 (工作进程数、进程/线程、小图像打包大小)，
+按吞吐量 (张/秒) 选出最快的一组，保存为 calibration/<主机名>.json；
+之后在同一主机上处理目录时自动读取。CPU 数与校准时不同的配置视为过期，不再使用。
+
+本模块不依赖 ASCII.py: 试运行由调用方以函数形式传入。
+"""
+import os
+import json
+import time
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_DIRNAME = "calibration" # 配置文件所在子目录 (与 config.ini 同级)
+PROFILE_VERSION = 1
+DEFAULT_SAMPLE_SIZE = 16 # 试运行使用的图像数
+BACKENDS = ('process', 'thread')
+BATCH_COST_FACTORS = (0.25, 4.0) # 在默认打包大小之外尝试的倍数
+MIN_IMPROVEMENT = 1.05 # 吞吐量至少提高 5% 才替换当前最快的设置 (避免追逐测量噪声)
+
+
+def profile_path(base_dir, host=None):
+    """返回本机 (或 host) 的校准配置文件路径。"""
+    return os.path.join(base_dir, CALIBRATION_DIRNAME, f"{host or socket.gethostname()}.json")
+
+
+def load_profile(base_dir):
+    """
+    读取本机的校准配置，返回 settings 字典 ({'workers', 'backend', 'batch_target_cost'})。
+    文件不存在、无法解析或 CPU 数已变化时返回 None。
+    """
+    path = profile_path(base_dir)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法读取校准配置 '{path}': {e}。使用默认设置。")
+        return None
+    if profile.get('version') != PROFILE_VERSION:
+        logger.warning(f"校准配置 '{path}' 的版本不匹配，请重新运行 --calibrate。")
+        return None
+    if profile.get('cpu_count') != os.cpu_count():
+        logger.warning(f"校准配置 '{path}' 记录的 CPU 数 ({profile.get('cpu_count')}) 与当前 ({os.cpu_count()}) 不同，"
+                       f"请重新运行 --calibrate。使用默认设置。")
+        return None
+    settings = profile.get('settings') or {}
+    if (not isinstance(settings.get('workers'), int) or settings['workers'] < 1
+            or settings.get('backend') not in BACKENDS
+            or not isinstance(settings.get('batch_target_cost'), (int, float))):
+        logger.warning(f"校准配置 '{path}' 的内容无效。使用默认设置。")
+        return None
+    return settings
+
+
+def save_profile(base_dir, settings, trials, context=None):
+    """保存校准结果，返回文件路径；无法写入时返回 None。"""
+    path = profile_path(base_dir)
+    profile = {
+        'version': PROFILE_VERSION,
+        'host': socket.gethostname(),
+        'cpu_count': os.cpu_count(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'settings': settings,
+        'context': context or {},
+        'trials': trials,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.error(f"无法保存校准配置 '{path}': {e}")
+        return None
+    return path
+
+
+def pick_sample(paths, sample_size=DEFAULT_SAMPLE_SIZE):
+    """按文件大小排序后等间隔取 sample_size 个路径，使样本覆盖输入中从小到大的各种图像。"""
+    if len(paths) <= sample_size:
+        return list(paths)
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            sizes[path] = 0
+    ordered = sorted(paths, key=sizes.get)
+    step = len(ordered) / float(sample_size)
+    return [ordered[int(i * step + step / 2)] for i in range(sample_size)]
+
+
+def candidate_workers(cpu_count):
+    """候选工作进程数: CPU 数 (默认值，最先试运行)、CPU 数的一半和 1 (去重，从大到小)。"""
+    cpu_count = max(1, cpu_count or 1)
+    return sorted({1, max(1, cpu_count // 2), cpu_count}, reverse=True)
+
+
+def calibrate(run_trial, default_batch_cost, cpu_count=None):
+    """
+    依次试运行候选设置，返回 (最快的 settings, 试运行记录列表)。
+    run_trial(settings) 处理样本并返回吞吐量 (张/秒)，失败时返回 None。
+    为控制试运行次数，逐项搜索: 先在进程后端下比较工作进程数，
+    再用最快的进程数比较线程后端，最后比较小图像打包大小。
+    第一次试运行是默认设置；候选设置的吞吐量比当前最快的高出 MIN_IMPROVEMENT 倍以上才会替换它，
+    差别在测量噪声范围内时保留默认设置。
+    """
+    trials = []
+
+    def trial(settings):
+        throughput = run_trial(settings)
+        trials.append({'settings': dict(settings), 'images_per_second': throughput})
+        if throughput is None:
+            logger.warning(f"试运行失败: {settings}")
+        else:
+            logger.info(f"  {settings['backend']:<7} 工作数 {settings['workers']:<3} "
+                        f"打包成本 {settings['batch_target_cost']:<10.0f} -> {throughput:.2f} 张/秒")
+        return throughput or 0.0
+
+    best = {'workers': max(1, cpu_count or os.cpu_count() or 1), 'backend': 'process',
+            'batch_target_cost': default_batch_cost}
+    best_throughput = -1.0
+    for workers in candidate_workers(cpu_count or os.cpu_count()):
+        settings = dict(best, workers=workers, backend='process')
+        throughput = trial(settings)
+        if throughput > best_throughput * MIN_IMPROVEMENT:
+            best, best_throughput = settings, throughput
+
+    for backend in BACKENDS:
+        if backend == best['backend']:
+            continue
+        settings = dict(best, backend=backend)
+        throughput = trial(settings)
+        if throughput > best_throughput * MIN_IMPROVEMENT:
+            best, best_throughput = settings, throughput
+
+    for factor in BATCH_COST_FACTORS:
+        settings = dict(best, batch_target_cost=default_batch_cost * factor)
+        throughput = trial(settings)
+        if throughput > best_throughput * MIN_IMPROVEMENT:
+            best, best_throughput = settings, throughput
+    return best, trials
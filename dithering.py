@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+字符网格的有序抖动 (ASCII.py 和 ASCII_single.py 共用)。
+
+灰度在映射到字符前加上按位置平铺的阈值偏移，使平缓的渐变 (如天空) 不再塌缩成
+同一字符的色带。偏移以 R+G+B 之和为单位 (整数)，因此批量查表和逐格计算的结果完全一致。
+
+- bayer:     8x8 Bayer 矩阵 (规则的交叉纹理)
+- bluenoise: 16x16 蓝噪声矩阵 (按最大空隙逐点生成，纹理更自然)
+"""
+import math
+
+DITHER_MODES = ('none', 'bayer', 'bluenoise')
+BAYER_SIZE = 8
+BLUE_NOISE_SIZE = 16
+BLUE_NOISE_SIGMA = 1.5 # 生成蓝噪声时能量函数的高斯半径
+RGB_SUM_RANGE = 768 # 灰度 0..256 对应的 R+G+B 之和范围 (与 floor((gray/256)*N) 的分桶一致)
+
+_matrix_cache = {}
+
+
+def bayer_matrix(size=BAYER_SIZE):
+    """返回 size x size 的 Bayer 排序矩阵 (元素为 0..size²-1)，size 必须是 2 的幂。"""
+    if size < 1 or size & (size - 1):
+        raise ValueError(f"Bayer 矩阵尺寸必须是 2 的幂: {size}")
+    matrix = [[0]]
+    while len(matrix) < size:
+        n = len(matrix)
+        grown = [[0] * (2 * n) for _ in range(2 * n)]
+        for y in range(n):
+            for x in range(n):
+                value = 4 * matrix[y][x]
+                grown[y][x] = value
+                grown[y][x + n] = value + 2
+                grown[y + n][x] = value + 3
+                grown[y + n][x + n] = value + 1
+        matrix = grown
+    return matrix
+
+
+def blue_noise_matrix(size=BLUE_NOISE_SIZE, sigma=BLUE_NOISE_SIGMA):
+    """
+    返回 size x size 的蓝噪声排序矩阵 (元素为 0..size²-1)。
+    每一步把下一个序号放到当前能量最低 (离已选点最远) 的位置，能量为环形距离上的高斯和；
+    能量相同时取索引最小的位置，结果是确定的。
+    """
+    count = size * size
+    kernel = [
+        [math.exp(-(min(dy, size - dy) ** 2 + min(dx, size - dx) ** 2) / (2.0 * sigma * sigma))
+         for dx in range(size)]
+        for dy in range(size)
+    ]
+    energy = [0.0] * count
+    ranks = [None] * count
+    for rank in range(count):
+        best = min((i for i in range(count) if ranks[i] is None), key=energy.__getitem__)
+        ranks[best] = rank
+        best_y, best_x = divmod(best, size)
+        for i in range(count):
+            y, x = divmod(i, size)
+            energy[i] += kernel[(y - best_y) % size][(x - best_x) % size]
+    return [ranks[row * size:(row + 1) * size] for row in range(size)]
+
+
+def _rank_matrix(mode):
+    matrix = _matrix_cache.get(mode)
+    if matrix is None:
+        matrix = bayer_matrix() if mode == 'bayer' else blue_noise_matrix()
+        _matrix_cache[mode] = matrix
+    return matrix
+
+
+def threshold_offsets(mode, num_levels):
+    """
+    返回抖动偏移矩阵 (每行一个列表，单位为 R+G+B 之和)，幅度为一个字符级的宽度。
+    mode 为 'none' 或 None 时返回 None。
+    """
+    if not mode or mode == 'none':
+        return None
+    if mode not in DITHER_MODES:
+        raise ValueError(f"未知的抖动方式 '{mode}' (可选: {', '.join(DITHER_MODES)})")
+    matrix = _rank_matrix(mode)
+    cells = len(matrix) * len(matrix)
+    step = RGB_SUM_RANGE / float(max(1, num_levels))
+    return [[int(round(((rank + 0.5) / cells - 0.5) * step)) for rank in row] for row in matrix]
+
+
+def tile_offsets(offsets, width, height, shift=0):
+    """把偏移矩阵平铺到 width x height 的网格，返回按行展开的列表 (每个值再加上 shift)。"""
+    size = len(offsets)
+    row_patterns = []
+    for row in offsets:
+        repeated = (row * (width // size + 1))[:width]
+        row_patterns.append([value + shift for value in repeated] if shift else repeated)
+    tiled = []
+    for y in range(height):
+        tiled.extend(row_patterns[y % size])
+    return tiled
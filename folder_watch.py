@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+热文件夹监视 (ASCII.py --watch 使用)。
+
+FolderWatcher 报告文件夹中新建或修改、并且已经写完的文件:
+- Linux 上通过 ctypes 调用 inotify (IN_CLOSE_WRITE / IN_MOVED_TO)，事件到达后立即检查；
+- 其他平台或 inotify 不可用时退回为定期扫描 (比较修改时间和大小)。
+两种方式都做防抖: 文件的大小和修改时间在 debounce 秒内保持不变才视为写完，
+避免处理仍在复制中的半个文件。
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE_SECONDS = 0.3 # 文件大小/修改时间保持不变多久后视为写完
+DEFAULT_POLL_INTERVAL = 0.25 # 扫描模式的扫描间隔 (秒)
+IGNORED_SUFFIXES = ('.tmp', '.part', '.crdownload', '~') # 下载/复制过程中的临时文件
+
+# inotify 常量 (见 <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+_INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_INOTIFY_EVENT = struct.Struct('iIII') # wd, mask, cookie, len
+_INOTIFY_READ_SIZE = 64 * 1024
+
+
+def file_signature(path):
+    """返回 (修改时间 ns, 大小)，文件不存在或不可访问时返回 None。"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class _InotifyBackend:
+    """通过 ctypes 调用 libc 的 inotify 接口 (只监视单个目录，不递归)。"""
+
+    def __init__(self, dir_path):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        watch = libc.inotify_add_watch(self._fd, os.fsencode(dir_path), _INOTIFY_MASK)
+        if watch < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, f"inotify_add_watch 失败: {dir_path}")
+        self.dir_path = dir_path
+
+    def wait(self, timeout):
+        """等待最多 timeout 秒，返回 (有变化的文件名集合, 是否需要全量扫描)。"""
+        readable, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        if not readable:
+            return set(), False
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, _INOTIFY_READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset + _INOTIFY_EVENT.size <= len(data):
+                _, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if mask & IN_Q_OVERFLOW: # 事件队列溢出，可能丢失了事件
+                    overflow = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class FolderWatcher:
+    """
+    监视 dir_path 中扩展名属于 extensions 的文件。
+
+    用法:
+        with FolderWatcher(path, extensions) as watcher:
+            while True:
+                for ready_path in watcher.poll(timeout=0.25):
+                    ...
+    """
+
+    def __init__(self, dir_path, extensions, debounce=DEFAULT_DEBOUNCE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+        self.dir_path = dir_path
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._backend = None
+        self._snapshot = {} # 扫描模式: {路径: 签名}
+        self._pending = {} # 等待写完的文件: {路径: (签名, 签名最后变化的时间)}
+        self._last_scan = 0.0
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._backend = _InotifyBackend(dir_path)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify 不可用 ({e})，改为每 {poll_interval} 秒扫描一次。")
+        self.mode = "inotify" if self._backend is not None else "polling"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+    def _is_candidate(self, name):
+        lower = name.lower()
+        return (not name.startswith('.') and lower.endswith(self.extensions)
+                and not lower.endswith(IGNORED_SUFFIXES))
+
+    def scan(self):
+        """扫描整个文件夹，返回 {路径: 签名}。"""
+        found = {}
+        try:
+            with os.scandir(self.dir_path) as entries:
+                for entry in entries:
+                    if entry.is_file() and self._is_candidate(entry.name):
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            logger.warning(f"扫描监视目录 '{self.dir_path}' 失败: {e}")
+        return found
+
+    def watch_existing(self):
+        """把文件夹中现有的文件加入待确认列表，经过同样的防抖后由 poll 返回。"""
+        now = time.monotonic()
+        current = self.scan()
+        for path in current:
+            self._mark_changed(path, now)
+        self._snapshot = current
+        self._last_scan = now
+
+    def _mark_changed(self, path, now):
+        signature = file_signature(path)
+        if signature is None:
+            self._pending.pop(path, None)
+            return
+        previous = self._pending.get(path)
+        if previous is None or previous[0] != signature:
+            self._pending[path] = (signature, now)
+
+    def poll(self, timeout=DEFAULT_POLL_INTERVAL):
+        """
+        等待最多 timeout 秒，返回已经写完 (签名在 debounce 秒内未变化) 的文件路径列表。
+        同一个文件每次写完只返回一次；之后再次修改会再次返回。
+        """
+        # 有等待写完的文件时缩短等待时间，以便及时确认
+        if self._pending:
+            timeout = min(timeout, self.debounce / 2.0)
+        now = time.monotonic()
+        if self._backend is not None:
+            names, overflow = self._backend.wait(timeout)
+            now = time.monotonic()
+            if overflow:
+                for path in self.scan():
+                    self._mark_changed(path, now)
+            for name in names:
+                if self._is_candidate(name):
+                    self._mark_changed(os.path.join(self.dir_path, name), now)
+        else:
+            time.sleep(max(0.0, min(timeout, self._last_scan + self.poll_interval - now)))
+            now = time.monotonic()
+            if now - self._last_scan >= self.poll_interval:
+                self._last_scan = now
+                current = self.scan()
+                for path, signature in current.items():
+                    if self._snapshot.get(path) != signature:
+                        self._mark_changed(path, now)
+                self._snapshot = current
+
+        ready = []
+        for path, (signature, changed_at) in list(self._pending.items()):
+            current = file_signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current != signature:
+                self._pending[path] = (current, now) # 仍在写入
+            elif now - changed_at >= self.debounce:
+                del self._pending[path]
+                ready.append(path)
+        return ready
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+日志与进度显示辅助模块 (ASCII.py 和 pixel.py 共用)。
+
+- setup_logging: 根据详细程度配置根日志记录器，日志输出到 stderr。
+- init_worker_logging: 作为进程池 initializer，让工作进程使用相同的日志级别。
+- ProgressLine: 批处理时的单行实时进度 (完成数/总数、张/秒、预计剩余时间、失败数)。
+"""
+import os
+import sys
+import time
+import logging
+
+# 详细程度 -> 日志级别 (-q: 只显示警告和错误, 默认: 信息, -v: 每个文件的详细信息)
+VERBOSITY_LEVELS = {
+    -1: logging.WARNING,
+    0: logging.INFO,
+    1: logging.DEBUG,
+}
+
+LOG_FORMAT_INFO = "%(message)s"
+LOG_FORMAT_DETAIL = "[%(levelname)s] %(message)s"
+LOG_FORMAT_WORKER_DETAIL = "[%(levelname)s][PID:%(process)d] %(message)s"
+
+# 回到行首并清除整行 (中文字符宽度不等于 len()，用空格覆盖不可靠)
+ERASE_LINE = "\r\033[K"
+
+# 当前活动的进度行 (同一时间最多一个)，日志处理器在输出前会先擦除它
+_active_progress = None
+# 工作进程: stderr 是终端时，输出日志前擦除主进程的进度行 (由主进程在下次更新时重新绘制)
+_worker_erases_line = False
+
+
+class _LevelAwareFormatter(logging.Formatter):
+    """INFO 级别只输出消息本身，其他级别带上级别前缀 (工作进程中还带上 PID)。"""
+
+    def __init__(self, in_worker=False):
+        super().__init__()
+        self._info_formatter = logging.Formatter(LOG_FORMAT_INFO)
+        detail_format = LOG_FORMAT_WORKER_DETAIL if in_worker else LOG_FORMAT_DETAIL
+        self._detail_formatter = logging.Formatter(detail_format)
+
+    def format(self, record):
+        if record.levelno == logging.INFO:
+            return self._info_formatter.format(record)
+        return self._detail_formatter.format(record)
+
+
+class _ProgressAwareHandler(logging.StreamHandler):
+    """
+    输出日志前擦除活动的进度行，输出后重新绘制，避免日志与进度行交错。
+    工作进程中没有自己的进度行，只擦除主进程的进度行，不重新绘制。
+    """
+
+    def emit(self, record):
+        progress = _active_progress
+        if progress is not None and progress.is_live:
+            progress.clear()
+        elif _worker_erases_line:
+            self.stream.write(ERASE_LINE)
+        super().emit(record)
+        if progress is not None and progress.is_live:
+            progress.render(force=True)
+
+
+def _configure_root(level, in_worker):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = _ProgressAwareHandler(sys.stderr)
+    handler.setFormatter(_LevelAwareFormatter(in_worker=in_worker))
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Pillow 的插件加载日志对用户没有意义，调试级别下也不显示
+    logging.getLogger("PIL").setLevel(max(level, logging.INFO))
+
+
+def verbosity_to_level(verbosity):
+    """把 -q/-v 计数转换为日志级别 (超出范围时取最接近的级别)。"""
+    verbosity = max(min(VERBOSITY_LEVELS), min(max(VERBOSITY_LEVELS), verbosity))
+    return VERBOSITY_LEVELS[verbosity]
+
+
+def setup_logging(verbosity=0):
+    """配置主进程的日志输出，返回使用的日志级别 (可传给 init_worker_logging)。"""
+    level = verbosity_to_level(verbosity)
+    _configure_root(level, in_worker=False)
+    return level
+
+
+def _is_live_terminal(stream):
+    """stream 是否为支持 '\\r' 和 ANSI 控制序列的终端。"""
+    is_tty = hasattr(stream, 'isatty') and stream.isatty()
+    return is_tty and os.environ.get('TERM') != 'dumb'
+
+
+def init_worker_logging(level):
+    """
+    进程池 initializer: 在工作进程中按主进程的级别配置日志。
+    进程池在进度行显示期间才 fork 工作进程，继承的 _active_progress 是主进程进度的过期副本，
+    必须丢弃，否则工作进程输出日志后会重新绘制旧的进度 (看起来进度在倒退)。
+    """
+    global _active_progress, _worker_erases_line
+    _active_progress = None
+    _worker_erases_line = _is_live_terminal(sys.stderr)
+    _configure_root(level, in_worker=True)
+
+
+def _format_duration(seconds):
+    seconds = int(max(0, seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+class ProgressLine:
+    """
+    批处理的单行实时进度显示，写入 stderr。
+
+    stderr 是终端时使用 '\\r' 原地刷新 (最多每 refresh_interval 秒一次)；
+    否则 (例如重定向到文件) 每 log_interval 秒输出一行普通日志，避免写出大量控制字符。
+    total 可以在运行中通过 add_total 增加 (流式扫描时总数事先未知)。
+    """
+
+    def __init__(self, total=0, label="进度", unit="张", refresh_interval=0.1,
+                 log_interval=10.0, stream=None):
+        self.total = total
+        self.label = label
+        self.unit = unit
+        self.done = 0
+        self.failed = 0
+        self.refresh_interval = refresh_interval
+        self.log_interval = log_interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.start_time = time.perf_counter()
+        self._last_render = self.start_time
+        self._drawn = False
+        self._closed = False
+        # 安静模式 (-q) 下不显示实时进度行
+        self.enabled = logging.getLogger().isEnabledFor(logging.INFO)
+        self.is_live = self.enabled and _is_live_terminal(self.stream)
+
+    def __enter__(self):
+        global _active_progress
+        _active_progress = self
+        self.render(force=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def add_total(self, count=1):
+        self.total += count
+        self.render()
+
+    def update(self, done=1, failed=0):
+        """记录 done 个已完成的项目，其中 failed 个失败。"""
+        self.done += done
+        self.failed += failed
+        self.render()
+
+    def _compose(self):
+        elapsed = time.perf_counter() - self.start_time
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.total and rate > 0:
+            eta = _format_duration((self.total - self.done) / rate)
+        else:
+            eta = "--:--"
+        total_text = str(self.total) if self.total else "?"
+        return (f"{self.label} {self.done}/{total_text} | {rate:.1f} {self.unit}/秒 | "
+                f"剩余 {eta} | 失败 {self.failed}")
+
+    def clear(self):
+        if self.is_live and self._drawn:
+            self.stream.write(ERASE_LINE)
+            self.stream.flush()
+
+    def render(self, force=False):
+        if not self.enabled or self._closed:
+            return
+        now = time.perf_counter()
+        interval = self.refresh_interval if self.is_live else self.log_interval
+        if not force and now - self._last_render < interval:
+            return
+        self._last_render = now
+        text = self._compose()
+        if self.is_live:
+            self.stream.write(ERASE_LINE + text)
+            self.stream.flush()
+            self._drawn = True
+        elif not force:
+            logging.getLogger(__name__).info(text)
+
+    def close(self):
+        """输出最终状态并结束进度行。"""
+        global _active_progress
+        if self._closed:
+            return
+        if self.enabled:
+            text = self._compose()
+            if self.is_live:
+                self.stream.write(ERASE_LINE + text + "\n")
+                self.stream.flush()
+            else:
+                logging.getLogger(__name__).info(text)
+        self._closed = True
+        if _active_progress is self:
+            _active_progress = None
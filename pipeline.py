@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段流水线 (ASCII.py 目录流水线模式使用)。
+
+读取 -> 计算 -> 写入 三个阶段同时运行，阶段之间用有界队列连接:
+- 读取线程把输入读入内存 (I/O 等待不占用计算进程)；
+- 主线程把读取结果提交给计算阶段 (通常是进程池)，同时进行中的任务数有上限；
+- 写入线程把计算结果写到磁盘。
+任一阶段变慢时，上游在队列满后等待 (背压)，因此内存中同时存在的数据量有上限。
+
+本模块不依赖 ASCII.py: 各阶段的具体工作由调用方以函数形式传入。
+"""
+import queue
+import logging
+import threading
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+_STAGE_POLL_SECONDS = 0.05 # 等待队列时检查停止标志的间隔
+_DONE = object() # 读取线程结束的标记
+
+
+def _put(target_queue, value, stop):
+    """放入有界队列；队列满时等待，收到停止信号时放弃并返回 False。"""
+    while not stop.is_set():
+        try:
+            target_queue.put(value, timeout=_STAGE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_pipeline(items, read, compute, write, on_done, on_error,
+                 reader_threads=2, writer_threads=2, queue_size=8, max_in_flight=2,
+                 cost=None, cost_budget=None):
+    """
+    按 items 的顺序处理所有条目，直到全部完成。
+    read(item) 在读取线程中执行，返回数据；
+    compute(item, data) 在主线程中调用，提交计算任务并返回 Future；
+    write(item, result) 在写入线程中执行，返回值交给 on_done(item, value)。
+    任一阶段抛出异常时调用 on_error(item, stage, exc)，stage 为 'read'、'compute' 或 'write'。
+    on_done 和 on_error 可能在不同线程中调用，但总是串行执行 (持有同一把锁)。
+    读取队列和写入队列各最多容纳 queue_size 项，计算阶段同时最多 max_in_flight 个任务。
+    cost(item) 返回条目的估算成本 (如峰值内存)；给出 cost_budget 时，计算阶段中的成本之和不超过预算，
+    装不下的条目等到有任务完成后再提交 (计算阶段为空时总是提交，超出预算的单个条目也能完成)。
+    """
+    pending_items = queue.Queue()
+    for item in items:
+        pending_items.put(item)
+    read_queue = queue.Queue(maxsize=max(1, queue_size))
+    write_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    callback_lock = threading.Lock()
+
+    def report_done(item, value):
+        with callback_lock:
+            on_done(item, value)
+
+    def report_error(item, stage, exc):
+        with callback_lock:
+            on_error(item, stage, exc)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                item = pending_items.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                entry = (item, read(item), None)
+            except Exception as exc:
+                entry = (item, None, exc)
+            if not _put(read_queue, entry, stop):
+                return
+        _put(read_queue, _DONE, stop)
+
+    def writer():
+        while True:
+            try:
+                entry = write_queue.get(timeout=_STAGE_POLL_SECONDS)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if entry is _DONE:
+                return
+            item, result = entry
+            try:
+                value = write(item, result)
+            except Exception as exc:
+                report_error(item, 'write', exc)
+            else:
+                report_done(item, value)
+
+    num_readers = max(1, reader_threads)
+    threads = [threading.Thread(target=reader, name=f"pipeline-read-{i}", daemon=True) for i in range(num_readers)]
+    threads += [threading.Thread(target=writer, name=f"pipeline-write-{i}", daemon=True)
+                for i in range(max(1, writer_threads))]
+    for thread in threads:
+        thread.start()
+
+    readers_left = num_readers
+    in_flight = {} # future -> (item, 成本)
+    in_flight_cost = 0
+    held = None # 已读取、但因成本预算暂不能提交的 (item, data, 成本)
+    try:
+        while readers_left or in_flight or held:
+            # 1. 已完成的计算结果交给写入线程 (写入队列满时在这里等待)
+            for future in [future for future in in_flight if future.done()]:
+                item, item_cost = in_flight.pop(future)
+                in_flight_cost -= item_cost
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    report_error(item, 'compute', exc)
+                    continue
+                _put(write_queue, (item, result), stop)
+
+            # 2. 计算阶段有空位时取下一个读取结果
+            if held is None and readers_left and len(in_flight) < max_in_flight:
+                try:
+                    entry = read_queue.get(timeout=_STAGE_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if entry is _DONE:
+                    readers_left -= 1
+                    continue
+                item, data, exc = entry
+                if exc is not None:
+                    report_error(item, 'read', exc)
+                    continue
+                held = (item, data, (cost(item) or 0) if cost else 0)
+
+            # 3. 成本预算允许时提交，否则等待某个任务完成
+            if held is not None and len(in_flight) < max_in_flight:
+                item, data, item_cost = held
+                if not in_flight or cost_budget is None or in_flight_cost + item_cost <= cost_budget:
+                    held = None
+                    try:
+                        in_flight[compute(item, data)] = (item, item_cost)
+                        in_flight_cost += item_cost
+                    except Exception as exc:
+                        report_error(item, 'compute', exc)
+                    continue
+            if in_flight:
+                concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for _ in range(max(1, writer_threads)):
+            _put(write_queue, _DONE, stop)
+    finally:
+        if readers_left or in_flight or held:
+            stop.set() # 异常或中断: 让读取/写入线程尽快退出
+            for future in in_flight:
+                future.cancel()
+        for thread in threads:
+            thread.join()
@@ -1,134 +1,686 @@
-from PIL import Image
+from PIL import Image, PngImagePlugin
 import os
 import sys
+import io # 管道模式 (--pipe) 在内存中解码和编码
+import zlib # 流式 PNG 写出 (--tiled)
+import struct
+import contextlib # 分块模式临时放宽 Pillow 的图片尺寸限制
 import time # <<< Import time module
-import traceback # Import traceback for better error reporting
+import logging # 分级日志
+import argparse # 命令行参数
+import concurrent.futures # 用于并行处理
+import multiprocessing # 冻结环境下的多进程支持
+import log_utils # 日志配置与进度行
+import stream_frames # stdin/stdout 管道模式 (--pipe)
+
+logger = logging.getLogger("pixel")
 
 # --- 常量定义 ---
 SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+MAX_PENDING_TASKS_PER_WORKER = 4 # 每个工作进程最多排队的任务数 (限制流式提交的内存占用)
+
+# --- 输出模式 ---
+# full:    放大回原始尺寸 (默认，与以前的行为一致)
+# integer: 按像素块大小做精确整数倍放大，每个块都是 pixel_size x pixel_size (边缘不足一块的部分被裁掉)
+# small:   直接保存缩小后的图片，缩放倍数记录在文件名 (_<N>px) 和 PNG 文本块 pixel_scale 中，
+#          适用于显示端自行使用最近邻缩放的场景，省去构建全尺寸画布
+OUTPUT_MODES = ('full', 'integer', 'small')
+
+# --- 缩小采样方式 ---
+# nearest: 每个块取其中一个像素的颜色 (默认，与以前的行为一致)
+# average: 每个块取块内所有像素的平均色 (尺寸能被整除时用 Image.reduce，否则用 BOX 重采样)
+SAMPLING_MODES = ('nearest', 'average')
+
+try:
+    NEAREST = Image.Resampling.NEAREST # Pillow >= 9.0.0
+    BOX = Image.Resampling.BOX
+except AttributeError:
+    NEAREST = Image.NEAREST # 兼容旧版 Pillow
+    BOX = Image.BOX
+
+# --- 复古调色板 ---
+# 调色板量化在缩小后的 small_img 上进行 (像素数只有原图的 1/pixel_size^2)，
+# 放大时保持 'P' (索引) 模式，因此 PNG 输出直接是索引色 PNG。
+FIXED_PALETTES = {
+    'pico8': ['#000000', '#1D2B53', '#7E2553', '#008751', '#AB5236', '#5F574F', '#C2C3C7', '#FFF1E8',
+              '#FF004D', '#FFA300', '#FFEC27', '#00E436', '#29ADFF', '#83769C', '#FF77A8', '#FFCCAA'],
+    'gameboy': ['#0F380F', '#306230', '#8BAC0F', '#9BBC0F'],
+}
+MAX_ADAPTIVE_COLORS = 256
+LOSSY_EXTENSIONS = ('.jpg', '.jpeg', '.webp') # 有损格式会破坏调色板，量化后改存 PNG
 
-def pixelate_image(input_path, output_path, pixel_size):
+try:
+    DITHER_NONE = Image.Dither.NONE # Pillow >= 9.1.0
+    MEDIANCUT = Image.Quantize.MEDIANCUT
+except AttributeError:
+    DITHER_NONE = Image.NONE # 兼容旧版 Pillow
+    MEDIANCUT = Image.MEDIANCUT
+
+# 每个进程缓存一次构建好的固定调色板图像 {名称: (调色板图像, 扁平 RGB 列表)}
+_palette_image_cache = {}
+
+def _resolve_save_format(output_path):
+    """
+    根据扩展名确定保存格式。扩展名未知或不支持时改为 PNG。
+
+    Returns:
+        tuple: (output_path, save_format)，save_format 为 Pillow 格式名 (大写)。
     """
-    将输入图片转换为像素风格，并记录各步骤耗时。
-    (此函数保持不变)
+    save_format = os.path.splitext(output_path)[1].lower().strip('.')
+    if save_format == 'jpg': save_format = 'jpeg' # Pillow 使用 'jpeg'
+    if not save_format or f".{save_format}" not in SUPPORTED_EXTENSIONS:
+        logger.warning(f"输出扩展名 '{save_format}' 未知或不支持，将尝试以 PNG 格式保存。")
+        output_path = os.path.splitext(output_path)[0] + '.png'
+        save_format = 'png'
+    return output_path, save_format.upper()
+
+def parse_palette(text):
+    """
+    解析调色板选项。
+
+    Returns:
+        tuple or None: None 表示不量化；('adaptive', 颜色数) 表示中位切分 (median-cut)；
+                       ('fixed', 名称) 表示映射到 FIXED_PALETTES 中的固定调色板。
+
+    Raises:
+        ValueError: 无法识别的调色板名称或颜色数超出范围。
+    """
+    name = str(text).strip().lower()
+    if name in ('', 'none'):
+        return None
+    if name in FIXED_PALETTES:
+        return ('fixed', name)
+    if name.startswith('adaptive'):
+        name = name[len('adaptive'):].lstrip(':')
+    if name.isdigit():
+        colors = int(name)
+        if 2 <= colors <= MAX_ADAPTIVE_COLORS:
+            return ('adaptive', colors)
+        raise ValueError(f"颜色数必须在 2 到 {MAX_ADAPTIVE_COLORS} 之间。")
+    raise ValueError(f"未知的调色板 '{text}' (可选: 颜色数如 16/32/64, 或 {', '.join(FIXED_PALETTES)})。")
+
+def palette_tag(palette):
+    """调色板在输出文件名中的标识，例如 16c 或 pico8。"""
+    kind, value = palette
+    return f"{value}c" if kind == 'adaptive' else value
+
+def _get_palette_image(name):
+    """构建 (并缓存) 固定调色板对应的 'P' 模式图像，供 Image.quantize 使用。"""
+    cached = _palette_image_cache.get(name)
+    if cached is None:
+        flat = []
+        for hex_color in FIXED_PALETTES[name]:
+            flat.extend(int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+        # 不足 256 色的部分用第一种颜色填充；最近色搜索在距离相同时取较小的索引，
+        # 因此填充项永远不会被选中
+        padded = flat + flat[:3] * (256 - len(flat) // 3)
+        palette_img = Image.new('P', (1, 1))
+        palette_img.putpalette(padded)
+        cached = (palette_img, flat)
+        _palette_image_cache[name] = cached
+    return cached
+
+def quantize_small_image(small_img, palette):
+    """
+    在缩小后的图像上进行调色板量化，返回 'P' 模式图像。
+    固定调色板通过 Pillow 的 C 实现映射 (内部使用颜色立方体查找缓存，每种颜色只搜索一次)。
+    """
+    kind, value = palette
+    if kind == 'adaptive':
+        return small_img.quantize(colors=value, method=MEDIANCUT, dither=DITHER_NONE)
+    palette_img, flat = _get_palette_image(value)
+    quantized = small_img.quantize(palette=palette_img, dither=DITHER_NONE)
+    quantized.putpalette(flat) # 去掉填充项，使 PNG 只写出实际颜色 (并自动使用更低位深)
+    return quantized
+
+def downsample_image(img, pixel_size, small_width, small_height, sampling='nearest', output_mode='full'):
+    """
+    把图片缩小到 small_width x small_height，每个输出像素对应一个像素块。
+
+    average 模式下:
+    - 宽高都能被 pixel_size 整除时使用 Image.reduce (整数倍块平均，C 实现，一次遍历)；
+    - integer/small 模式只使用完整的块 (边缘不足一块的部分本来就会被裁掉)，
+      因此用 reduce 的 box 参数只对完整块区域做整数倍平均；
+    - 其他情况 (full 模式且尺寸不能整除) 使用 BOX 重采样，块边界按比例分摊到整张图上。
+    """
+    if sampling != 'average':
+        return img.resize((small_width, small_height), NEAREST)
+    width, height = img.size
+    if pixel_size > 1 and width >= pixel_size and height >= pixel_size:
+        if width % pixel_size == 0 and height % pixel_size == 0:
+            return img.reduce(pixel_size)
+        if output_mode != 'full':
+            return img.reduce(pixel_size, box=(0, 0, small_width * pixel_size, small_height * pixel_size))
+    return img.resize((small_width, small_height), BOX)
+
+# --- 分块流式处理 (超大图片，--tiled) ---
+# 源图按条带 (strip) 读取并逐条缩小，缩小结果 (只有原图的 1/pixel_size^2) 在内存中拼接；
+# full/integer 模式的全尺寸输出逐行压缩写入 PNG，不在内存中构建完整的全尺寸画布。
+# 峰值内存 ≈ 一个条带 + 缩小后的图片，与原图尺寸无关。
+TILED_STRIP_TARGET_PIXELS = 4 * 1024 * 1024 # 每个读取/写出条带的目标像素数 (峰值内存约为其 50 倍字节)
+PNG_IDAT_CHUNK_SIZE = 256 * 1024 # 流式 PNG 每个 IDAT 块的大致字节数
+PNG_COMPRESS_LEVEL = 6 # 与 Pillow 保存 PNG 的默认压缩级别一致
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+@contextlib.contextmanager
+def _open_large_image(path):
+    """
+    打开分块模式的源图片。分块模式的内存占用与图片尺寸无关，只在打开时临时关闭
+    Pillow 的解压炸弹尺寸检查 (Image.MAX_IMAGE_PIXELS)，不影响进程中的其他处理。
+    """
+    saved_limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        im = Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = saved_limit
+    with im:
+        yield im
+
+def _replace_tile(tile, extents, offset):
+    """返回修改了区域和文件偏移的 tile 描述 (Pillow >= 11 使用具名元组)。"""
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents, offset=offset)
+    return (tile[0], extents, offset, tile[3])
+
+class _StripSource:
+    """
+    按行区间读取源图片 (返回 RGB 条带)。
+
+    未压缩的 raw 布局 (BMP、PPM、未压缩 TIFF 等) 通过改写 Pillow 的 tile 描述只解码请求的行；
+    PNG、JPEG、压缩 TIFF 等无法按行随机访问的格式退回为一次性解码整张图片。
+    JPEG 在给出 draft_size 时使用 DCT 缩放解码 (仅用于 average 采样)，解码尺寸最多缩小到 1/8。
+    """
+
+    def __init__(self, path, draft_size=None):
+        self.path = path
+        self._layout = None
+        self._full = None
+        with _open_large_image(path) as probe:
+            self.original_size = probe.size
+            self.format = probe.format
+            self._layout = self._plan_layout(probe)
+            if self._layout is None:
+                if draft_size is not None and probe.format == 'JPEG':
+                    probe.draft('RGB', draft_size)
+                self._full = probe.convert('RGB')
+        self.size = self._full.size if self._full is not None else self.original_size
+
+    @property
+    def is_lazy(self):
+        return self._layout is not None
+
+    @staticmethod
+    def _plan_layout(im):
+        tiles = list(im.tile)
+        if not tiles or any(tile[0] != 'raw' for tile in tiles):
+            return None
+        width, height = im.size
+        if len(tiles) > 1:
+            return ('tiles', tiles)
+        tile = tiles[0]
+        if tuple(tile[1]) != (0, 0, width, height):
+            return None
+        args = (tile[3],) if isinstance(tile[3], str) else tuple(tile[3])
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if not stride:
+            try:
+                stride = len(Image.new(rawmode, (width, 1)).tobytes())
+            except ValueError: # 非标准的 rawmode，无法推算行跨度
+                return None
+        return ('rows', tile, stride, orientation)
+
+    def read(self, top, bottom):
+        """读取第 top 到 bottom-1 行，返回 RGB 图片。"""
+        width, height = self.size
+        if self._full is not None:
+            return self._full.crop((0, top, width, bottom))
+
+        with _open_large_image(self.path) as band:
+            if self._layout[0] == 'rows':
+                _, tile, stride, orientation = self._layout
+                first_row = top if orientation > 0 else height - bottom # 自底向上存储 (BMP)
+                band.tile = [_replace_tile(tile, (0, 0, width, bottom - top), tile[2] + first_row * stride)]
+                load_top, load_bottom = top, bottom
+            else:
+                selected = [tile for tile in self._layout[1] if tile[1][1] < bottom and tile[1][3] > top]
+                load_top = min(tile[1][1] for tile in selected)
+                load_bottom = max(tile[1][3] for tile in selected)
+                band.tile = [
+                    _replace_tile(tile, (tile[1][0], tile[1][1] - load_top, tile[1][2], tile[1][3] - load_top),
+                                  tile[2])
+                    for tile in selected
+                ]
+            band._size = (width, load_bottom - load_top)
+            band.load()
+            strip = band.convert('RGB')
+        if (load_top, load_bottom) != (top, bottom): # 按 TIFF 条带边界多读的行
+            strip = strip.crop((0, top - load_top, width, bottom - load_top))
+        return strip
+
+    def close(self):
+        self._full = None
+
+def nearest_source_rows(source_height, output_height):
+    """
+    最近邻缩放到 output_height 行时，每个输出行取自的源行。
+    直接用 Pillow 缩放一列行号，坐标计算 (包括逐行的浮点累加) 与 Image.resize 完全相同，
+    条带处理和流式写出因此能与整图缩放逐像素一致。
+    """
+    row_numbers = Image.new('I', (1, source_height))
+    row_numbers.putdata(range(source_height))
+    return list(struct.unpack(f'={output_height}i', row_numbers.resize((1, output_height), NEAREST).tobytes()))
+
+def box_source_rows(source_height, output_height):
+    """
+    BOX 缩放到 output_height 行时，每个输出行平均的源行区间 [(起始行, 行数)]。
+    BOX 滤波的权重只有 0 和 1，区间按 Pillow 计算滤波系数时相同的浮点运算确定
+    (中心 (i + 0.5) * scale，落在 (-0.5, 0.5] 内的行权重为 1)；
+    对每个区间单独缩放到一行时，Pillow 使用的定点系数与整图缩放相同。
+    """
+    scale = source_height / output_height
+    support = 0.5 * max(1.0, scale)
+    inverse = 1.0 / max(1.0, scale)
+    rows = []
+    for output_row in range(output_height):
+        center = (output_row + 0.5) * scale
+        first = max(0, int(center - support + 0.5))
+        last = min(source_height, int(center + support + 0.5))
+        selected = [row for row in range(first, last) if -0.5 < (row - center + 0.5) * inverse <= 0.5]
+        rows.append((selected[0], len(selected)))
+    return rows
+
+def downsample_tiled(source, pixel_size, small_width, small_height, sampling='nearest', output_mode='full'):
+    """
+    按条带读取源图片并缩小，结果与 downsample_image 对整张图片的处理一致:
+    nearest 按 nearest_source_rows 取整图缩放时的源行再横向缩小；
+    average 在块区域是整数倍时与 downsample_image 一样按块对齐的条带 reduce，
+    否则按 box_source_rows 逐行平均与整图缩放相同的源行。
+    JPEG 按 draft 缩小解码时 (源图已经是近似值) 按缩放比例计算每个条带的采样区域。
+    """
+    original_width, original_height = source.original_size
+    loaded_width, loaded_height = source.size
+    if sampling == 'average' and output_mode != 'full':
+        # 与 downsample_image 相同: 只对完整的块区域求平均
+        region_width = min(original_width, small_width * pixel_size)
+        region_height = min(original_height, small_height * pixel_size)
+    else:
+        region_width, region_height = original_width, original_height
+    # 换算到实际解码的坐标 (JPEG draft 解码时尺寸会变小)
+    region_width *= loaded_width / original_width
+    region_height *= loaded_height / original_height
+    scale_y = region_height / small_height
+    # 块区域恰好是整数倍时与 downsample_image 一样使用 reduce (条带与块边界对齐，结果逐像素一致)
+    use_reduce = (sampling == 'average' and pixel_size > 1 and source.size == source.original_size
+                  and region_width == small_width * pixel_size and region_height == small_height * pixel_size)
+
+    small_img = Image.new('RGB', (small_width, small_height))
+    rows_per_strip = max(1, int(TILED_STRIP_TARGET_PIXELS // max(1.0, loaded_width * scale_y)))
+    if sampling != 'average':
+        source_rows = nearest_source_rows(original_height, small_height)
+        for row_start in range(0, small_height, rows_per_strip):
+            row_end = min(small_height, row_start + rows_per_strip)
+            top = source_rows[row_start]
+            strip = source.read(top, source_rows[row_end - 1] + 1)
+            # 只保留被采样的行，高度不变的横向缩放与整图缩放的列坐标相同
+            picked = Image.new('RGB', (original_width, row_end - row_start))
+            for index, source_row in enumerate(source_rows[row_start:row_end]):
+                picked.paste(strip.crop((0, source_row - top, original_width, source_row - top + 1)), (0, index))
+            small_img.paste(picked.resize((small_width, row_end - row_start), NEAREST), (0, row_start))
+        return small_img
+    if not use_reduce and source.size == source.original_size:
+        source_rows = box_source_rows(int(region_height), small_height)
+        for row_start in range(0, small_height, rows_per_strip):
+            row_end = min(small_height, row_start + rows_per_strip)
+            top = source_rows[row_start][0]
+            strip = source.read(top, sum(source_rows[row_end - 1]))
+            for row, (first, count) in enumerate(source_rows[row_start:row_end], row_start):
+                part = strip.resize((small_width, 1), BOX, box=(0, first - top, region_width, first - top + count))
+                small_img.paste(part, (0, row))
+        return small_img
+    for row_start in range(0, small_height, rows_per_strip):
+        row_end = min(small_height, row_start + rows_per_strip)
+        y_start, y_end = row_start * scale_y, row_end * scale_y
+        top = int(y_start)
+        bottom = min(loaded_height, max(top + 1, -int(-y_end // 1)))
+        strip = source.read(top, bottom)
+        if use_reduce:
+            part = strip.reduce(pixel_size, box=(0, 0, int(region_width), bottom - top))
+        else:
+            part = strip.resize((small_width, row_end - row_start), BOX,
+                                box=(0, y_start - top, region_width, y_end - top))
+        small_img.paste(part, (0, row_start))
+    return small_img
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+def write_upscaled_png_streaming(small_img, output_path, output_width, output_height):
+    """
+    把 small_img 用最近邻放大到 output_width x output_height，逐行压缩写入 PNG。
+    每个缩小后的行只横向展开一次；与上一行相同的输出行使用 PNG 的 Up 滤波 (整行为 0)，
+    因此重复行几乎不占压缩时间和文件大小。支持 'RGB' 和 'P' (调色板) 模式。
+    """
+    small_width, small_height = small_img.size
+    if small_img.mode == 'P':
+        color_type, bytes_per_pixel = 3, 1
+        palette = small_img.getpalette() or []
+    else:
+        small_img = small_img.convert('RGB')
+        color_type, bytes_per_pixel, palette = 2, 3, None
+    row_bytes = output_width * bytes_per_pixel
+    source_rows = nearest_source_rows(small_height, output_height) # 与 Image.resize 相同的行映射
+    repeat_row = b'\x02' + bytes(row_bytes) # Up 滤波，与上一行相同
+    rows_per_chunk = max(1, TILED_STRIP_TARGET_PIXELS // output_width)
+    compressor = zlib.compressobj(PNG_COMPRESS_LEVEL)
+
+    with open(output_path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', output_width, output_height, 8, color_type, 0, 0, 0)))
+        if palette is not None:
+            f.write(_png_chunk(b'PLTE', bytes(palette[:768])))
+
+        pending = []
+        pending_size = 0
+        def flush_compressed(data):
+            nonlocal pending_size
+            if data:
+                pending.append(data)
+                pending_size += len(data)
+            if pending_size >= PNG_IDAT_CHUNK_SIZE:
+                f.write(_png_chunk(b'IDAT', b''.join(pending)))
+                pending.clear()
+                pending_size = 0
+
+        previous_row = -1
+        output_row = 0
+        for row_start in range(0, small_height, rows_per_chunk):
+            row_end = min(small_height, row_start + rows_per_chunk)
+            # 只做横向展开 (高度不变)，纵向重复在写出时完成
+            expanded = small_img.crop((0, row_start, small_width, row_end)).resize(
+                (output_width, row_end - row_start), NEAREST).tobytes()
+            lines = []
+            while output_row < output_height:
+                source_row = source_rows[output_row]
+                if source_row >= row_end:
+                    break
+                if source_row == previous_row:
+                    lines.append(repeat_row)
+                else:
+                    offset = (source_row - row_start) * row_bytes
+                    lines.append(b'\x00' + expanded[offset:offset + row_bytes])
+                    previous_row = source_row
+                output_row += 1
+            flush_compressed(compressor.compress(b''.join(lines)))
+        flush_compressed(compressor.flush())
+        if pending:
+            f.write(_png_chunk(b'IDAT', b''.join(pending)))
+        f.write(_png_chunk(b'IEND', b''))
+
+def build_output_path(base_path_no_ext, ext, pixel_size, multiple_sizes=False, output_mode='full',
+                      palette=None, tiled=False):
+    """
+    生成输出文件路径。单一尺寸的 full/integer 模式保持原来的 <名称>_pixelated<扩展名>；
+    多个尺寸或 small 模式在文件名中加入 _<N>px 以区分尺寸并记录缩放倍数；
+    使用调色板时加入调色板标识，并把有损格式改为 PNG 以保存索引色；
+    tiled 模式的全尺寸输出只能流式写出 PNG。
+    """
+    if tiled and output_mode != 'small':
+        ext = '.png'
+    suffix = "_pixelated"
+    if multiple_sizes or output_mode == 'small':
+        suffix += f"_{pixel_size}px"
+    if palette is not None:
+        suffix += f"_{palette_tag(palette)}"
+        if ext.lower() in LOSSY_EXTENSIONS:
+            ext = '.png'
+    if output_mode == 'small':
+        suffix += "_small"
+    if ext.lower() not in SUPPORTED_EXTENSIONS:
+        ext = '.png'
+    return f"{base_path_no_ext}{suffix}{ext}"
+
+def upscale_small_image(small_img, pixel_size, output_mode, original_size):
+    """按输出模式放大缩小后的图像 (最近邻)；small 模式原样返回。"""
+    if output_mode == 'full':
+        return small_img.resize(original_size, NEAREST)
+    if output_mode == 'integer':
+        return small_img.resize((small_img.size[0] * pixel_size, small_img.size[1] * pixel_size), NEAREST)
+    return small_img
+
+def small_png_info(pixel_size, original_width, original_height):
+    """small 模式的 PNG 文本块: 记录缩放倍数和原始尺寸，便于显示端按最近邻放大。"""
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text("pixel_scale", str(pixel_size))
+    pnginfo.add_text("original_size", f"{original_width}x{original_height}")
+    return pnginfo
+
+def pixelate_image_multi(input_path, output_paths, output_mode='full', palette=None, sampling='nearest',
+                         tiled=False):
+    """
+    只解码一次输入图片，为每个请求的像素块大小生成像素风格图片，并记录各步骤耗时。
+
     Args:
         input_path (str): 输入图片的文件路径。
-        output_path (str): 保存像素化图片的路径。
-        pixel_size (int): 定义每个“大像素”块的边长。
+        output_paths (dict): {像素块大小 (int): 输出路径 (str)}。
+        output_mode (str): 'full'、'integer' 或 'small'，见 OUTPUT_MODES。
+        palette (tuple or None): parse_palette 的返回值；不为 None 时在缩小后的图像上量化。
+        sampling (str): 'nearest' 或 'average'，见 SAMPLING_MODES。
+        tiled (bool): True 时按条带读取源图并流式写出 PNG，峰值内存与原图尺寸无关 (适用于超大图片)。
 
     Returns:
-        bool: True 如果成功, False 如果失败。
+        dict: {像素块大小: True 如果成功, False 如果失败}。
     """
-    # --- Timing variables for steps inside the function ---
-    t_open_start, t_open_end = 0, 0
-    t_resize_down_start, t_resize_down_end = 0, 0
-    t_resize_up_start, t_resize_up_end = 0, 0
-    t_save_start, t_save_end = 0, 0
-    func_total_start = 0 # Initialize here
+    results = {pixel_size: False for pixel_size in output_paths}
+    short_name = os.path.basename(input_path)
 
     # --- 基本检查放在前面 ---
     if not os.path.exists(input_path):
-        print(f"错误：找不到输入文件 '{input_path}'")
-        return False
+        logger.error(f"找不到输入文件 '{input_path}'")
+        return results
     if not os.path.isfile(input_path): # 确保是文件
-         print(f"错误：输入路径 '{input_path}' 不是一个有效的文件。")
-         return False
-    if not isinstance(pixel_size, int) or pixel_size <= 0:
-        print(f"错误：像素大小 ({pixel_size}) 必须是一个正整数。")
-        return False
+         logger.error(f"输入路径 '{input_path}' 不是一个有效的文件。")
+         return results
+    if output_mode not in OUTPUT_MODES:
+        logger.error(f"未知的输出模式 '{output_mode}' (可选: {', '.join(OUTPUT_MODES)})。")
+        return results
+    if sampling not in SAMPLING_MODES:
+        logger.error(f"未知的采样方式 '{sampling}' (可选: {', '.join(SAMPLING_MODES)})。")
+        return results
+    invalid_sizes = [size for size in output_paths if not isinstance(size, int) or size <= 0]
+    if invalid_sizes:
+        logger.error(f"像素大小 ({invalid_sizes}) 必须是正整数。")
+        return results
 
-    print(f"\n--- 开始处理: {os.path.basename(input_path)} ---")
+    logger.debug(f"--- 开始处理: {short_name} ---")
     func_total_start = time.perf_counter() # Start timer for the whole function's work
 
     try:
-        # === Step 1: 打开并准备图片 ===
+        # === Step 1: 打开并准备图片 (所有尺寸共用一次解码) ===
         t_open_start = time.perf_counter()
-        img = Image.open(input_path)
-        img = img.convert("RGB") # 转换为RGB以处理透明度等问题，并确保一致性
-        original_width, original_height = img.size
+        source = None
+        if tiled:
+            min_size = min(output_paths)
+            with _open_large_image(input_path) as probe:
+                draft_size = (max(1, probe.size[0] // min_size), max(1, probe.size[1] // min_size))
+            source = _StripSource(input_path, draft_size if sampling == 'average' else None)
+            original_width, original_height = source.original_size
+            if not source.is_lazy:
+                logger.debug(f"'{short_name}' ({source.format}) 不支持按行读取，分块模式下将整张解码源图 "
+                             f"(输出仍流式写出)。")
+        else:
+            with Image.open(input_path) as opened:
+                img = opened.convert("RGB") # 转换为RGB以处理透明度等问题，并确保一致性
+            original_width, original_height = img.size
         t_open_end = time.perf_counter()
-        print(f"  原始图片尺寸: {original_width}x{original_height}")
-
-        # === Step 2: 缩小图片 ===
-        # 确保缩小后的尺寸至少为 1x1 像素
-        small_width = max(1, original_width // pixel_size)
-        small_height = max(1, original_height // pixel_size)
-        print(f"  缩小后尺寸: {small_width}x{small_height}")
+        logger.debug(f"原始图片尺寸: {original_width}x{original_height}")
+    except Exception as e:
+        logger.error(f"打开图片 '{short_name}' 时发生错误: {e}")
+        logger.debug("详细的错误堆栈信息:", exc_info=True)
+        return results
 
-        t_resize_down_start = time.perf_counter()
-        # 优先使用 Resampling.NEAREST (Pillow >= 9.0.0)
+    for pixel_size, output_path in sorted(output_paths.items()):
         try:
-            small_img = img.resize((small_width, small_height), Image.Resampling.NEAREST)
-        except AttributeError:
-            # 兼容旧版 Pillow
-            print("  警告：检测到旧版 Pillow (< 9.0.0)，使用 Image.NEAREST。建议更新 Pillow。")
-            small_img = img.resize((small_width, small_height), Image.NEAREST)
-        t_resize_down_end = time.perf_counter()
-
-        # === Step 3: 放大图片 ===
-        print(f"  放大回原始尺寸: {original_width}x{original_height}")
-        t_resize_up_start = time.perf_counter()
-        try:
-            pixelated_img = small_img.resize((original_width, original_height), Image.Resampling.NEAREST)
-        except AttributeError:
-            pixelated_img = small_img.resize((original_width, original_height), Image.NEAREST)
-        t_resize_up_end = time.perf_counter()
-
-        # === Step 4: 保存结果 ===
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_path)
-        if output_dir and not os.path.exists(output_dir):
-             try:
-                 os.makedirs(output_dir)
-                 print(f"  已创建输出目录: {output_dir}")
-             except OSError as e:
-                 print(f"  错误：无法创建输出目录 '{output_dir}': {e}")
-                 return False # 无法创建目录则无法保存
-
-        t_save_start = time.perf_counter()
-        # 保存时也指定格式，避免依赖扩展名（尤其对于非标准扩展名）
-        save_format = os.path.splitext(output_path)[1].lower().strip('.')
-        if save_format == 'jpg': save_format = 'jpeg' # Pillow 使用 'jpeg'
-        if not save_format or f".{save_format}" not in SUPPORTED_EXTENSIONS:
-            print(f"  警告：输出扩展名 '{save_format}' 未知或不支持，将尝试以 PNG 格式保存。")
-            output_path = os.path.splitext(output_path)[0] + '.png'
-            save_format = 'png'
-
-        pixelated_img.save(output_path, format=save_format.upper()) # 指定格式
-        t_save_end = time.perf_counter()
-        print(f"  像素化图片成功保存到: {output_path}")
-
-        # --- 打印内部步骤耗时 ---
-        print("  --- 详细耗时 ---")
-        print(f"     - 图片打开与转换: {t_open_end - t_open_start:.4f} 秒")
-        print(f"     - 图片缩小:       {t_resize_down_end - t_resize_down_start:.4f} 秒")
-        print(f"     - 图片放大:       {t_resize_up_end - t_resize_up_start:.4f} 秒")
-        print(f"     - 图片保存:       {t_save_end - t_save_start:.4f} 秒")
-        print("  ------------------")
-
-        return True
-
-    except FileNotFoundError:
-        # 这个错误理论上在函数开始时已被捕获，但保留以防万一
-        print(f"错误：找不到输入文件 '{input_path}'")
+            # === Step 2: 缩小图片 ===
+            # 确保缩小后的尺寸至少为 1x1 像素
+            small_width = max(1, original_width // pixel_size)
+            small_height = max(1, original_height // pixel_size)
+
+            t_resize_down_start = time.perf_counter()
+            if tiled:
+                small_img = downsample_tiled(source, pixel_size, small_width, small_height, sampling, output_mode)
+            else:
+                small_img = downsample_image(img, pixel_size, small_width, small_height, sampling, output_mode)
+            t_resize_down_end = time.perf_counter()
+
+            # === Step 2b: 调色板量化 (可选，在小图上进行) ===
+            t_quantize_start = time.perf_counter()
+            if palette is not None:
+                small_img = quantize_small_image(small_img, palette)
+            t_quantize_end = time.perf_counter()
+
+            # === Step 3: 按输出模式放大 (small 模式不放大) ===
+            t_resize_up_start = time.perf_counter()
+            if tiled and output_mode != 'small':
+                pixelated_img = None # 放大与保存合并为流式写出 (Step 4)
+            else:
+                pixelated_img = upscale_small_image(small_img, pixel_size, output_mode, (original_width, original_height))
+            t_resize_up_end = time.perf_counter()
+
+            # === Step 4: 保存结果 ===
+            # 确保输出目录存在
+            output_dir = os.path.dirname(output_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+                logger.debug(f"已创建输出目录: {output_dir}")
+
+            t_save_start = time.perf_counter()
+            # 保存时也指定格式，避免依赖扩展名（尤其对于非标准扩展名）
+            output_path, save_format = _resolve_save_format(output_path)
+            if pixelated_img is None:
+                if save_format != 'PNG':
+                    output_path = os.path.splitext(output_path)[0] + '.png'
+                if output_mode == 'full':
+                    output_size = (original_width, original_height)
+                else:
+                    output_size = (small_width * pixel_size, small_height * pixel_size)
+                write_upscaled_png_streaming(small_img, output_path, *output_size)
+                t_save_end = time.perf_counter()
+                results[pixel_size] = True
+                logger.debug(f"'{short_name}' [{pixel_size}px, {output_mode}, {sampling}, 分块] "
+                             f"{small_width}x{small_height} -> {output_size[0]}x{output_size[1]}, 耗时: "
+                             f"条带缩小 {t_resize_down_end - t_resize_down_start:.4f}s, "
+                             f"量化 {t_quantize_end - t_quantize_start:.4f}s, "
+                             f"流式放大并保存 {t_save_end - t_save_start:.4f}s -> {output_path}")
+                continue
+            save_kwargs = {}
+            if output_mode == 'small' and save_format == 'PNG':
+                save_kwargs['pnginfo'] = small_png_info(pixel_size, original_width, original_height)
+            if pixelated_img.mode == 'P' and save_format == 'JPEG':
+                pixelated_img = pixelated_img.convert('RGB') # JPEG 不支持索引色
+            pixelated_img.save(output_path, format=save_format, **save_kwargs) # 指定格式
+            t_save_end = time.perf_counter()
+            results[pixel_size] = True
+
+            # --- 记录内部步骤耗时 (调试级别，一行) ---
+            logger.debug(f"'{short_name}' [{pixel_size}px, {output_mode}, {sampling}] "
+                         f"{small_width}x{small_height} -> {pixelated_img.size[0]}x{pixelated_img.size[1]}, 耗时: "
+                         f"缩小 {t_resize_down_end - t_resize_down_start:.4f}s, "
+                         f"量化 {t_quantize_end - t_quantize_start:.4f}s, "
+                         f"放大 {t_resize_up_end - t_resize_up_start:.4f}s, "
+                         f"保存 {t_save_end - t_save_start:.4f}s -> {output_path}")
+        except Exception as e:
+            logger.error(f"处理图片 '{short_name}' (像素块 {pixel_size}) 时发生错误: {e}")
+            logger.debug("详细的错误堆栈信息:", exc_info=True)
+
+    if source is not None:
+        source.close()
+
+    func_total_end = time.perf_counter()
+    logger.debug(f"--- 处理结束: {short_name} | 解码 {t_open_end - t_open_start:.4f} 秒 | "
+                 f"函数总耗时: {func_total_end - func_total_start:.4f} 秒 ---")
+    return results
+
+def pixelate_image(input_path, output_path, pixel_size, output_mode='full', palette=None, sampling='nearest',
+                   tiled=False):
+    """
+    将输入图片转换为单一像素块大小的像素风格图片。
+
+    Args:
+        input_path (str): 输入图片的文件路径。
+        output_path (str): 保存像素化图片的路径。
+        pixel_size (int): 定义每个“大像素”块的边长。
+        output_mode (str): 'full'、'integer' 或 'small'，见 OUTPUT_MODES。
+        palette (tuple or None): parse_palette 的返回值，None 表示不量化。
+        sampling (str): 'nearest' 或 'average'。
+        tiled (bool): 按条带读取并流式写出 (超大图片)。
+
+    Returns:
+        bool: True 如果成功, False 如果失败。
+    """
+    if not isinstance(pixel_size, int) or pixel_size <= 0:
+        logger.error(f"像素大小 ({pixel_size}) 必须是一个正整数。")
         return False
+    return pixelate_image_multi(input_path, {pixel_size: output_path}, output_mode, palette, sampling,
+                                tiled)[pixel_size]
+
+def pixelate_image_bytes(image_bytes, pixel_size, output_mode='full', palette=None, sampling='nearest'):
+    """
+    管道模式 (--pipe): 把内存中的图片字节像素化，返回 PNG 字节 (不创建任何文件)。
+
+    Returns:
+        bytes or None: PNG 字节；无法解码或处理失败时记录错误并返回 None。
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as opened:
+            img = opened.convert("RGB")
+        original_width, original_height = img.size
+        small_width = max(1, original_width // pixel_size)
+        small_height = max(1, original_height // pixel_size)
+        small_img = downsample_image(img, pixel_size, small_width, small_height, sampling, output_mode)
+        if palette is not None:
+            small_img = quantize_small_image(small_img, palette)
+        pixelated_img = upscale_small_image(small_img, pixel_size, output_mode, (original_width, original_height))
+        save_kwargs = {}
+        if output_mode == 'small':
+            save_kwargs['pnginfo'] = small_png_info(pixel_size, original_width, original_height)
+        buffer = io.BytesIO()
+        pixelated_img.save(buffer, format='PNG', **save_kwargs)
     except Exception as e:
-        print(f"处理图片 '{os.path.basename(input_path)}' 时发生错误: {e}")
-        traceback.print_exc() # 打印详细的错误堆栈信息
-        return False
-    finally:
-        # Ensure total function time is recorded even on error (if func_total_start was set)
-        if func_total_start > 0:
-            func_total_end = time.perf_counter()
-            print(f"--- 处理结束: {os.path.basename(input_path)} | 函数总耗时: {func_total_end - func_total_start:.4f} 秒 ---")
+        logger.error(f"像素化管道输入时发生错误: {e}")
+        logger.debug("详细的错误堆栈信息:", exc_info=True)
+        return None
+    logger.debug(f"管道输入 {original_width}x{original_height} [{pixel_size}px, {output_mode}, {sampling}] "
+                 f"-> {pixelated_img.size[0]}x{pixelated_img.size[1]}")
+    return buffer.getvalue()
+
+def pixelate_to_outputs(input_path, base_path_no_ext, ext, pixel_sizes, output_mode='full', palette=None,
+                        sampling='nearest', tiled=False):
+    """
+    为一个输入文件生成所有请求尺寸的输出 (进程池任务函数)。
+
+    Returns:
+        tuple: (是否全部成功 (bool), 第一个输出路径 (str))。
+    """
+    multiple_sizes = len(pixel_sizes) > 1
+    output_paths = {
+        pixel_size: build_output_path(base_path_no_ext, ext, pixel_size, multiple_sizes, output_mode, palette,
+                                      tiled)
+        for pixel_size in pixel_sizes
+    }
+    size_results = pixelate_image_multi(input_path, output_paths, output_mode, palette, sampling, tiled)
+    return all(size_results.values()), output_paths[pixel_sizes[0]]
 
 # --- 新函数：获取用户输入 ---
 def get_user_inputs():
     """
-    获取用户输入的源路径和像素大小。
+    获取用户输入的源路径和像素大小 (可输入多个，用逗号分隔)。
 
     Returns:
-        tuple: 包含 input_path (str) 和 pixel_block_size (int) 的元组。
+        tuple: 包含 input_path (str) 和 pixel_block_sizes (list[int]) 的元组。
                如果用户取消操作，则返回 (None, None)。
     """
     input_path = ""
@@ -141,49 +693,71 @@ def get_user_inputs():
              print("\n操作已取消。")
              return None, None # 返回 None 表示取消
 
-    pixel_block_size = 0
+    pixel_block_sizes = []
     while True:
         try:
-            pixel_block_size_str = input("请输入所需的像素块大小 (整数, e.g., 8, 16): ")
-            pixel_block_size = int(pixel_block_size_str)
-            if pixel_block_size > 0:
-                break
-            else:
-                print("像素块大小必须是正整数。")
-        except ValueError:
-            print("无效输入，请输入一个整数。")
+            pixel_block_size_str = input("请输入所需的像素块大小 (整数，多个用逗号分隔, e.g., 8 或 4,8,16,32): ")
+            pixel_block_sizes = parse_pixel_sizes(pixel_block_size_str)
+            break
+        except ValueError as e:
+            print(f"无效输入: {e}")
         except KeyboardInterrupt:
             print("\n操作已取消。")
             return None, None # 返回 None 表示取消
 
-    return input_path, pixel_block_size
+    return input_path, pixel_block_sizes
+
+def parse_pixel_sizes(text):
+    """
+    解析逗号分隔的像素块大小列表 (去重并保持输入顺序)。
+
+    Raises:
+        ValueError: 列表为空，或包含非正整数。
+    """
+    sizes = []
+    for part in str(text).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        size = int(part) # 非整数时抛出 ValueError
+        if size <= 0:
+            raise ValueError("像素块大小必须是正整数。")
+        if size not in sizes:
+            sizes.append(size)
+    if not sizes:
+        raise ValueError("请至少输入一个像素块大小。")
+    return sizes
 
 # --- 新函数：处理单个文件 ---
-def process_single_file(input_path, pixel_size):
+def process_single_file(input_path, pixel_sizes, output_mode='full', palette=None, sampling='nearest',
+                        tiled=False):
     """
-    处理单个图片文件。
+    处理单个图片文件 (一次解码，生成所有请求的像素块大小)。
 
     Args:
         input_path (str): 输入图片文件路径。
-        pixel_size (int): 像素块大小。
+        pixel_sizes (list[int]): 像素块大小列表。
+        output_mode (str): 'full'、'integer' 或 'small'。
+        palette (tuple or None): 调色板选项 (parse_palette 的返回值)。
+        sampling (str): 缩小采样方式 'nearest' 或 'average'。
+        tiled (bool): 分块流式处理 (超大图片)。
 
     Returns:
         dict: 包含处理结果的字典:
               {'processed': int, 'success': int, 'failed': int, 'output_location': str or None}
     """
-    print(f"\n检测到输入为单个文件: {input_path}")
-    print("开始处理...")
+    logger.info(f"检测到输入为单个文件: {input_path}")
     stats = {'processed': 0, 'success': 0, 'failed': 0, 'output_location': None}
 
     # 生成默认输出路径
     base, ext = os.path.splitext(input_path)
-    output_image_path = f"{base}_pixelated{ext}"
-    # 如果原扩展名不受支持，提示并改为 .png
+    # 如果原扩展名不受支持，提示并改为 .png (build_output_path 负责替换)
     if ext.lower() not in SUPPORTED_EXTENSIONS:
-        print(f"警告：文件扩展名 '{ext}' 可能不受支持，将尝试处理并以 .png 格式保存。")
-        output_image_path = f"{base}_pixelated.png"
+        logger.warning(f"文件扩展名 '{ext}' 可能不受支持，将尝试处理并以 .png 格式保存。")
 
-    if pixelate_image(input_path, output_image_path, pixel_size):
+    success, output_image_path = pixelate_to_outputs(input_path, base, ext, pixel_sizes, output_mode, palette,
+                                                     sampling, tiled)
+    if success:
         stats['success'] = 1
         stats['output_location'] = output_image_path
     else:
@@ -191,22 +765,43 @@ def process_single_file(input_path, pixel_size):
     stats['processed'] = 1
     return stats
 
+# --- 新函数：流式扫描文件夹 ---
+def iter_image_entries(input_path):
+    """
+    逐个产出文件夹中受支持的图片条目 (os.DirEntry)，不预先构建完整列表。
+    跳过的条目只在调试级别记录。
+    """
+    with os.scandir(input_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                logger.debug(f"跳过: '{entry.name}' (不是文件)")
+            elif os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                logger.debug(f"跳过: '{entry.name}' (非支持的图片格式)")
+            else:
+                yield entry
+
 # --- 新函数：处理文件夹 ---
-def process_directory(input_path, pixel_size):
+def process_directory(input_path, pixel_sizes, max_workers=None, output_mode='full', palette=None,
+                      sampling='nearest', tiled=False):
     """
-    处理文件夹中的所有支持的图片文件。
+    使用进程池并行处理文件夹中的所有支持的图片文件。
+    扫描是流式的：边扫描边提交，排队中的任务数不超过 工作进程数 * MAX_PENDING_TASKS_PER_WORKER。
 
     Args:
         input_path (str): 输入文件夹路径。
-        pixel_size (int): 像素块大小。
+        pixel_sizes (list[int]): 像素块大小列表 (每个文件只解码一次)。
+        max_workers (int or None): 工作进程数，None 表示使用 CPU 核心数，1 表示在主进程中顺序处理。
+        output_mode (str): 'full'、'integer' 或 'small'。
+        palette (tuple or None): 调色板选项 (parse_palette 的返回值)。
+        sampling (str): 缩小采样方式 'nearest' 或 'average'。
+        tiled (bool): 分块流式处理 (超大图片)。
 
     Returns:
         dict: 包含处理结果的字典:
               {'processed': int, 'success': int, 'failed': int, 'output_location': str or None}
               'output_location' 是输出文件夹的路径。
     """
-    print(f"\n检测到输入为文件夹: {input_path}")
-    print("开始批量处理...")
+    logger.info(f"检测到输入为文件夹: {input_path}")
     stats = {'processed': 0, 'success': 0, 'failed': 0, 'output_location': None}
 
     # 创建输出文件夹
@@ -217,53 +812,80 @@ def process_directory(input_path, pixel_size):
 
     try:
         os.makedirs(output_dir, exist_ok=True)
-        print(f"结果将保存到文件夹: {output_dir}")
+        logger.info(f"结果将保存到文件夹: {output_dir}")
         stats['output_location'] = output_dir
     except OSError as e:
-        print(f"错误：无法创建输出目录 '{output_dir}': {e}")
-        print("处理中止。")
+        logger.error(f"无法创建输出目录 '{output_dir}': {e}")
+        logger.info("处理中止。")
         stats['failed'] = 1 # 标记为失败，因为无法创建目录
         return stats # 提前返回
 
-    # 遍历文件夹
-    print("开始扫描文件夹...")
-    image_files_found = 0
-    try:
-        items_in_dir = list(os.scandir(input_path)) # 获取列表以计算总数
-        total_items = len(items_in_dir)
-
-        for i, entry in enumerate(items_in_dir):
-            current_file_number = i + 1
-            print(f"\n[{current_file_number}/{total_items}] 检查: {entry.name}")
-            if entry.is_file():
-                file_ext = os.path.splitext(entry.name)[1].lower()
-                if file_ext in SUPPORTED_EXTENSIONS:
-                    image_files_found += 1
+    worker_count = max_workers or os.cpu_count() or 1
+    logger.info(f"开始批量处理 (工作进程数: {worker_count})...")
+
+    def record_result(progress, entry_name, success):
+        if success:
+            stats['success'] += 1
+            progress.update(done=1)
+        else:
+            stats['failed'] += 1
+            progress.update(done=1, failed=1)
+            logger.debug(f"处理失败: '{entry_name}'")
+
+    # 单行实时进度 (总数随扫描增长)；每个文件的详细信息只在调试级别输出
+    with log_utils.ProgressLine(total=0, label="像素化") as progress:
+        try:
+            if worker_count == 1:
+                # 单进程：不启动进程池，直接在主进程中处理
+                for entry in iter_image_entries(input_path):
                     stats['processed'] += 1
-                    current_input_path = entry.path
+                    progress.add_total(1)
                     base, ext = os.path.splitext(entry.name)
-                    current_output_path = os.path.join(output_dir, f"{base}_pixelated{ext}")
-
-                    # 处理单个图片
-                    if pixelate_image(current_input_path, current_output_path, pixel_size):
-                        stats['success'] += 1
-                    else:
-                        stats['failed'] += 1
-                else:
-                    print(f"  跳过: '{entry.name}' (非支持的图片格式)")
+                    success, _ = pixelate_to_outputs(entry.path, os.path.join(output_dir, base), ext,
+                                                     pixel_sizes, output_mode, palette, sampling, tiled)
+                    record_result(progress, entry.name, success)
             else:
-                 print(f"  跳过: '{entry.name}' (不是文件)")
+                max_pending = worker_count * MAX_PENDING_TASKS_PER_WORKER
+                pending = {}
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=worker_count,
+                        initializer=log_utils.init_worker_logging,
+                        initargs=(logging.getLogger().getEffectiveLevel(),)) as executor:
 
-        if image_files_found == 0:
-             print("\n在指定文件夹中未找到支持的图片文件。")
+                    def collect(return_when):
+                        done, _ = concurrent.futures.wait(pending, return_when=return_when)
+                        for future in done:
+                            entry_name = pending.pop(future)
+                            try:
+                                success, _ = future.result()
+                            except Exception as exc:
+                                logger.error(f"处理图片 '{entry_name}' 时工作进程异常: {exc}")
+                                success = False
+                            record_result(progress, entry_name, success)
 
-    except FileNotFoundError:
-         print(f"错误：扫描时找不到文件夹 '{input_path}'。")
-         stats['failed'] = 1 # 标记为失败
-    except Exception as e:
-         print(f"扫描或处理文件夹 '{input_path}' 时发生意外错误: {e}")
-         traceback.print_exc()
-         stats['failed'] = max(1, stats['failed']) # 确保至少标记为1个失败
+                    for entry in iter_image_entries(input_path):
+                        # 排队任务已满时，先等待至少一个任务完成再继续扫描
+                        if len(pending) >= max_pending:
+                            collect(concurrent.futures.FIRST_COMPLETED)
+                        stats['processed'] += 1
+                        progress.add_total(1)
+                        base, ext = os.path.splitext(entry.name)
+                        future = executor.submit(pixelate_to_outputs, entry.path, os.path.join(output_dir, base), ext,
+                                                 pixel_sizes, output_mode, palette, sampling, tiled)
+                        pending[future] = entry.name
+
+                    if pending:
+                        collect(concurrent.futures.ALL_COMPLETED)
+
+            if stats['processed'] == 0:
+                 logger.info("在指定文件夹中未找到支持的图片文件。")
+
+        except FileNotFoundError:
+             logger.error(f"扫描时找不到文件夹 '{input_path}'。")
+             stats['failed'] = 1 # 标记为失败
+        except Exception as e:
+             logger.exception(f"扫描或处理文件夹 '{input_path}' 时发生意外错误: {e}")
+             stats['failed'] = max(1, stats['failed']) # 确保至少标记为1个失败
 
     return stats
 
@@ -308,17 +930,81 @@ def print_summary(results, duration):
     print(f"\n总处理耗时 (包含文件扫描): {duration:.4f} 秒")
     print("===================================")
 
+# --- 命令行参数 ---
+def parse_args(argv=None):
+    """解析命令行参数。输入路径或像素块大小缺失时，main 会交互式询问。"""
+    parser = argparse.ArgumentParser(description="图片像素化工具")
+    parser.add_argument("input_path", nargs="?", default=None,
+                        help="源图片文件或包含图片的文件夹 (省略时交互式输入)")
+    parser.add_argument("-s", "--pixel-size", dest="pixel_sizes", type=parse_pixel_sizes, default=None,
+                        help="像素块大小，多个用逗号分隔 (e.g., 8 或 4,8,16,32)；每个文件只解码一次")
+    parser.add_argument("-m", "--output-mode", choices=OUTPUT_MODES, default='full',
+                        help="输出模式: full=放大回原始尺寸 (默认), integer=精确整数倍放大, "
+                             "small=保存缩小图并在文件名/PNG 元数据中记录缩放倍数")
+    parser.add_argument("-a", "--sampling", choices=SAMPLING_MODES, default='nearest',
+                        help="缩小采样方式: nearest=每块取一个像素 (默认), average=每块取平均色 (照片更平滑)")
+    parser.add_argument("-t", "--tiled", action="store_true",
+                        help="分块流式处理超大图片: 按条带读取源图 (BMP/PPM/未压缩 TIFF 只解码需要的行)，"
+                             "全尺寸输出逐行写入 PNG，峰值内存与图片尺寸无关")
+    parser.add_argument("-p", "--palette", type=parse_palette, default=None,
+                        help="在缩小后的图像上做调色板量化: 颜色数 (如 16/32/64，中位切分) 或固定调色板 "
+                             f"({', '.join(FIXED_PALETTES)})；输出为索引色 PNG")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="处理文件夹时的工作进程数 (默认: CPU 核心数；1 表示不使用进程池)")
+    parser.add_argument("--pipe", action="store_true",
+                        help="管道模式: 从 stdin 读取一张图片，把 PNG 写到 stdout (不创建文件，不交互式询问，需要 -s)；"
+                             "多个像素块大小时使用第一个")
+    parser.add_argument("--framed", action="store_true",
+                        help="管道模式的输入和输出都是分帧的图片流 (每帧为 8 字节大端长度 + 数据，失败的图片输出空帧)；隐含 --pipe")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="输出每个文件的详细信息和耗时 (调试级别)")
+    parser.add_argument("-q", "--quiet", action="count", default=0,
+                        help="只输出警告和错误")
+    return parser.parse_args(argv)
+
 # --- 主程序入口 ---
-def main():
+def main(args=None):
     """主执行函数"""
-    print("--- 图片像素化工具 ---")
-    print(f"支持的图片格式: {', '.join(SUPPORTED_EXTENSIONS)}")
+    if args is None:
+        args = parse_args()
+    log_utils.setup_logging(args.verbose - args.quiet)
+    logger.info("--- 图片像素化工具 ---")
+    logger.info(f"支持的图片格式: {', '.join(SUPPORTED_EXTENSIONS)}")
+
+    # === 管道模式: stdin -> stdout，不交互式询问，stdout 只输出结果数据 ===
+    if args.pipe or args.framed:
+        if args.pixel_sizes is None:
+            logger.error("管道模式需要用 -s 指定像素块大小。")
+            sys.exit(2)
+        if args.input_path:
+            logger.warning(f"管道模式从 stdin 读取图片，忽略输入路径 '{args.input_path}'。")
+        if args.tiled:
+            logger.warning("管道模式在内存中处理，忽略 --tiled。")
+        if len(args.pixel_sizes) > 1:
+            logger.info(f"管道模式每张图片只输出一个结果，使用像素块大小 {args.pixel_sizes[0]}。")
+        start_time = time.perf_counter()
+        pipe_results = stream_frames.run_pipe(
+            lambda image_bytes: pixelate_image_bytes(image_bytes, args.pixel_sizes[0], args.output_mode,
+                                                     args.palette, args.sampling),
+            args.framed)
+        if pipe_results['images_total'] == 0 and not pipe_results['images_failed']:
+            logger.error("stdin 中没有图片数据。")
+        logger.info(f"管道模式完成: {pipe_results['images_total']} 张图片，失败 {pipe_results['images_failed']}，"
+                    f"耗时 {time.perf_counter() - start_time:.2f} 秒。")
+        sys.exit(0 if pipe_results['images_total'] and not pipe_results['images_failed'] else 1)
+
+    # === 获取输入 (命令行参数齐全时不再交互式询问) ===
+    if args.input_path and args.pixel_sizes is not None:
+        input_path, pixel_block_sizes = args.input_path, args.pixel_sizes
+    else:
+        input_path, pixel_block_sizes = get_user_inputs()
 
-    # === 获取输入 ===
-    input_path, pixel_block_size = get_user_inputs()
+    if args.workers is not None and args.workers <= 0:
+        logger.error("工作进程数必须是正整数。")
+        sys.exit(2)
 
     # 如果用户取消输入，则退出
-    if input_path is None or pixel_block_size is None:
+    if input_path is None or pixel_block_sizes is None:
         sys.exit(0) # 正常退出
 
     # <<< 开始总计时 >>>
@@ -327,13 +1013,16 @@ def main():
 
     # === 判断路径类型并处理 ===
     if os.path.isfile(input_path):
-        results = process_single_file(input_path, pixel_block_size)
+        results = process_single_file(input_path, pixel_block_sizes, args.output_mode, args.palette,
+                                      args.sampling, args.tiled)
         results['input_type'] = 'file'
     elif os.path.isdir(input_path):
-        results = process_directory(input_path, pixel_block_size)
+        results = process_directory(input_path, pixel_block_sizes, max_workers=args.workers,
+                                    output_mode=args.output_mode, palette=args.palette,
+                                    sampling=args.sampling, tiled=args.tiled)
         results['input_type'] = 'directory'
     else:
-        print(f"\n错误：输入的路径 '{input_path}' 不是一个有效的文件或文件夹。")
+        logger.error(f"输入的路径 '{input_path}' 不是一个有效的文件或文件夹。")
         results['failed'] = 1 # 标记为失败
         results['input_type'] = 'invalid'
 
@@ -345,4 +1034,6 @@ def main():
     print_summary(results, total_processing_duration)
 
 if __name__ == "__main__":
+    # 确保在 Windows / 冻结环境下多进程正常工作
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+工作进程性能分析辅助模块。
+
+在 ProcessPoolExecutor 中，对父进程运行 cProfile 只能看到它在 as_completed 中等待。
+此模块让每个工作任务在 cProfile 下运行，每个工作进程把累计统计写入自己的 .prof 文件，
+运行结束后由主进程合并为一份文本报告和一份火焰图可用的折叠栈 (collapsed stack) 文件。
+"""
+import os
+import io
+import cProfile
+import pstats
+import logging
+
+PROFILE_STATS_DIRNAME = "profile_stats" # 每个工作进程的 .prof 文件所在子目录
+PROFILE_REPORT_FILENAME = "profile_report.txt" # 合并后的文本报告
+PROFILE_COLLAPSED_FILENAME = "profile_collapsed.txt" # 折叠栈文件 (flamegraph.pl / speedscope 可读)
+
+logger = logging.getLogger(__name__)
+
+# 报告中单独列出的关注点 (正则，匹配 pstats 的函数描述)
+PROFILE_FOCUS_PATTERNS = ("image_to_ascii|create_ascii_png", "PIL")
+
+# --- 工作进程内的 profiler (每个进程、每个输出目录一个，跨任务累计) ---
+_worker_profilers = {}
+
+
+def run_profiled(stats_dir, func, *args, **kwargs):
+    """
+    在 cProfile 下执行 func(*args, **kwargs) 并返回其结果。
+    同一进程中的多次调用共享一个 profiler，每次任务结束后把累计统计
+    写入 stats_dir/worker_<pid>.prof (覆盖写入，因此文件始终是该进程的完整统计)。
+    """
+    profiler = _worker_profilers.get(stats_dir)
+    if profiler is None:
+        profiler = cProfile.Profile()
+        _worker_profilers[stats_dir] = profiler
+
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        stats_path = os.path.join(stats_dir, f"worker_{os.getpid()}.prof")
+        try:
+            os.makedirs(stats_dir, exist_ok=True)
+            profiler.dump_stats(stats_path)
+        except OSError as e:
+            logger.warning(f"无法写入性能分析文件 '{stats_path}': {e}")
+
+
+def _frame_label(func_key):
+    """把 pstats 的 (filename, lineno, funcname) 转换为折叠栈中的帧名称。"""
+    filename, lineno, funcname = func_key
+    if filename == '~': # 内置函数，如 <built-in method ...>
+        label = funcname
+    else:
+        label = f"{funcname} ({os.path.basename(filename)}:{lineno})"
+    return label.replace(';', ',') # ';' 是折叠栈的分隔符
+
+
+def write_collapsed_stacks(stats, output_path, max_depth=64, min_microseconds=1):
+    """
+    根据 pstats 统计生成折叠栈文件，每行格式为 "帧1;帧2;...;帧N 微秒数"。
+    cProfile 只记录调用者 -> 被调用者的边，因此完整的调用栈是按每条边的累计时间
+    占被调用函数总累计时间的比例重建的近似值。
+    返回写入的栈行数。
+    """
+    raw_stats = stats.stats
+    children = {}
+    for callee, (_, _, _, _, callers) in raw_stats.items():
+        for caller, caller_edge in callers.items():
+            edge_cumtime = caller_edge[3]
+            children.setdefault(caller, []).append((callee, edge_cumtime))
+
+    # 根节点: 没有已知调用者的函数 (排除 profiler 自身的 disable 调用)
+    roots = [func for func, (_, _, _, _, callers) in raw_stats.items()
+             if not any(caller in raw_stats for caller in callers)
+             and '_lsprof.Profiler' not in func[2]]
+
+    collapsed = {}
+
+    def walk(func, stack, fraction):
+        _, _, tottime, cumtime, _ = raw_stats[func]
+        stack = stack + [_frame_label(func)]
+        self_us = int(round(tottime * fraction * 1e6))
+        if self_us >= min_microseconds:
+            key = ";".join(stack)
+            collapsed[key] = collapsed.get(key, 0) + self_us
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_cumtime in children.get(func, []):
+            callee_cumtime = raw_stats[callee][3]
+            if callee_cumtime <= 0 or _frame_label(callee) in stack: # 跳过递归/环
+                continue
+            child_fraction = fraction * edge_cumtime / callee_cumtime
+            if callee_cumtime * child_fraction * 1e6 < min_microseconds:
+                continue
+            walk(callee, stack, child_fraction)
+
+    for root in roots:
+        walk(root, [], 1.0)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for stack_line, micros in sorted(collapsed.items()):
+            f.write(f"{stack_line} {micros}\n")
+    return len(collapsed)
+
+
+def merge_profile_stats(stats_dir, report_path, collapsed_path, limit=60):
+    """
+    合并 stats_dir 中所有工作进程的 .prof 文件，写出文本报告和折叠栈文件。
+    返回合并的文件数量；没有可用文件时返回 0。
+    """
+    try:
+        prof_files = sorted(
+            os.path.join(stats_dir, name) for name in os.listdir(stats_dir)
+            if name.endswith('.prof')
+        )
+    except FileNotFoundError:
+        return 0
+    if not prof_files:
+        return 0
+
+    stream = io.StringIO()
+    stats = pstats.Stats(prof_files[0], stream=stream)
+    for prof_file in prof_files[1:]:
+        stats.add(prof_file)
+
+    stream.write(f"合并的工作进程统计文件数: {len(prof_files)}\n")
+    stream.write(f"统计目录: {stats_dir}\n\n")
+    stream.write("===== 按累计耗时排序 =====\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    stream.write("===== 按自身耗时排序 =====\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+    for pattern in PROFILE_FOCUS_PATTERNS:
+        stream.write(f"===== 关注函数: {pattern} =====\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(pattern, limit)
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(stream.getvalue())
+
+    write_collapsed_stacks(stats, collapsed_path)
+    return len(prof_files)
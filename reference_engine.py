@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+ASCII.py --verify 的参考实现: 基线版本 ASCII.py 中 image_to_ascii 和 create_ascii_png 的冻结副本。
+
+逐像素采样、逐字符计算灰度，固定颜色主题按行绘制、彩色主题逐字符绘制，
+与优化前的 ASCII.py 输出相同。除了与 ASCII_single.py 相同的抖动偏移 (dither_offsets) 外不做修改，
+优化实现的改动都以它为准校验；错误信息仍用 print 输出 (校验时重定向)。
+"""
+import math
+
+from PIL import Image, ImageDraw
+
+ASCII_CHARS = "@%#*+=-:. " # 假设@最暗, ' ' 最亮
+RESIZE_OUTPUT = True # 设置为 True 以将输出 PNG 调整为原始宽高比
+
+
+def image_to_ascii(color_image, width_chars, active_theme_name, dither_offsets=None):
+    """
+    将 PIL 彩色图像转换为包含字符和对应原图点采样颜色的数据结构。
+    此版本模拟 C++ 逻辑：
+    1. 直接在原始彩色图像上采样。
+    2. 使用 (R+G+B)/3 计算灰度值。
+    3. 字符映射逻辑不考虑背景明暗。
+    dither_offsets 为 dithering.threshold_offsets 返回的偏移矩阵 (None 表示不抖动)，逐格加在 R+G+B 之和上。
+    """
+    try:
+        # 1. 确保输入是 RGB 并获取尺寸
+        image_rgb = color_image if color_image.mode == 'RGB' else color_image.convert('RGB')
+        original_width, original_height = image_rgb.size
+
+        if original_width <= 0 or original_height <= 0:
+            print("错误：原始图像尺寸无效。")
+            return None
+
+        # 2. 计算目标字符网格的高度 (保持宽高比)
+        aspect_ratio = original_height / float(original_width)
+        # C++ 版本使用 charAspectRatioCorrection = 2.0 (默认)，这里保持 Python 之前的 0.5
+        # 如果想严格模拟 C++ 的默认行为，需要调整这里
+        char_aspect_ratio_correction = 0.5 # 或者调整为 2.0? 取决于 C++ 配置
+        width_chars = max(1, int(width_chars))
+        new_height_chars = int(width_chars * aspect_ratio * char_aspect_ratio_correction)
+        new_height_chars = max(1, new_height_chars) # 确保至少有一行
+
+        # 3. 准备字符映射
+        num_chars = len(ASCII_CHARS)
+        if num_chars == 0:
+            print("错误：ASCII_CHARS 不能为空。")
+            return None
+
+        # 4. 计算采样比例因子
+        xScale = float(original_width) / width_chars
+        yScale = float(original_height) / new_height_chars
+
+        # 5. 准备像素访问器和结果列表
+        ascii_char_color_data = []
+        try:
+            original_pixels = image_rgb.load() # 优化像素访问
+        except Exception as load_err:
+             print(f"警告: 无法创建像素访问对象: {load_err}. 将使用 getpixel (可能较慢)。")
+             original_pixels = None # 标记，后面用 getpixel
+
+        # 6. 遍历目标字符网格
+        for y_char in range(new_height_chars):
+            row_data = []
+            for x_char in range(width_chars):
+                # a. 计算原始图像中的采样坐标 (中心点)
+                x_orig = int(math.floor((x_char + 0.5) * xScale))
+                y_orig = int(math.floor((y_char + 0.5) * yScale))
+
+                # b. 确保坐标在边界内
+                x_orig = max(0, min(x_orig, original_width - 1))
+                y_orig = max(0, min(y_orig, original_height - 1))
+
+                # c. 获取采样点的 RGB 颜色
+                sampled_color = (0, 0, 0) # Default to black on error
+                try:
+                    if original_pixels:
+                        sampled_color = original_pixels[x_orig, y_orig]
+                    else:
+                        sampled_color = image_rgb.getpixel((x_orig, y_orig))
+
+                    # 确保是有效的 RGB 元组
+                    if not isinstance(sampled_color, tuple) or len(sampled_color) < 3:
+                        # Fallback if pixel access didn't return expected tuple (e.g., for palette images)
+                        pixel_img = image_rgb.crop((x_orig, y_orig, x_orig + 1, y_orig + 1))
+                        sampled_color = pixel_img.convert("RGB").getpixel((0,0))
+                        if not isinstance(sampled_color, tuple) or len(sampled_color) < 3:
+                            print(f"警告：无法在 ({x_orig}, {y_orig}) 获取有效的 RGB 颜色。使用默认黑色。")
+                            sampled_color = (0, 0, 0)
+                except IndexError:
+                    print(f"警告：点采样索引 ({x_orig}, {y_orig}) 超出范围。使用默认黑色。")
+                    sampled_color = (0, 0, 0)
+                except Exception as pixel_err:
+                    print(f"警告：获取像素 ({x_orig}, {y_orig}) 时出错: {pixel_err}。使用默认黑色。")
+                    sampled_color = (0, 0, 0)
+
+                # d. 从采样颜色计算灰度值 (模拟 C++ 的简单平均法)
+                r, g, b = sampled_color[:3] # 取前三个元素以防有 alpha 通道
+                # gray = (int(r) + int(g) + int(b)) // 3 # 整数除法
+                # 使用浮点数除法和 floor 模拟 C++ 的 floor((gray/256.0f)...)
+                # 有序抖动: 按字符格位置加上阈值偏移 (单位为 R+G+B 之和)
+                dither_offset = 0
+                if dither_offsets is not None:
+                    dither_size = len(dither_offsets)
+                    dither_offset = dither_offsets[y_char % dither_size][x_char % dither_size]
+                gray = (int(r) + int(g) + int(b) + dither_offset) / 3.0
+
+                # e. 映射灰度值到字符索引 (模拟 C++ 逻辑)
+                # C++: floor((gray / 256.0f) * NUM_ASCII_CHARS)
+                # Python: math.floor((gray / 256.0) * num_chars)
+                ascii_index = math.floor((gray / 256.0) * num_chars)
+
+                # f. 确保索引在有效范围内
+                ascii_index = max(0, min(ascii_index, num_chars - 1))
+
+                # g. 选择字符
+                char = ASCII_CHARS[ascii_index]
+
+                # h. 存储字符和原始颜色
+                row_data.append((char, sampled_color[:3]))
+            # i. 添加行数据到结果列表
+            ascii_char_color_data.append(row_data)
+
+        # 7. 返回结果
+        return ascii_char_color_data
+
+    except Exception as e:
+        # 保留原始的异常处理
+        print(f"在主题 '{active_theme_name}' 的 ASCII 转换和颜色采样过程中出错: {e}")
+        # traceback.print_exc() # 在子进程中打印完整的traceback可能比较混乱，可以选择性注释掉
+        return None
+
+
+def create_ascii_png(ascii_char_color_data, # 新参数：包含字符和颜色的数据
+                     theme_name,
+                     output_path,
+                     font, # 接收已加载字体
+                     background_color,
+                     foreground_color, # 仍然需要用于非 'original' 主题
+                     original_image_size=None):
+    """
+    根据包含字符和采样颜色的数据创建 PNG 图像。
+    优化：对于非彩色主题，按行绘制文本以提高性能。
+    """
+    if not ascii_char_color_data or not ascii_char_color_data[0]:
+        print("错误：没有 ASCII 数据或空行来创建 PNG。")
+        return False
+
+    if not isinstance(ascii_char_color_data[0][0], tuple) or len(ascii_char_color_data[0][0]) != 2:
+        print("错误：传入 create_ascii_png 的数据结构不正确。应为 list[list[tuple[char, color]]]")
+        return False
+
+    is_original_color_theme = theme_name in ["original_dark_bg", "original_light_bg"]
+    font_size_val = 10 # 后备字体大小
+
+    try:
+        if hasattr(font, 'size'):
+            font_size_val = font.size
+
+        dummy_img = Image.new('RGB', (1, 1))
+        draw = ImageDraw.Draw(dummy_img)
+        sample_text_height = '|M_g(`' # 尝试包含一些升部和降部字符
+        # 确保 sample_line_text 不为空 (代码不变)
+        if not ascii_char_color_data[0]: return False # 如果第一行为空则无法继续
+        sample_line_text = "".join([item[0] for item in ascii_char_color_data[0]])
+        if not sample_line_text: # 如果第一行全是空字符或无法获取字符
+             # 尝试用 'M' 来估算宽度
+             print("警告：无法从第一行获取样本文本，将使用'M'估算宽度。")
+             sample_line_text = 'M' * len(ascii_char_color_data[0])
+             if not sample_line_text: sample_line_text = "M" # 最终后备
+
+        # 使用 getbbox 获取更准确的尺寸 (代码不变)
+        try:
+            # left, top, right, bottom
+            bbox_h = draw.textbbox((0, 0), sample_text_height, font=font, anchor="lt") # 左上角对齐
+            line_height = bbox_h[3] - bbox_h[1] if bbox_h else font_size_val # 从 bbox 获取高度
+
+            bbox_w = draw.textbbox((0, 0), sample_line_text, font=font, anchor="lt")
+            text_width = bbox_w[2] - bbox_w[0] if bbox_w else font_size_val * len(sample_line_text) # 从 bbox 获取宽度
+
+        except AttributeError: # Pillow < 9.2.0? or other issues
+            print("警告：textbbox 不可用或出错。正在使用较旧的 Pillow 文本测量方法（textsize）。尺寸可能不太准确。")
+            try:
+                size_h = draw.textsize(sample_text_height, font=font)
+                line_height = size_h[1]
+                size_w = draw.textsize(sample_line_text, font=font)
+                text_width = size_w[0]
+            except AttributeError: # Pillow < 8.0.0?
+                print("警告：textsize 不可用。正在使用更旧的 font.getsize。尺寸可能非常不准确。")
+                try:
+                    (_, h) = font.getsize('M') # 用 'M' 的高度近似
+                    line_height = int(h * 1.2) # 增加一点行间距
+                    w = sum(font.getsize(c)[0] for c in sample_line_text)
+                    text_width = w
+                except Exception as e_getsize:
+                    print(f"错误: 无法使用任何方法测量文本尺寸: {e_getsize}. 使用默认值。")
+                    line_height = font_size_val + 4
+                    text_width = font_size_val * len(sample_line_text)
+
+        # 确保尺寸有效 (代码不变)
+        line_spacing = line_height + 2 # 增加2像素行间距
+        if line_spacing <= 0: line_spacing = font_size_val + 2
+        if text_width <= 0: text_width = font_size_val * len(sample_line_text) if sample_line_text else font_size_val
+
+        num_rows = len(ascii_char_color_data)
+        num_cols = len(ascii_char_color_data[0]) if num_rows > 0 else 0
+        # 平均字符宽度可能不准，特别是对于比例字体。但对于等宽字体尚可。 (代码不变)
+        avg_char_width = text_width / num_cols if num_cols > 0 else font_size_val
+
+        img_width = max(1, int(math.ceil(text_width))) # 使用 ceil 确保宽度足够
+        img_height = max(1, int(math.ceil(line_spacing * num_rows))) # 使用 ceil
+
+        output_image = Image.new('RGB', (img_width, img_height), color=background_color)
+        draw = ImageDraw.Draw(output_image)
+        y_text = 0 # 从顶部开始绘制
+
+        # --- 修改后的绘制文本逻辑 ---
+        if not is_original_color_theme:
+            # --- 优化：按行绘制 (用于固定前景色的主题) ---
+            final_color = None
+            if foreground_color is None:
+                # 理论上 load_config 应该确保非 original 主题有 foreground_color
+                # 但作为后备，设置一个默认值
+                print(f"警告：非原始主题 '{theme_name}' 缺少前景色。使用白色。")
+                final_color = "white"
+            else:
+                final_color = foreground_color
+
+            for y, row_data in enumerate(ascii_char_color_data):
+                # 构建当前行的完整字符串
+                line_text = "".join([item[0] for item in row_data])
+                if line_text: # 仅在行不为空时绘制
+                    try:
+                        # 对每一行调用一次 draw.text，从左上角 (0, y_text) 开始绘制
+                        draw.text((0, y_text), line_text, font=font, fill=final_color, anchor="lt")
+                    except Exception as line_err:
+                         print(f"警告：在 y={y_text} 绘制行 '{line_text[:20]}...' 时出错: {line_err}")
+                # 更新 y 位置，移动到下一行
+                y_text += line_spacing
+        else:
+            # --- 保持原始逻辑：逐字符绘制 (用于 original_dark_bg / original_light_bg) ---
+            for y, row_data in enumerate(ascii_char_color_data):
+                x_pos = 0 # 每行开始时重置 x 位置
+                for x, (char, sampled_color) in enumerate(row_data):
+                    final_color = sampled_color # 默认使用采样颜色
+
+                    # 轻微调暗亮背景上的彩色字符 (逻辑不变)
+                    if theme_name == "original_light_bg":
+                        darken_factor = 0.8 # 稍微调暗一点
+                        try:
+                            r, g, b = sampled_color
+                            new_r = max(0, min(255, int(r * darken_factor)))
+                            new_g = max(0, min(255, int(g * darken_factor)))
+                            new_b = max(0, min(255, int(b * darken_factor)))
+                            final_color = (new_r, new_g, new_b)
+                        except (TypeError, ValueError):
+                            final_color = sampled_color # 如果颜色无效则保持原样
+
+                    # 使用 draw.text 绘制单个字符 (逻辑不变)
+                    try:
+                        # anchor='lt' 表示文本的左上角位于 (x_pos, y_text)
+                        draw.text((math.floor(x_pos), y_text), char, font=font, fill=final_color, anchor="lt")
+                    except Exception as char_err:
+                        print(f"警告：在文本位置 ({x_pos:.0f},{y_text}) 绘制字符 '{char}' 时出错: {char_err}")
+
+                    # 更新 x 位置，使用平均宽度（对于等宽字体较准）(逻辑不变)
+                    x_pos += avg_char_width
+                # 更新 y 位置，移动到下一行 (逻辑不变)
+                y_text += line_spacing
+
+        # 调整大小 (可选) (代码不变)
+        if RESIZE_OUTPUT and original_image_size:
+            original_width, original_height = original_image_size
+            if original_width > 0 and original_height > 0:
+                # 保持输出图像的宽度不变，根据原始宽高比调整高度
+                original_aspect = original_height / float(original_width)
+                target_height = max(1, int(img_width * original_aspect))
+                try:
+                    resample_filter = Image.Resampling.LANCZOS # 高质量重采样
+                except AttributeError:
+                    resample_filter = Image.LANCZOS # 兼容旧版 Pillow
+                try:
+                    # 注意：这个 print 语句可能在子进程中执行，输出会混合
+                    # print(f"    调整 PNG 大小为 {img_width}x{target_height} 以匹配原始宽高比...")
+                    output_image = output_image.resize((img_width, target_height), resample_filter)
+                except Exception as resize_err:
+                    print(f"警告: 调整大小失败: {resize_err}. 使用原始渲染大小。")
+            else:
+                print("警告：无法调整大小，原始图像尺寸无效。")
+        elif RESIZE_OUTPUT:
+            print("警告：请求调整大小但未提供原始图像尺寸。")
+
+        # 保存图像 (代码不变)
+        output_image.save(output_path)
+        return True
+
+    except Exception as e:
+        print(f"在路径 '{output_path}' 为主题 '{theme_name}' 创建或保存 PNG 时出错: {e}")
+        # traceback.print_exc() # 在子进程中打印完整的traceback可能比较混乱
+        return False
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+stdin/stdout 管道模式 (ASCII.py 和 pixel.py 的 --pipe 共用)。
+
+- 不分帧: stdin 的全部字节是一张图像，结果直接写到 stdout；失败时不输出任何字节。
+- 分帧 (--framed): 输入和输出都是连续的帧，每帧为 8 字节大端无符号长度 + 数据。
+  每个输入帧对应一个输出帧 (顺序相同)，失败的图像输出长度为 0 的帧，下游可以按顺序对应。
+
+数据只在内存中传递，不创建临时文件；日志写到 stderr，stdout 只有输出数据。
+本模块不依赖 ASCII.py 和 pixel.py: 渲染函数由调用方传入。
+"""
+import os
+import sys
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('>Q') # 帧头: 8 字节大端无符号长度
+MAX_FRAME_BYTES = 1 << 31 # 单帧上限 (2 GB)，防止把错误的数据流当作帧长度分配内存
+
+
+def read_exactly(stream, size):
+    """从 stream 读取 size 字节 (管道可能分多次返回)；遇到 EOF 时返回已读到的部分。"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def iter_input_images(stream, framed):
+    """
+    逐个返回 stream 中的图像字节。不分帧时整个 stream 是一张图像 (为空时不返回任何图像)。
+    分帧数据在帧边界处结束时正常停止；帧头或数据不完整、长度超过 MAX_FRAME_BYTES 时抛出 ValueError。
+    """
+    if not framed:
+        data = stream.read()
+        if data:
+            yield data
+        return
+    while True:
+        header = read_exactly(stream, FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise ValueError(f"帧头不完整 ({len(header)}/{FRAME_HEADER.size} 字节)")
+        (size,) = FRAME_HEADER.unpack(header)
+        if size > MAX_FRAME_BYTES:
+            raise ValueError(f"帧长度 {size} 超过上限 {MAX_FRAME_BYTES} (输入可能不是分帧数据)")
+        data = read_exactly(stream, size)
+        if len(data) < size:
+            raise ValueError(f"帧数据不完整 ({len(data)}/{size} 字节)")
+        yield data
+
+
+def write_output(stream, data, framed):
+    """把一个结果写到 stream 并立即 flush (分帧时先写帧头)，下游可以边收边处理。"""
+    if framed:
+        stream.write(FRAME_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def run_pipe(render, framed, input_stream=None, output_stream=None):
+    """
+    从 input_stream (默认 stdin) 读取图像，对每张图像调用 render(图像字节) -> 输出字节或 None (失败)，
+    结果写到 output_stream (默认 stdout)。下游提前关闭管道 (如 head) 时停止读取。
+    返回 {'images_total': 读取的图像数, 'images_failed': 失败数 (含无法解析的输入帧)}。
+    """
+    input_stream = input_stream if input_stream is not None else sys.stdin.buffer
+    output_stream = output_stream if output_stream is not None else sys.stdout.buffer
+    results = {'images_total': 0, 'images_failed': 0}
+    try:
+        for image_bytes in iter_input_images(input_stream, framed):
+            results['images_total'] += 1
+            output = render(image_bytes)
+            if output is None:
+                results['images_failed'] += 1
+                if framed:
+                    write_output(output_stream, b'', framed) # 空帧占位，保持输入输出一一对应
+                continue
+            write_output(output_stream, output, framed)
+    except ValueError as e:
+        logger.error(f"无法读取输入帧: {e}")
+        results['images_failed'] += 1
+    except BrokenPipeError:
+        logger.debug("下游已关闭管道，停止处理。")
+        if output_stream is sys.stdout.buffer:
+            # 解释器退出时还会 flush stdout，指向 devnull 避免再次报 BrokenPipeError
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return results
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+--metrics-file: 目录中有内容重复的图像时，导出的指标必须与处理摘要 (process_directory 的结果) 一致。
+"""
+import os
+import sys
+import shutil
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ASCII # noqa: E402
+import batch_metrics # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THEMES = ["dark", "light"]
+WIDTHS = [24, 40]
+FILTER_SETTINGS = {"enable_filter": False, "filter_type": "gaussian", "filter_gaussian_radius": 1.0,
+                   "filter_median_size": 3, "tone_map": None}
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    directory = tmp_path / "imgs"
+    directory.mkdir()
+    Image.linear_gradient('L').resize((120, 80)).convert('RGB').save(directory / "gradient.png")
+    Image.new('RGB', (60, 90), (200, 40, 90)).save(directory / "red.png")
+    shutil.copy(directory / "red.png", directory / "red_copy.png")
+    shutil.copy(directory / "red.png", directory / "red_copy2.png")
+    return str(directory)
+
+
+@pytest.mark.parametrize('output_archive', [None, 'zip'])
+def test_metrics_count_deduplicated_images(image_dir, output_archive):
+    metrics = batch_metrics.BatchMetrics()
+    results = ASCII.process_directory(image_dir, {'type': 'default'}, ASCII.COLOR_THEMES, WIDTHS, FILTER_SETTINGS,
+                                      os.path.join(REPO_DIR, "config.ini"), THEMES, metrics=metrics,
+                                      output_archive=output_archive)
+
+    outputs_per_image = len(THEMES) * len(WIDTHS)
+    assert results['processed_files'] == 4
+    assert results['renders_saved'] == 2
+    assert results['total_success'] == 4 * outputs_per_image
+    assert metrics.images_planned == results['processed_files']
+    assert metrics.images_deduplicated == results['renders_saved']
+    assert sum(metrics.image_counts.values()) == results['processed_files']
+    assert metrics.output_counts['success'] == results['total_success']
+    assert metrics.output_counts['failed'] == results['total_failed']
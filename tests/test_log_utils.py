@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+log_utils: 工作进程继承的进度行副本不能被重新绘制 (否则终端上的进度会倒退)。
+"""
+import io
+import os
+import sys
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log_utils # noqa: E402
+
+
+class _FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.fixture(autouse=True)
+def restore_logging(monkeypatch):
+    monkeypatch.setenv('TERM', 'xterm')
+    monkeypatch.setattr(log_utils, '_active_progress', None)
+    monkeypatch.setattr(log_utils, '_worker_erases_line', False)
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    yield
+    root.handlers[:] = saved_handlers
+    root.setLevel(saved_level)
+
+
+def _use_terminal(monkeypatch):
+    # pytest 在测试函数运行前会重新替换 sys.stderr，所以在测试函数内部替换
+    terminal = _FakeTerminal()
+    monkeypatch.setattr(sys, 'stderr', terminal)
+    return terminal
+
+
+def test_worker_does_not_redraw_inherited_progress(monkeypatch):
+    terminal = _use_terminal(monkeypatch)
+    log_utils.setup_logging(0)
+    progress = log_utils.ProgressLine(total=5, label="处理图像", stream=terminal)
+    with progress:
+        # 模拟进程池在进度行显示期间 fork 出的工作进程 (继承了 _active_progress)
+        log_utils.init_worker_logging(logging.INFO)
+        terminal.seek(0)
+        terminal.truncate()
+        logging.getLogger("worker").error("图像损坏")
+        output = terminal.getvalue()
+    assert output.startswith(log_utils.ERASE_LINE) # 擦除主进程的进度行
+    assert "处理图像" not in output # 不重新绘制过期的进度
+    assert "图像损坏" in output
+    assert log_utils._active_progress is None
+
+
+def test_main_process_redraws_progress_after_log(monkeypatch):
+    terminal = _use_terminal(monkeypatch)
+    log_utils.setup_logging(0)
+    with log_utils.ProgressLine(total=5, label="处理图像", stream=terminal) as progress:
+        progress.update(done=2)
+        terminal.seek(0)
+        terminal.truncate()
+        logging.getLogger("main").warning("提示")
+        output = terminal.getvalue()
+    assert output.index("提示") < output.index("处理图像 2/5")
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+pixel.py 分块流式模式 (--tiled) 与整图处理的一致性: 尺寸不能被像素块整除时输出也必须逐像素相同。
+"""
+import os
+import sys
+import random
+
+import pytest
+from PIL import Image, ImageChops
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pixel # noqa: E402
+
+SIZES = [(1003, 757), (1000, 750), (333, 251)]
+PIXEL_SIZES = [3, 8, 13]
+
+
+def _noise_image(width, height):
+    rng = random.Random(width * 7919 + height)
+    return Image.frombytes('RGB', (width, height), bytes(rng.getrandbits(8) for _ in range(width * height * 3)))
+
+
+def _assert_same_pixels(expected_path, actual_path):
+    with Image.open(expected_path) as expected, Image.open(actual_path) as actual:
+        expected_rgb, actual_rgb = expected.convert('RGB'), actual.convert('RGB')
+    assert expected_rgb.size == actual_rgb.size
+    assert ImageChops.difference(expected_rgb, actual_rgb).getbbox() is None
+
+
+@pytest.fixture(autouse=True)
+def small_strips(monkeypatch):
+    # 很小的条带，使每张测试图片都被分成许多条带
+    monkeypatch.setattr(pixel, 'TILED_STRIP_TARGET_PIXELS', 3000)
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('extension', ['.bmp', '.png']) # BMP 按行读取，PNG 整张解码后分条
+@pytest.mark.parametrize('sampling', pixel.SAMPLING_MODES)
+@pytest.mark.parametrize('output_mode', pixel.OUTPUT_MODES)
+def test_tiled_matches_in_memory(tmp_path, size, extension, sampling, output_mode):
+    source_path = str(tmp_path / f"source{extension}")
+    _noise_image(*size).save(source_path)
+    for pixel_size in PIXEL_SIZES:
+        expected_path = str(tmp_path / f"expected_{pixel_size}.png")
+        actual_path = str(tmp_path / f"tiled_{pixel_size}.png")
+        assert pixel.pixelate_image(source_path, expected_path, pixel_size, output_mode, sampling=sampling)
+        assert pixel.pixelate_image(source_path, actual_path, pixel_size, output_mode, sampling=sampling, tiled=True)
+        _assert_same_pixels(expected_path, actual_path)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'P'])
+def test_streaming_upscale_matches_resize(tmp_path, mode):
+    small_img = _noise_image(125, 94)
+    if mode == 'P':
+        small_img = pixel.quantize_small_image(small_img, ('fixed', 'pico8'))
+    output_path = str(tmp_path / "streamed.png")
+    pixel.write_upscaled_png_streaming(small_img, output_path, 1003, 757)
+    expected_path = str(tmp_path / "resized.png")
+    small_img.resize((1003, 757), pixel.NEAREST).save(expected_path)
+    _assert_same_pixels(expected_path, output_path)
+
+
+def test_tiled_does_not_change_global_pixel_limit(tmp_path):
+    source_path = str(tmp_path / "source.bmp")
+    _noise_image(64, 48).save(source_path)
+    limit = Image.MAX_IMAGE_PIXELS
+    assert pixel.pixelate_image(source_path, str(tmp_path / "out.png"), 8, tiled=True)
+    assert Image.MAX_IMAGE_PIXELS == limit
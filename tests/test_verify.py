@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+ASCII.py --verify: 未修改的代码树用参考实现 (reference_engine.py) 校验时必须完全一致 (像素容差 0)。
+"""
+import os
+import sys
+import random
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ASCII # noqa: E402
+import dithering # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEJAVU_MONO = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"
+FONT_INFOS = [{'type': 'default'}]
+if os.path.exists(DEJAVU_MONO):
+    FONT_INFOS.append({'type': 'truetype', 'path': DEJAVU_MONO, 'size': 12})
+
+
+@pytest.fixture(scope="module")
+def sample_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("verify_inputs")
+    rng = random.Random(46)
+    Image.frombytes('RGB', (173, 121), bytes(rng.getrandbits(8) for _ in range(173 * 121 * 3))).save(directory / "noise.png")
+    Image.linear_gradient('L').resize((300, 200)).convert('RGB').save(directory / "gradient.jpg")
+    Image.new('RGBA', (90, 140), (200, 40, 90, 128)).save(directory / "rgba.png")
+    return str(directory)
+
+
+@pytest.mark.parametrize('font_info', FONT_INFOS, ids=lambda info: info['type'])
+@pytest.mark.parametrize('dither_mode', ['none', 'bayer'])
+def test_clean_tree_verifies_consistent(sample_dir, font_info, dither_mode):
+    # 使用随仓库提供的 config.ini (主题、滤波)，宽度改小以缩短运行时间
+    config = ASCII.load_config(os.path.join(REPO_DIR, "config.ini"))
+    filter_settings = {
+        "enable_filter": config["enable_filter"],
+        "filter_type": config["filter_type"],
+        "filter_gaussian_radius": config["filter_gaussian_radius"],
+        "filter_median_size": config["filter_median_size"],
+        "tone_map": None,
+    }
+    offsets = dithering.threshold_offsets(dither_mode, len(ASCII.ASCII_CHARS))
+    dither_settings = {"dither_mode": dither_mode, "offsets": offsets} if offsets is not None else None
+    themes = sorted(set(config["themes_to_generate"]) | {"dark", "original_dark_bg"})
+
+    results = ASCII.verify_engines(sample_dir, font_info, ASCII.COLOR_THEMES, [40, 96], filter_settings, themes,
+                                   dither_settings=dither_settings, pixel_tolerance=0)
+
+    assert results['verify_cases'] == 3 * 2 * len(themes)
+    assert results['verify_mismatches'] == []
+    assert results['verify_grid_mismatches'] == 0
+    assert results['verify_png_mismatches'] == 0
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+字符网格上的自适应色调映射 (ASCII.py 使用)。
+
+在点采样得到的灰度网格 (每格的 R+G+B 之和，0..765) 上重新分配灰度，再映射到字符，
+低对比度的照片也能用到梯度中的全部字符。只改变字符的选择，采样颜色 (彩色主题) 不变。
+所有计算都在字符网格上进行，耗时与网格大小成正比，与源图像大小无关。
+
+- autocontrast: 全局自动色阶，两端各裁掉 clip_percent% 的格子后线性拉伸到全范围
+- equalize:     全局直方图均衡
+- clahe:        限制对比度的自适应直方图均衡 (CLAHE): 网格分成 tiles x tiles 块，
+                每块单独均衡 (直方图按 clip_limit 截断后把超出部分平均分配)，块之间双线性插值
+"""
+
+TONE_MODES = ('none', 'autocontrast', 'equalize', 'clahe')
+RGB_SUM_MAX = 765 # R+G+B 之和的最大值
+DEFAULT_CLIP_PERCENT = 0.5 # autocontrast 两端各裁掉的格子百分比
+DEFAULT_CLAHE_TILES = 8 # clahe 每个方向的分块数
+DEFAULT_CLAHE_CLIP_LIMIT = 2.0 # clahe 直方图截断值 (相对于每个灰度级的平均格数)
+CLAHE_BINS = 256 # clahe 直方图的灰度级数 (R+G+B 之和 // 3)
+
+
+def _histogram(values, bins):
+    histogram = [0] * bins
+    for value in values:
+        histogram[value] += 1
+    return histogram
+
+
+def _clamp_lut(lut):
+    return [0 if value < 0 else RGB_SUM_MAX if value > RGB_SUM_MAX else value for value in lut]
+
+
+def autocontrast_lut(rgb_sums, clip_percent=DEFAULT_CLIP_PERCENT):
+    """返回自动色阶的查找表 (R+G+B 之和 -> 新的和)；网格只有一个灰度时返回 None (不需要映射)。"""
+    histogram = _histogram(rgb_sums, RGB_SUM_MAX + 1)
+    cutoff = len(rgb_sums) * clip_percent / 100.0
+    low, count = 0, 0
+    for low, bin_count in enumerate(histogram):
+        count += bin_count
+        if count > cutoff:
+            break
+    high, count = RGB_SUM_MAX, 0
+    for high in range(RGB_SUM_MAX, -1, -1):
+        count += histogram[high]
+        if count > cutoff:
+            break
+    if high <= low:
+        return None
+    scale = RGB_SUM_MAX / float(high - low)
+    return _clamp_lut([round((value - low) * scale) for value in range(RGB_SUM_MAX + 1)])
+
+
+def equalize_lut(rgb_sums):
+    """返回全局直方图均衡的查找表；网格只有一个灰度时返回 None。"""
+    histogram = _histogram(rgb_sums, RGB_SUM_MAX + 1)
+    total = len(rgb_sums)
+    cdf_min = next(bin_count for bin_count in histogram if bin_count)
+    if total == cdf_min:
+        return None
+    scale = RGB_SUM_MAX / float(total - cdf_min)
+    lut, cumulative = [], 0
+    for bin_count in histogram:
+        cumulative += bin_count
+        lut.append(max(0, round((cumulative - cdf_min) * scale)))
+    return lut
+
+
+def _clahe_tile_lut(tile_bins, clip_limit):
+    """单个分块的均衡查找表 (灰度级 -> R+G+B 之和)，直方图先截断再把超出部分平均分配到各级。"""
+    histogram = _histogram(tile_bins, CLAHE_BINS)
+    total = len(tile_bins)
+    # 字符网格的分块通常只有几十到几百格，截断值和分配量用小数，平坦的分块映射后接近原值
+    limit = clip_limit * total / float(CLAHE_BINS)
+    excess = sum(bin_count - limit for bin_count in histogram if bin_count > limit)
+    bonus = excess / CLAHE_BINS
+    lut, cumulative = [], 0.0
+    for bin_count in histogram:
+        cumulative += min(bin_count, limit) + bonus
+        lut.append(cumulative * RGB_SUM_MAX / total)
+    return lut
+
+
+def _tile_interpolation(size, tiles):
+    """每个位置 (行或列) 的插值参数 (前一块, 后一块, 后一块的权重)，按块中心线性插值，边缘处不外推。"""
+    bounds = [size * i // tiles for i in range(tiles + 1)]
+    centers = [(bounds[i] + bounds[i + 1]) / 2.0 for i in range(tiles)]
+    params = []
+    tile = 0
+    for position in range(size):
+        center = position + 0.5
+        while tile < tiles - 1 and centers[tile + 1] <= center:
+            tile += 1
+        if center <= centers[0]:
+            params.append((0, 0, 0.0))
+        elif tile == tiles - 1:
+            params.append((tile, tile, 0.0))
+        else:
+            params.append((tile, tile + 1, (center - centers[tile]) / (centers[tile + 1] - centers[tile])))
+    return bounds, params
+
+
+def clahe(rgb_sums, width, height, tiles=DEFAULT_CLAHE_TILES, clip_limit=DEFAULT_CLAHE_CLIP_LIMIT):
+    """对 width x height 的网格 (按行排列的 R+G+B 之和) 做 CLAHE，返回新的列表。"""
+    tiles_x = max(1, min(tiles, width))
+    tiles_y = max(1, min(tiles, height))
+    levels = [value // 3 for value in rgb_sums]
+    x_bounds, x_params = _tile_interpolation(width, tiles_x)
+    y_bounds, y_params = _tile_interpolation(height, tiles_y)
+
+    luts = []
+    for tile_y in range(tiles_y):
+        row_luts = []
+        for tile_x in range(tiles_x):
+            tile_levels = []
+            for y in range(y_bounds[tile_y], y_bounds[tile_y + 1]):
+                tile_levels.extend(levels[y * width + x_bounds[tile_x]:y * width + x_bounds[tile_x + 1]])
+            row_luts.append(_clahe_tile_lut(tile_levels, clip_limit))
+        luts.append(row_luts)
+
+    mapped = []
+    for y in range(height):
+        top, bottom, weight_y = y_params[y]
+        top_luts, bottom_luts = luts[top], luts[bottom]
+        row = levels[y * width:(y + 1) * width]
+        for x, level in enumerate(row):
+            left, right, weight_x = x_params[x]
+            upper = top_luts[left][level] + weight_x * (top_luts[right][level] - top_luts[left][level])
+            lower = bottom_luts[left][level] + weight_x * (bottom_luts[right][level] - bottom_luts[left][level])
+            value = round(upper + weight_y * (lower - upper))
+            mapped.append(0 if value < 0 else RGB_SUM_MAX if value > RGB_SUM_MAX else value)
+    return mapped
+
+
+def apply_tone_map(rgb_sums, width, height, tone_settings):
+    """
+    按 tone_settings ({'tone_mode', 'clip_percent', 'clahe_tiles', 'clahe_clip_limit'}) 映射灰度网格，
+    返回新的 R+G+B 之和列表。tone_settings 为 None 或模式为 'none' 时原样返回。
+    """
+    mode = tone_settings['tone_mode'] if tone_settings else 'none'
+    if mode == 'none' or not rgb_sums:
+        return rgb_sums
+    if mode == 'clahe':
+        return clahe(rgb_sums, width, height,
+                     tone_settings.get('clahe_tiles', DEFAULT_CLAHE_TILES),
+                     tone_settings.get('clahe_clip_limit', DEFAULT_CLAHE_CLIP_LIMIT))
+    if mode == 'autocontrast':
+        lut = autocontrast_lut(rgb_sums, tone_settings.get('clip_percent', DEFAULT_CLIP_PERCENT))
+    elif mode == 'equalize':
+        lut = equalize_lut(rgb_sums)
+    else:
+        raise ValueError(f"未知的色调映射模式: {mode} (可选: {', '.join(TONE_MODES)})")
+    return rgb_sums if lut is None else list(map(lut.__getitem__, rgb_sums))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+优化实现与参考实现的一致性校验 (ASCII.py --verify 使用)。
+
+对同一输入分别运行参考实现 (reference_engine.py: 基线版本 ASCII.py 中逐像素的 image_to_ascii / create_ascii_png)
+和优化实现，字符网格 (字符和采样颜色) 必须完全一致；渲染出的 PNG 逐像素比较，
+各通道差值不超过容差的像素视为一致 (文本绘制方式不同时可能有抗锯齿上的细微差别)。
+
+本模块不依赖 ASCII.py: 两种实现的调用由调用方完成，这里只负责比较和计时。
+"""
+import time
+import logging
+
+from PIL import Image, ImageChops
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 8 # 校验使用的图像数
+DEFAULT_PIXEL_TOLERANCE = 0 # 每个像素各通道允许的最大差值 (0-255)
+MAX_REPORTED_MISMATCHES = 20 # 摘要中最多列出的不一致项
+
+
+def timed(func, *args, **kwargs):
+    """调用 func，返回 (返回值, 耗时秒数)。"""
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+def compare_grids(reference, optimized):
+    """
+    比较两个字符网格 (list[list[(字符, (R, G, B))]])。
+    完全一致时返回 None，否则返回描述第一处差异和差异格数的字符串。
+    """
+    if reference is None or optimized is None:
+        return f"网格生成失败 (参考: {'失败' if reference is None else '成功'}，优化: {'失败' if optimized is None else '成功'})"
+    ref_shape = (len(reference), len(reference[0]) if reference else 0)
+    opt_shape = (len(optimized), len(optimized[0]) if optimized else 0)
+    if ref_shape != opt_shape:
+        return f"网格尺寸不同 (参考 {ref_shape[1]}x{ref_shape[0]}，优化 {opt_shape[1]}x{opt_shape[0]})"
+    first = None
+    mismatched = 0
+    for row_index, (ref_row, opt_row) in enumerate(zip(reference, optimized)):
+        if ref_row == opt_row:
+            continue
+        for col_index, (ref_cell, opt_cell) in enumerate(zip(ref_row, opt_row)):
+            if (ref_cell[0], tuple(ref_cell[1])) != (opt_cell[0], tuple(opt_cell[1])):
+                mismatched += 1
+                if first is None:
+                    first = (row_index, col_index, ref_cell, opt_cell)
+    if first is None:
+        return None
+    row_index, col_index, ref_cell, opt_cell = first
+    return (f"{mismatched} 个字符格不同，第一处在第 {row_index} 行第 {col_index} 列: "
+            f"参考 {ref_cell[0]!r} {tuple(ref_cell[1])}，优化 {opt_cell[0]!r} {tuple(opt_cell[1])}")
+
+
+def compare_images(reference_path, optimized_path, tolerance=DEFAULT_PIXEL_TOLERANCE):
+    """
+    逐像素比较两个 PNG 文件。某个通道差值超过 tolerance 的像素计为不一致。
+    返回 {'size_match': 尺寸是否相同, 'max_diff': 最大通道差值, 'mismatched_pixels': 不一致像素数,
+          'total_pixels': 像素总数}。
+    """
+    with Image.open(reference_path) as reference_img, Image.open(optimized_path) as optimized_img:
+        reference_rgb = reference_img.convert('RGB')
+        optimized_rgb = optimized_img.convert('RGB')
+    if reference_rgb.size != optimized_rgb.size:
+        return {'size_match': False, 'max_diff': None, 'mismatched_pixels': None,
+                'total_pixels': reference_rgb.size[0] * reference_rgb.size[1]}
+    # 每个像素取三个通道差值中的最大值
+    red, green, blue = ImageChops.difference(reference_rgb, optimized_rgb).split()
+    pixel_diff = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    return {
+        'size_match': True,
+        'max_diff': pixel_diff.getextrema()[1],
+        'mismatched_pixels': sum(pixel_diff.histogram()[tolerance + 1:]),
+        'total_pixels': reference_rgb.size[0] * reference_rgb.size[1],
+    }
+
+
+def describe_image_mismatch(comparison, tolerance):
+    """compare_images 的结果在容差内时返回 None，否则返回描述字符串。"""
+    if not comparison['size_match']:
+        return "PNG 尺寸不同"
+    if comparison['mismatched_pixels'] == 0:
+        return None
+    return (f"{comparison['mismatched_pixels']}/{comparison['total_pixels']} 个像素超出容差 {tolerance} "
+            f"(最大差值 {comparison['max_diff']})")
+
+
+def speedup(reference_seconds, optimized_seconds):
+    """返回参考耗时 / 优化耗时 (优化耗时为 0 时返回 None)。"""
+    if optimized_seconds <= 0:
+        return None
+    return reference_seconds / optimized_seconds